@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+"""
+Local stand-ins for the secrets management backends.
+
+They speak enough of each backend protocol for the managers to work
+unmodified: a Secrets Manager JSON endpoint for boto3, a Vault HTTP
+server for hvac and a stub `bw` executable for the Bitwarden CLI.
+Every stand-in has a configurable latency added to each request and can
+fail a share of them as an unavailable backend would. The local backend
+gets a real directory of secret files.
+"""
+
+import json
+import os
+import random
+import stat
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_SESSION_KEY = "fake-session-key"
+FAKE_VAULT_TOKEN = "fake-vault-token"
+FAKE_BW_EMAIL = "bench@example.com"
+
+
+def make_secrets(count: int) -> dict:
+    """Builds `count` services with a username, a password and an api token each."""
+    return {
+        f"service-{i}": {
+            "username": f"user-{i}",
+            "password": f"password-{i}",
+            "api-token": f"token-{i}",
+        }
+        for i in range(count)
+    }
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    """Base handler replying JSON documents over keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, document: dict, content_type="application/json"):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+
+class _FakeServer:
+    """Runs a handler class on a local port in a background thread."""
+
+    handler_class = _JsonHandler
+
+    def __init__(self, secrets: dict, latency: float = 0.0, failure_rate: float = 0.0):
+        self.secrets = secrets
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._httpd = None
+        self._thread = None
+
+    def should_fail(self) -> bool:
+        """Whether to answer the current request as an unavailable backend."""
+        return self.failure_rate > 0 and random.random() < self.failure_rate
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        server = self
+
+        class Handler(self.handler_class):
+            fake = server
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+class _SecretsManagerHandler(_JsonHandler):
+
+    def do_POST(self):
+        self.fake.requests += 1
+        time.sleep(self.fake.latency)
+        target = self.headers.get("X-Amz-Target", "")
+        request = json.loads(self._read_body() or b"{}")
+        operation = target.split(".")[-1]
+
+        if self.fake.should_fail():
+            self._reply(
+                503,
+                {"__type": "ServiceUnavailable", "message": "Injected failure"},
+                "application/x-amz-json-1.1",
+            )
+        elif operation == "GetSecretValue":
+            name = request.get("SecretId")
+            if name not in self.fake.secrets:
+                self._reply(
+                    400,
+                    {
+                        "__type": "ResourceNotFoundException",
+                        "message": "Secrets Manager can't find the specified secret.",
+                    },
+                    "application/x-amz-json-1.1",
+                )
+                return
+            self._reply(
+                200,
+                {
+                    "ARN": f"arn:aws:secretsmanager:us-east-1:000000000000:secret:{name}",
+                    "Name": name,
+                    "VersionId": "00000000-0000-0000-0000-000000000001",
+                    "SecretString": json.dumps(self.fake.secrets[name]),
+                    "VersionStages": ["AWSCURRENT"],
+                },
+                "application/x-amz-json-1.1",
+            )
+        else:
+            self._reply(
+                400,
+                {"__type": "InvalidRequestException", "message": f"Unsupported {operation}"},
+                "application/x-amz-json-1.1",
+            )
+
+
+class FakeSecretsManager(_FakeServer):
+    """Secrets Manager endpoint answering GetSecretValue."""
+
+    handler_class = _SecretsManagerHandler
+
+    def environ(self) -> dict:
+        """Environment variables pointing boto3 to this endpoint."""
+        return {
+            "AWS_ENDPOINT_URL_SECRETS_MANAGER": self.url,
+            "AWS_ACCESS_KEY_ID": "fake",
+            "AWS_SECRET_ACCESS_KEY": "fake",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+
+class _VaultHandler(_JsonHandler):
+
+    def do_GET(self):
+        self.fake.requests += 1
+        time.sleep(self.fake.latency)
+        path = self.path.split("?")[0]
+
+        if path.startswith("/v1/secret/") and self.fake.should_fail():
+            self._reply(503, {"errors": ["injected failure"]})
+        elif self.headers.get("X-Vault-Token") != FAKE_VAULT_TOKEN and path != "/v1/sys/init":
+            self._reply(403, {"errors": ["permission denied"]})
+        elif path == "/v1/sys/init":
+            self._reply(200, {"initialized": True})
+        elif path == "/v1/auth/token/lookup-self":
+            self._reply(200, {"data": {"id": FAKE_VAULT_TOKEN, "ttl": 0, "renewable": False}})
+        elif path.startswith("/v1/secret/data/"):
+            name = path[len("/v1/secret/data/"):]
+            if name not in self.fake.secrets:
+                self._reply(404, {"errors": []})
+                return
+            self._reply(
+                200,
+                {
+                    "data": {
+                        "data": self.fake.secrets[name],
+                        "metadata": {"version": 1, "destroyed": False, "deletion_time": ""},
+                    },
+                    "lease_duration": 0,
+                    "lease_id": "",
+                    "renewable": False,
+                },
+            )
+        else:
+            self._reply(404, {"errors": []})
+
+
+class FakeVault(_FakeServer):
+    """Vault server exposing a KV v2 engine mounted at secret/."""
+
+    handler_class = _VaultHandler
+
+
+_BW_STUB = """#!{python}
+import json
+import random
+import sys
+import time
+
+with open({state!r}) as fd:
+    state = json.load(fd)
+time.sleep(state["latency"])
+
+args = sys.argv[1:]
+command = args[0] if args else ""
+
+if command in ("sync", "get", "list") and random.random() < state["failure_rate"]:
+    sys.stderr.write("Injected failure")
+    sys.exit(1)
+elif command == "status":
+    print(json.dumps({{"status": "unlocked", "userEmail": state["email"],
+                      "sessionKey": state["session_key"]}}))
+elif command in ("unlock", "login"):
+    print(state["session_key"])
+elif command == "sync":
+    pass
+elif command == "get" and args[1] == "item":
+    for item in state["items"]:
+        if item["name"] == args[2] or item["id"] == args[2]:
+            print(json.dumps(item))
+            break
+    else:
+        sys.stderr.write("Not found.")
+        sys.exit(1)
+elif command == "list" and args[1] == "items":
+    print(json.dumps(state["items"]))
+elif command == "list" and args[1] in ("folders", "collections"):
+    print("[]")
+else:
+    sys.stderr.write("Invalid command: " + command)
+    sys.exit(1)
+"""
+
+
+class FakeBitwardenCli:
+    """Stub `bw` executable serving items from a state file."""
+
+    def __init__(self, secrets: dict, latency: float = 0.0, failure_rate: float = 0.0):
+        self.secrets = secrets
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._directory = None
+        self.path = None
+
+    def _items(self) -> list:
+        items = []
+        for i, (name, credentials) in enumerate(sorted(self.secrets.items())):
+            items.append({
+                "id": f"00000000-0000-0000-0000-{i:012d}",
+                "name": name,
+                "revisionDate": "2024-01-01T00:00:00.000Z",
+                "login": {
+                    "username": credentials.get("username"),
+                    "password": credentials.get("password"),
+                },
+                "fields": [
+                    {"name": key, "value": value, "type": 1}
+                    for key, value in credentials.items()
+                    if key not in ("username", "password")
+                ],
+            })
+        return items
+
+    def start(self):
+        self._directory = tempfile.TemporaryDirectory(prefix="enigma-fake-bw-")
+        state_path = os.path.join(self._directory.name, "state.json")
+        with open(state_path, "w") as fd:
+            json.dump({
+                "latency": self.latency,
+                "failure_rate": self.failure_rate,
+                "email": FAKE_BW_EMAIL,
+                "session_key": FAKE_SESSION_KEY,
+                "items": self._items(),
+            }, fd)
+
+        self.path = os.path.join(self._directory.name, "bw")
+        with open(self.path, "w") as fd:
+            fd.write(_BW_STUB.format(python=sys.executable, state=state_path))
+        os.chmod(self.path, os.stat(self.path).st_mode | stat.S_IXUSR)
+        return self
+
+    def stop(self):
+        if self._directory:
+            self._directory.cleanup()
+            self._directory = None
+
+    def environ(self) -> dict:
+        """Environment variables pointing BitwardenManager to this stub."""
+        return {
+            "GRIMOIRELAB_ENIGMA_BW_PATH": self.path,
+            "GRIMOIRELAB_ENIGMA_BW_EMAIL": FAKE_BW_EMAIL,
+            "GRIMOIRELAB_ENIGMA_BW_PASSWORD": "fake-password",
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+class LocalSecrets:
+    """Directory with a JSON file per service, as mounted by an orchestrator."""
+
+    def __init__(self, secrets: dict):
+        self.secrets = secrets
+        self._directory = None
+        self.path = None
+
+    def start(self):
+        self._directory = tempfile.TemporaryDirectory(prefix="enigma-local-")
+        self.path = self._directory.name
+        for name, credentials in self.secrets.items():
+            with open(os.path.join(self.path, f"{name}.json"), "w") as fd:
+                json.dump(credentials, fd)
+        return self
+
+    def stop(self):
+        if self._directory:
+            self._directory.cleanup()
+            self._directory = None
+
+    def environ(self) -> dict:
+        """Environment variables pointing LocalManager to this directory."""
+        return {"GRIMOIRELAB_ENIGMA_LOCAL_PATH": self.path}
+
+
+class StandIns:
+    """Starts the stand-ins and exposes the environment to reach them."""
+
+    def __init__(
+        self, secrets: dict, latency: float = 0.0, bw_latency: float = None, failure_rate: float = 0.0
+    ):
+        self.aws = FakeSecretsManager(secrets, latency, failure_rate)
+        self.vault = FakeVault(secrets, latency, failure_rate)
+        self.bw = FakeBitwardenCli(secrets, latency if bw_latency is None else bw_latency, failure_rate)
+        self.local = LocalSecrets(secrets)
+
+    def environ(self) -> dict:
+        env = {}
+        env.update(self.aws.environ())
+        env.update(self.bw.environ())
+        env.update(self.local.environ())
+        env.update({
+            "GRIMOIRELAB_ENIGMA_VAULT_ADDR": self.vault.url,
+            "GRIMOIRELAB_ENIGMA_VAULT_TOKEN": FAKE_VAULT_TOKEN,
+            "GRIMOIRELAB_ENIGMA_VAULT_CACERT": "none",
+        })
+        return env
+
+    def __enter__(self):
+        self.aws.start()
+        self.vault.start()
+        self.bw.start()
+        self.local.start()
+        self._saved = {key: os.environ.get(key) for key in self.environ()}
+        os.environ.update(self.environ())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for key, value in self._saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        self.aws.stop()
+        self.vault.stop()
+        self.bw.stop()
+        self.local.stop()
+        return False
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+"""
+Micro-benchmarks for the secrets managers.
+
+Every manager is exercised against the local stand-ins in fakes.py:
+
+- single: repeated lookups of the same credential
+- batch: lookups of every credential of a set of services
+- warm_start: building a manager and doing its first lookup in a process
+  that already did it once
+- cold_start: the same in a fresh interpreter, imports included
+
+Results are written as JSON and compared against a stored baseline. A
+benchmark regresses when its median is slower than the baseline median
+by more than the tolerance.
+
+    $ python -m benchmarks --output bench_output.json
+    $ python -m benchmarks --update-baseline
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from .fakes import StandIns, make_secrets
+
+BACKENDS = ("aws", "hashicorp", "bitwarden", "local")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+CREDENTIALS = ("username", "password", "api-token")
+
+
+def _quiet_logging():
+    """Keeps log records from being written while timing."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.NullHandler())
+
+
+def _new_manager(backend: str):
+    from enigma import SecretsManagerFactory
+
+    SecretsManagerFactory.clear()
+    if backend == "aws":
+        return SecretsManagerFactory.get_aws_manager()
+    elif backend == "hashicorp":
+        return SecretsManagerFactory.get_hashicorp_manager()
+    elif backend == "bitwarden":
+        return SecretsManagerFactory.get_bitwarden_manager()
+    elif backend == "local":
+        return SecretsManagerFactory.get_local_manager()
+    raise ValueError(f"Unknown backend {backend}")
+
+
+def _summary(samples: list) -> dict:
+    """Summarizes timings given in seconds as milliseconds."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "samples": len(samples),
+        "min_ms": ordered[0] * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p95_ms": p95 * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def bench_single(backend: str, iterations: int) -> list:
+    manager = _new_manager(backend)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        manager.get_secret("service-0", "password")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_batch(backend: str, iterations: int, services: int) -> list:
+    manager = _new_manager(backend)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for i in range(services):
+            for credential in CREDENTIALS:
+                manager.get_secret(f"service-{i}", credential)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_warm_start(backend: str, iterations: int) -> list:
+    _new_manager(backend).get_secret("service-0", "password")
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        _new_manager(backend).get_secret("service-0", "password")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_cold_start(backend: str, iterations: int) -> list:
+    samples = []
+    command = [sys.executable, "-m", "benchmarks.run", "--cold-child", backend]
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for _ in range(iterations):
+        output = subprocess.run(command, capture_output=True, text=True, check=True, cwd=cwd)
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def _cold_child(backend: str) -> None:
+    """Measures imports, construction and first lookup in this interpreter."""
+    start = time.perf_counter()
+    import enigma  # noqa: F401
+
+    _quiet_logging()
+    _new_manager(backend).get_secret("service-0", "password")
+    print(time.perf_counter() - start)
+
+
+def run(backends, iterations: int, services: int, latency: float, bw_latency: float) -> dict:
+    """Runs every benchmark for the given backends and returns the results."""
+    results = {}
+    with StandIns(make_secrets(services), latency, bw_latency):
+        import enigma  # noqa: F401
+
+        _quiet_logging()
+        for backend in backends:
+            results[f"{backend}.single"] = _summary(bench_single(backend, iterations))
+            results[f"{backend}.batch"] = _summary(
+                bench_batch(backend, max(1, iterations // 10), services)
+            )
+            results[f"{backend}.warm_start"] = _summary(bench_warm_start(backend, max(1, iterations // 10)))
+            results[f"{backend}.cold_start"] = _summary(bench_cold_start(backend, max(1, iterations // 20)))
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "iterations": iterations,
+            "services": services,
+            "latency": latency,
+            "bw_latency": bw_latency,
+        },
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float = 0.0) -> list:
+    """
+    Compares the results against a baseline.
+
+    Medians that differ from the baseline by less than min_delta milliseconds
+    are never reported, so timer noise on sub-microsecond benchmarks is ignored.
+
+    Returns:
+        list: Names of the benchmarks whose median regressed
+    """
+    regressions = []
+    for name, current in sorted(results["results"].items()):
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            print(f"{name:28} {current['median_ms']:10.3f} ms   (no baseline)")
+            continue
+        ratio = current["median_ms"] / reference["median_ms"] if reference["median_ms"] else 1.0
+        status = "ok"
+        if ratio > 1 + tolerance and current["median_ms"] - reference["median_ms"] > min_delta:
+            status = "REGRESSION"
+            regressions.append(name)
+        print(f"{name:28} {current['median_ms']:10.3f} ms   x{ratio:5.2f}   {status}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the enigma secrets managers.")
+    parser.add_argument("--backend", action="append", choices=BACKENDS,
+                        help="Backend to benchmark. Can be repeated; all by default.")
+    parser.add_argument("--iterations", type=int, default=200,
+                        help="Lookups per single-lookup benchmark.")
+    parser.add_argument("--services", type=int, default=20,
+                        help="Number of services stored in the stand-ins.")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Latency in seconds added to each fake HTTP request.")
+    parser.add_argument("--bw-latency", type=float, default=0.0,
+                        help="Latency in seconds added to each stub bw invocation.")
+    parser.add_argument("--output", help="Path where the results are written as JSON.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown of the median before failing.")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="Slowdown in milliseconds below which a median never regresses.")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store the results as the new baseline.")
+    parser.add_argument("--cold-child", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.cold_child:
+        _cold_child(args.cold_child)
+        return 0
+
+    results = run(args.backend or BACKENDS, args.iterations, args.services,
+                  args.latency, args.bw_latency)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+            fd.write("\n")
+        print(f"Baseline stored in {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
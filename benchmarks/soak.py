@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+"""
+Soak test for concurrent secret lookups.
+
+Several worker threads make random lookups through enigma.get_secret for
+a given time, against the local stand-ins in fakes.py with latency and
+failures injected. Meanwhile the process is sampled to follow its open
+file descriptors, resident memory, threads, spawned subprocesses and
+unreaped (zombie) children.
+
+The report holds the throughput and the latency percentiles of each
+backend and the evolution of the samples. The command fails when file
+descriptors or memory grow past the given limits, or when zombies are
+left behind.
+
+    $ python -m benchmarks.soak --workers 32 --duration 300 --failure-rate 0.01
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from .fakes import StandIns, make_secrets
+from .run import BACKENDS, CREDENTIALS, _quiet_logging
+
+
+class _SpawnCounter:
+    """Counts the subprocesses started by the process."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._popen = None
+
+    def __enter__(self):
+        counter = self
+        self._popen = subprocess.Popen
+
+        class CountingPopen(self._popen):
+            def __init__(self, *args, **kwargs):
+                with counter._lock:
+                    counter.count += 1
+                super().__init__(*args, **kwargs)
+
+        subprocess.Popen = CountingPopen
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        subprocess.Popen = self._popen
+        return False
+
+
+def open_fds() -> int:
+    """Number of file descriptors open by the process, None if unknown."""
+    for directory in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(directory))
+        except OSError:
+            continue
+    return None
+
+
+def rss_bytes() -> int:
+    """Resident memory of the process, None if unknown."""
+    try:
+        with open("/proc/self/status") as fd:
+            for line in fd:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def zombies() -> int:
+    """Children of the process that exited and were not reaped, None if unknown."""
+    pid = str(os.getpid())
+    count = 0
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fd:
+                fields = fd.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[0] == "Z" and fields[1] == pid:
+            count += 1
+    return count
+
+
+class Histogram:
+    """
+    Latencies counted in logarithmic buckets.
+
+    Memory doesn't grow with the number of samples, so it doesn't hide
+    the growth of the process under test. Percentiles are accurate to 1%.
+    """
+
+    _BASE = 1e-7
+    _GROWTH = math.log(1.01)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        bucket = int(math.log(max(seconds, self._BASE) / self._BASE) / self._GROWTH)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> float:
+        """Latency below which the given fraction of the samples fall, None without samples."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self._BASE * math.exp((bucket + 1) * self._GROWTH), self.max)
+        return self.max
+
+
+def _latencies(histogram: Histogram, elapsed: float) -> dict:
+    """Summarizes latencies as milliseconds."""
+    summary = {"lookups": histogram.count, "throughput": histogram.count / elapsed if elapsed else 0.0}
+    for name, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        value = histogram.percentile(fraction)
+        summary[name] = value * 1000 if value is not None else None
+    summary["max_ms"] = histogram.max * 1000 if histogram.count else None
+    return summary
+
+
+class _Worker(threading.Thread):
+    """Makes random lookups until the stop event is set."""
+
+    def __init__(self, number: int, backends: list, services: int, miss_rate: float, stop: threading.Event):
+        super().__init__(name=f"soak-worker-{number}", daemon=True)
+        self.random = random.Random(number)
+        self.backends = backends
+        self.services = services
+        self.miss_rate = miss_rate
+        self.stop = stop
+        self.latencies = {backend: Histogram() for backend in backends}
+        self.errors = {backend: 0 for backend in backends}
+        self.not_found = {backend: 0 for backend in backends}
+
+    def run(self):
+        from enigma import get_secret
+
+        while not self.stop.is_set():
+            backend = self.random.choice(self.backends)
+            if self.random.random() < self.miss_rate:
+                service = f"missing-{self.random.randrange(self.services)}"
+            else:
+                service = f"service-{self.random.randrange(self.services)}"
+            credential = self.random.choice(CREDENTIALS)
+
+            start = time.perf_counter()
+            try:
+                secret = get_secret(backend, service, credential)
+            except Exception:
+                self.errors[backend] += 1
+                continue
+            self.latencies[backend].record(time.perf_counter() - start)
+            if not secret:
+                self.not_found[backend] += 1
+
+    def lookups(self) -> int:
+        return sum(histogram.count for histogram in self.latencies.values()) + sum(self.errors.values())
+
+
+def _sample(start: float, workers: list, spawns: _SpawnCounter) -> dict:
+    return {
+        "elapsed": time.monotonic() - start,
+        "lookups": sum(worker.lookups() for worker in workers),
+        "open_fds": open_fds(),
+        "rss_bytes": rss_bytes(),
+        "threads": threading.active_count(),
+        "spawns": spawns.count,
+        "zombies": zombies(),
+    }
+
+
+def soak(
+    backends,
+    workers: int,
+    duration: float,
+    services: int,
+    latency: float,
+    bw_latency: float,
+    failure_rate: float,
+    miss_rate: float,
+    sample_interval: float,
+) -> dict:
+    """Runs the soak test and returns the report."""
+    with StandIns(make_secrets(services), latency, bw_latency, failure_rate), _SpawnCounter() as spawns:
+        import enigma  # noqa: F401
+
+        _quiet_logging()
+        stop = threading.Event()
+        threads = [_Worker(number, list(backends), services, miss_rate, stop) for number in range(workers)]
+
+        start = time.monotonic()
+        samples = [_sample(start, threads, spawns)]
+        for thread in threads:
+            thread.start()
+        while not stop.wait(min(sample_interval, max(0.0, start + duration - time.monotonic()))):
+            samples.append(_sample(start, threads, spawns))
+            if time.monotonic() - start >= duration:
+                stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        samples.append(_sample(start, threads, spawns))
+
+    results = {}
+    total = Histogram()
+    for backend in backends:
+        histogram = Histogram()
+        for thread in threads:
+            histogram.merge(thread.latencies[backend])
+        total.merge(histogram)
+        summary = _latencies(histogram, elapsed)
+        summary["errors"] = sum(thread.errors[backend] for thread in threads)
+        summary["not_found"] = sum(thread.not_found[backend] for thread in threads)
+        results[backend] = summary
+    results["all"] = _latencies(total, elapsed)
+    results["all"]["errors"] = sum(results[backend]["errors"] for backend in backends)
+    results["all"]["not_found"] = sum(results[backend]["not_found"] for backend in backends)
+
+    return {
+        "parameters": {
+            "backends": list(backends),
+            "workers": workers,
+            "duration": duration,
+            "services": services,
+            "latency": latency,
+            "bw_latency": bw_latency,
+            "failure_rate": failure_rate,
+            "miss_rate": miss_rate,
+        },
+        "elapsed": elapsed,
+        "results": results,
+        "samples": samples,
+    }
+
+
+def _growth(report: dict, key: str):
+    """Growth of a sampled value between the first and the last samples."""
+    # The first sample is taken before any manager is created
+    first, last = report["samples"][1 if len(report["samples"]) > 2 else 0], report["samples"][-1]
+    if first[key] is None or last[key] is None:
+        return None
+    return last[key] - first[key]
+
+
+def check(report: dict, max_fd_growth: int, max_rss_growth: float) -> list:
+    """
+    Looks for leaks in the samples of a report.
+
+    Returns:
+        list: Descriptions of the leaks found
+    """
+    leaks = []
+    fd_growth = _growth(report, "open_fds")
+    if fd_growth is not None and fd_growth > max_fd_growth:
+        leaks.append(f"{fd_growth} file descriptors leaked")
+    rss_growth = _growth(report, "rss_bytes")
+    if rss_growth is not None and rss_growth > max_rss_growth * 1024 * 1024:
+        leaks.append(f"resident memory grew {rss_growth / 1024 / 1024:.1f} MiB")
+    zombie_count = report["samples"][-1]["zombies"]
+    if zombie_count:
+        leaks.append(f"{zombie_count} zombie processes")
+    return leaks
+
+
+def print_report(report: dict) -> None:
+    print(f"{'backend':12} {'lookups':>9} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'max ms':>9} {'errors':>7}")
+    for backend, summary in report["results"].items():
+        row = [summary[key] if summary[key] is not None else float("nan")
+               for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{backend:12} {summary['lookups']:9d} {summary['throughput']:9.1f} "
+              + " ".join(f"{value:9.3f}" for value in row)
+              + f" {summary['errors']:7d}")
+
+    print()
+    print(f"{'elapsed s':>9} {'lookups':>9} {'fds':>5} {'rss MiB':>8} {'threads':>7} {'spawns':>7} {'zombies':>7}")
+    for sample in report["samples"]:
+        rss = sample["rss_bytes"] / 1024 / 1024 if sample["rss_bytes"] is not None else float("nan")
+        print(f"{sample['elapsed']:9.1f} {sample['lookups']:9d} {str(sample['open_fds']):>5} {rss:8.1f} "
+              f"{sample['threads']:7d} {sample['spawns']:7d} {str(sample['zombies']):>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test concurrent enigma secret lookups.")
+    parser.add_argument("--backend", action="append", choices=BACKENDS,
+                        help="Backend looked up. Can be repeated; all by default.")
+    parser.add_argument("--workers", type=int, default=16, help="Threads making lookups.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds the test lasts.")
+    parser.add_argument("--services", type=int, default=20,
+                        help="Number of services stored in the stand-ins.")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Latency in seconds added to each fake HTTP request.")
+    parser.add_argument("--bw-latency", type=float, default=0.0,
+                        help="Latency in seconds added to each stub bw invocation.")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of the backend requests answered as unavailable.")
+    parser.add_argument("--miss-rate", type=float, default=0.05,
+                        help="Share of the lookups of services that don't exist.")
+    parser.add_argument("--sample-interval", type=float, default=5,
+                        help="Seconds between samples of the process resources.")
+    parser.add_argument("--max-fd-growth", type=int, default=16,
+                        help="File descriptors the process may gain before failing.")
+    parser.add_argument("--max-rss-growth", type=float, default=64,
+                        help="MiB of resident memory the process may gain before failing.")
+    parser.add_argument("--output", help="Path where the report is written as JSON.")
+    args = parser.parse_args(argv)
+
+    report = soak(args.backend or BACKENDS, args.workers, args.duration, args.services,
+                  args.latency, args.bw_latency, args.failure_rate, args.miss_rate,
+                  args.sample_interval)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+
+    leaks = check(report, args.max_fd_growth, args.max_rss_growth)
+    if leaks:
+        print(f"Leaks found: {', '.join(leaks)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
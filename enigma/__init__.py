@@ -19,7 +19,25 @@
 #     Alberto Ferrer Sánchez (alberefe@gmail.com)
 #
 
-from .enigma import get_secret
+import logging
+
+from .enigma import get_secret, warmup
+from .events import configure_logging
+from .references import resolve_config, resolve_file
 from .secrets_manager_factory import SecretsManagerFactory
+from .tracing import set_tracer
+from .watcher import watch
+
+__all__ = [
+    'get_secret',
+    'warmup',
+    'configure_logging',
+    'resolve_config',
+    'resolve_file',
+    'SecretsManagerFactory',
+    'set_tracer',
+    'watch',
+]
 
-__all__ = ['get_secret', 'SecretsManagerFactory']
\ No newline at end of file
+# Applications decide where the records of the library go
+logging.getLogger(__name__).addHandler(logging.NullHandler())
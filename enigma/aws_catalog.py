@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 300
+
+
+class AwsSecretEntry:
+    """Metadata of a secret listed by list_secrets."""
+
+    __slots__ = ("name", "arn", "version", "last_changed", "tags")
+
+    def __init__(self, name: str, arn: str, version: str = None, last_changed=None, tags: dict = None):
+        self.name = name
+        self.arn = arn
+        self.version = version
+        self.last_changed = last_changed
+        self.tags = tags or {}
+
+    @classmethod
+    def from_listing(cls, secret: dict) -> "AwsSecretEntry":
+        """Builds an entry from an element of the SecretList of list_secrets."""
+        version = None
+        for version_id, stages in (secret.get("SecretVersionsToStages") or {}).items():
+            if "AWSCURRENT" in stages:
+                version = version_id
+        return cls(
+            name=secret["Name"],
+            arn=secret["ARN"],
+            version=version,
+            last_changed=secret.get("LastChangedDate"),
+            tags={tag["Key"]: tag["Value"] for tag in secret.get("Tags") or ()},
+        )
+
+
+class AwsCatalog:
+    """
+    Index of the secrets of an AWS account, by name.
+
+    Built from a paginated list_secrets, it keeps the ARN, the current
+    version and the tags of every secret, so which secrets exist can be
+    answered without calling AWS. Values are never listed.
+
+    Secrets Manager can't list only the secrets changed since a date, so a
+    refresh lists every secret again, but entries are only replaced when
+    their LastChangedDate changes. Refreshes are skipped while the index is
+    younger than max_age.
+    """
+
+    def __init__(self, client, max_age: float = DEFAULT_MAX_AGE):
+        """
+        Args:
+            client: Secrets Manager client
+            max_age (float): Seconds the index is used before listing the secrets again
+        """
+        self.client = client
+        self.max_age = max_age
+        self._entries = {}
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> list:
+        """
+        Lists the secrets again if the index is too old.
+
+        Args:
+            force (bool): Whether to list the secrets even if the index is recent
+
+        Returns:
+            list: Names of the secrets added, changed or deleted since the previous listing
+        """
+        with self._lock:
+            if not force and self._refreshed is not None and time.monotonic() - self._refreshed < self.max_age:
+                return []
+
+            _logger.info("Listing AWS secrets")
+            listed = {}
+            paginator = self.client.get_paginator("list_secrets")
+            for page in paginator.paginate():
+                for secret in page["SecretList"]:
+                    listed[secret["Name"]] = secret
+
+            changed = []
+            entries = {}
+            for name, secret in listed.items():
+                entry = self._entries.get(name)
+                if entry is None or entry.last_changed != secret.get("LastChangedDate"):
+                    entry = AwsSecretEntry.from_listing(secret)
+                    changed.append(name)
+                entries[name] = entry
+            changed.extend(name for name in self._entries if name not in entries)
+
+            self._entries = entries
+            self._refreshed = time.monotonic()
+            _logger.debug("Indexed %s AWS secrets, %s changed", len(entries), len(changed))
+            return changed
+
+    def get(self, name: str) -> AwsSecretEntry:
+        """
+        Returns the entry of a secret, None if it doesn't exist.
+
+        Args:
+            name (str): Name of the secret
+        """
+        self.refresh()
+        return self._entries.get(name)
+
+    def names(self, prefix: str = None, tags: dict = None) -> list:
+        """
+        Returns the names of the secrets matching a query.
+
+        Args:
+            prefix (str, optional): Beginning of the names, such as "grimoirelab/"
+            tags (dict, optional): Tags the secrets must have. A None value
+                matches any value of the tag.
+
+        Returns:
+            list: Sorted names of the matching secrets
+        """
+        self.refresh()
+        entries = self._entries
+        return sorted(
+            name for name, entry in entries.items()
+            if (prefix is None or name.startswith(prefix)) and self._has_tags(entry, tags)
+        )
+
+    @staticmethod
+    def _has_tags(entry: AwsSecretEntry, tags: dict) -> bool:
+        for key, value in (tags or {}).items():
+            if key not in entry.tags or (value is not None and entry.tags[key] != value):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
@@ -21,43 +21,199 @@
 
 import logging
 import json
+import os
+import threading
+
 import boto3
-from botocore.exceptions import EndpointConnectionError, SSLError, ClientError
+import botocore.session
+from botocore.config import Config
+from botocore.exceptions import EndpointConnectionError, SSLError, ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+from .aws_catalog import AwsCatalog
+from .cache import SecretCache
+from .deadline import DeadlineExceeded, check_deadline, deadline_scope
+from .events import EventLogger
+from .hedging import HedgedReader
+from .tracing import get_tracer, OUTCOME_NOT_FOUND
 
-logging.getLogger("urllib3").setLevel(logging.WARNING)
-logging.getLogger("botocore").setLevel(logging.WARNING)
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 _logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+# Failures after which the last retrieved secret can still be served
+UNAVAILABLE_ERRORS = (BotoConnectionError, HTTPClientError, DeadlineExceeded)
+
+SERVICE_NAME = "secretsmanager"
+
+# Values accepted by a list_secrets filter
+LIST_FILTER_SIZE = 10
+
+# Secrets accepted by a batch_get_secret_value call
+BATCH_SIZE = 20
+
+# Seconds to connect and to wait for an answer, and attempts per request
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_MAX_ATTEMPTS = 3
+
+CLIENT_CONFIG = Config(
+    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+    read_timeout=DEFAULT_READ_TIMEOUT,
+    retries={"max_attempts": DEFAULT_MAX_ATTEMPTS, "mode": "standard"},
+)
+
+_shared_lock = threading.Lock()
+_shared_session = None
+_shared_clients = {}
+
+
+def get_shared_session() -> boto3.Session:
+    """
+    Returns the boto3 session shared by every AwsManager of the process.
+
+    The session is created once with the Secrets Manager service model
+    already loaded. Credentials are resolved through the provider chain the
+    first time they are needed and cached by the session from then on;
+    temporary credentials are refreshed automatically before they expire.
+
+    Returns:
+        boto3.Session: The shared session
+    """
+    global _shared_session
+
+    with _shared_lock:
+        if _shared_session is None:
+            botocore_session = botocore.session.get_session()
+            botocore_session.get_service_model(SERVICE_NAME)
+            _shared_session = boto3.Session(botocore_session=botocore_session)
+        return _shared_session
+
+
+def get_shared_client(region_name: str = None):
+    """
+    Returns the Secrets Manager client of the shared session for a region.
+
+    Clients are thread-safe, so one client per region is created and reused.
+    They use CLIENT_CONFIG, so a request that hangs is abandoned after the
+    read timeout and retried a bounded number of times.
+
+    Args:
+        region_name (str, optional): Region of the client. Defaults to the configured one.
+
+    Returns:
+        The Secrets Manager client
+    """
+    session = get_shared_session()
+    with _shared_lock:
+        client = _shared_clients.get(region_name)
+        if client is None:
+            client = _create_client(session, region_name)
+            _shared_clients[region_name] = client
+        return client
+
+
+def reset_shared_session() -> None:
+    """
+    Discards the shared session and its clients.
+
+    Called automatically in child processes after a fork, since connection
+    pools can't be shared between processes.
+    """
+    global _shared_session
+
+    with _shared_lock:
+        _shared_session = None
+        _shared_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_shared_session)
+
+
+def _create_client(session: boto3.Session, region_name: str = None, config: Config = CLIENT_CONFIG):
+    if region_name:
+        return session.client(SERVICE_NAME, region_name=region_name, config=config)
+    return session.client(SERVICE_NAME, config=config)
 
 
 class AwsManager:
 
-    def __init__(self):
+    def __init__(
+        self,
+        cache: SecretCache = None,
+        regions: list = None,
+        session: boto3.Session = None,
+        client=None,
+        region_name: str = None,
+        config: Config = None,
+    ):
         """
         Initializes the client that will access to the credentials management service.
 
         This takes the credentials to log into aws from the .aws folder.
         This constructor also takes other relevant information from that folder if it exists.
 
+        Unless a session or a client is given, clients come from a session shared
+        by the whole process, so creating more managers doesn't load the service
+        model or resolve the credentials again.
+
+        When several regions holding replicas of the secrets are given, reads go
+        to the fastest one and are hedged to the others when it is slow to answer.
+
+        Clients connect and read with the timeouts and the capped retries of
+        CLIENT_CONFIG unless another config is given.
+
+        Args:
+            cache (SecretCache, optional): Cache for the retrieved secrets
+            regions (list, optional): Regions holding replicas of the secrets
+            session (boto3.Session, optional): Session used to create the clients
+            client (optional): Secrets Manager client to use
+            region_name (str, optional): Region of the client, if not the configured one
+            config (Config, optional): Timeouts and retries of the clients. Clients with
+                their own config are not shared with other managers.
+
         Raises:
             Exception: If there's a connection error.
         """
 
+        self.cache = cache if cache is not None else SecretCache()
+
         # Creates a client using the credentials found in the .aws folder
         try:
             _logger.info("Initializing client and login in")
-            self.client = boto3.client("secretsmanager")
+            with get_tracer().span("aws.login", backend="aws"):
+                if client is not None:
+                    self.clients = [client]
+                elif regions:
+                    self.clients = [self._create_client(session, region, config) for region in regions]
+                else:
+                    self.clients = [self._create_client(session, region_name, config)]
+                self.client = self.clients[0]
 
         except (EndpointConnectionError, SSLError, ClientError, Exception) as e:
             _logger.error("Problem starting the client: %s", e)
             raise e
 
+        self._reader = None
+        if len(self.clients) > 1:
+            self._reader = HedgedReader(self.clients, names=regions)
+
+        self.catalog = AwsCatalog(self.client)
+
+    @staticmethod
+    def _create_client(session: boto3.Session, region_name: str = None, config: Config = None):
+        """Creates a client with the given session, or takes it from the shared one."""
+        if session is not None or config is not None:
+            return _create_client(session or get_shared_session(), region_name, config or CLIENT_CONFIG)
+        return get_shared_client(region_name)
+
     def _retrieve_and_format_credentials(self, service_name: str) -> dict:
         """
         Retrieves credentials using the class client.
 
+        Secrets are kept in the manager cache. If AWS can't be reached, the last
+        secret retrieved is served while the cache grace period lasts.
+
         Args:
             service_name (str): Name of the service to retrieve credentials for.(or name of the secret)
 
@@ -68,48 +224,198 @@ class AwsManager:
             Exception: If there's a connection error.
         """
         try:
-            _logger.info("Retrieving credentials: %s", service_name)
-            secret_value_response = self.client.get_secret_value(SecretId=service_name)
-            formatted_credentials = json.loads(secret_value_response["SecretString"])
-            return formatted_credentials
+            return self.cache.get(
+                service_name,
+                lambda: self._fetch_credentials(service_name),
+                fallback_errors=UNAVAILABLE_ERRORS,
+            )
         except (ClientError, json.JSONDecodeError) as e:
-            _logger.error("Error retrieving the secret: %s", str(e))
+            _events.emit("aws.retrieve_error", logging.ERROR, "Error retrieving the secret %s: %s",
+                         service_name, e, backend="aws", service=service_name)
             raise e
 
-    def get_secret(self, service_name: str, credential_name: str) -> str:
+    def _fetch_credentials(self, service_name: str) -> dict:
+        """
+        Gets a secret from AWS and parses its JSON value.
+
+        Args:
+            service_name (str): Name of the secret
+
+        Returns:
+            dict: The credentials stored in the secret
+        """
+        _events.emit("aws.fetch", logging.DEBUG, "Retrieving credentials: %s", service_name,
+                     backend="aws", service=service_name)
+        check_deadline()
+        tracer = get_tracer()
+        with tracer.span("aws.fetch", backend="aws", service=service_name):
+            if self._reader is None:
+                secret_value_response = self.client.get_secret_value(SecretId=service_name)
+            else:
+                secret_value_response = self._reader.read(
+                    lambda client: client.get_secret_value(SecretId=service_name),
+                    retry_errors=UNAVAILABLE_ERRORS,
+                )
+        with tracer.span("aws.parse", backend="aws", service=service_name):
+            formatted_credentials = json.loads(secret_value_response["SecretString"])
+        return formatted_credentials
+
+    def get_secrets(self, services: list) -> dict:
+        """
+        Retrieves several secrets with batch_get_secret_value.
+
+        Secrets already in the cache are not fetched again; the ones fetched
+        are added to it. Secrets that can't be retrieved are left out.
+
+        Args:
+            services (list): Names of the secrets
+
+        Returns:
+            dict: The credentials stored in each secret, by name
+        """
+        credentials = {}
+        missing = []
+        for service_name in dict.fromkeys(services):
+            if service_name in self.cache:
+                credentials[service_name] = self._retrieve_and_format_credentials(service_name)
+            else:
+                missing.append(service_name)
+
+        tracer = get_tracer()
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start:start + BATCH_SIZE]
+            _events.emit("aws.fetch_batch", logging.DEBUG, "Retrieving %s secrets", len(batch), backend="aws")
+            check_deadline()
+            with tracer.span("aws.fetch", backend="aws"):
+                responses = self._batch_get(batch)
+            with tracer.span("aws.parse", backend="aws"):
+                for response in responses:
+                    for secret in response.get("SecretValues", ()):
+                        name = secret["Name"] if secret["Name"] in batch else secret["ARN"]
+                        try:
+                            credentials[name] = json.loads(secret["SecretString"])
+                        except (KeyError, json.JSONDecodeError) as e:
+                            _logger.error("Error parsing the secret %s: %s", name, e)
+                            continue
+                        self.cache.put(name, credentials[name])
+                    for error in response.get("Errors", ()):
+                        _logger.error("Error retrieving the secret %s: %s", error.get("SecretId"), error.get("Message"))
+        return credentials
+
+    def _batch_get(self, names: list) -> list:
+        """Calls batch_get_secret_value, following its pages."""
+        def call(client):
+            responses = []
+            kwargs = {"SecretIdList": names}
+            while True:
+                response = client.batch_get_secret_value(**kwargs)
+                responses.append(response)
+                if not response.get("NextToken"):
+                    return responses
+                kwargs["NextToken"] = response["NextToken"]
+
+        if self._reader is None:
+            return call(self.client)
+        return self._reader.read(call, retry_errors=UNAVAILABLE_ERRORS)
+
+    def prefetch(self, prefix: str = None, tags: dict = None) -> dict:
+        """
+        Retrieves every secret matching a catalog query.
+
+        Args:
+            prefix (str, optional): Beginning of the names, such as "grimoirelab/"
+            tags (dict, optional): Tags the secrets must have
+
+        Returns:
+            dict: The credentials stored in each secret, by name
+        """
+        return self.get_secrets(self.catalog.names(prefix=prefix, tags=tags))
+
+    def get_versions(self, services: list) -> dict:
+        """
+        Returns when each secret last changed.
+
+        Secrets are listed in batches with list_secrets, without reading
+        their values.
+
+        Args:
+            services (list): Names of the secrets
+
+        Returns:
+            dict: LastChangedDate of each secret found, by name
+        """
+        versions = {}
+        paginator = self.client.get_paginator("list_secrets")
+        for start in range(0, len(services), LIST_FILTER_SIZE):
+            batch = services[start:start + LIST_FILTER_SIZE]
+            # The name filter matches prefixes
+            for page in paginator.paginate(Filters=[{"Key": "name", "Values": batch}]):
+                for secret in page["SecretList"]:
+                    if secret["Name"] in batch:
+                        versions[secret["Name"]] = secret.get("LastChangedDate")
+        return versions
+
+    def invalidate(self, service_name: str) -> None:
+        """Drops a secret from the cache, so it is retrieved again."""
+        self.cache.invalidate(service_name)
+
+    def warmup(self) -> None:
+        """
+        Resolves the credentials and connects to the endpoint of every region.
+
+        Clients do both on their first request, so a cheap one is made to
+        each of them. Being denied to list the secrets still leaves the
+        client ready for the lookups.
+        """
+        with get_tracer().span("aws.warmup", backend="aws"):
+            for client in self.clients:
+                check_deadline()
+                try:
+                    client.list_secrets(MaxResults=1)
+                except ClientError as e:
+                    _logger.debug("Warmup request refused: %s", e)
+
+    def get_secret(self, service_name: str, credential_name: str, deadline=None) -> str:
         """
         Gets a secret based on the service name and the desired credential.
 
         Args:
             service_name (str): Name of the service to retrieve credentials for
             credential_name (str): Name of the credential
+            deadline (Deadline or float, optional): Deadline of the lookup, or seconds it may take
 
         Returns:
             str: The credential value if found, empty string if not found
 
         Raises:
+            DeadlineExceeded: If the deadline passed before AWS was asked.
             Exception: If there's a connection error.
         """
-        try:
-            formatted_credentials = self._retrieve_and_format_credentials(service_name)
-            credential = formatted_credentials[credential_name]
-            return credential
-        except KeyError:
-            # This handles when the credential doesn't exist in the secret
-            _logger.error("The secret %s:%s, was not found.", service_name, credential_name)
-            _logger.error(
-                "Please check the secret name and the credential name. For now here you have an empty string.")
-            return ""
-        except ClientError as e:
-            # This handles AWS-specific errors like ResourceNotFoundException
-            if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                _logger.error("The secret %s:%s, was not found.", service_name, credential_name)
-                _logger.error(e)
-                _logger.error(
-                    "Please check the secret name and the credential name. For now here you have an empty string.")
+        with get_tracer().span("aws.get_secret", backend="aws", service=service_name) as span, \
+                deadline_scope(deadline):
+            try:
+                formatted_credentials = self._retrieve_and_format_credentials(service_name)
+                credential = formatted_credentials[credential_name]
+                return credential
+            except KeyError:
+                # This handles when the credential doesn't exist in the secret
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("aws.not_found", logging.ERROR,
+                             "The secret %s:%s, was not found. Returning an empty string.",
+                             service_name, credential_name, backend="aws", service=service_name)
                 return ""
-            _logger.error("There was a problem getting the secret")
-            raise e
-        except Exception as e:
-            _logger.error("There was a problem getting the secret")
-            raise e
+            except ClientError as e:
+                # This handles AWS-specific errors like ResourceNotFoundException
+                if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                    span.set_outcome(OUTCOME_NOT_FOUND)
+                    _events.emit("aws.not_found", logging.ERROR,
+                                 "The secret %s:%s, was not found. Returning an empty string: %s",
+                                 service_name, credential_name, e, backend="aws", service=service_name)
+                    return ""
+                _events.emit("aws.error", logging.ERROR, "There was a problem getting the secret %s: %s",
+                             service_name, e, backend="aws", service=service_name)
+                raise e
+            except Exception as e:
+                _events.emit("aws.error", logging.ERROR, "There was a problem getting the secret %s: %s",
+                             service_name, e, backend="aws", service=service_name)
+                raise e
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import heapq
+import io
+import json
+import logging
+import sys
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+_CHUNK_SIZE = 64 * 1024
+
+
+def _normalize(name: str) -> str:
+    return name.strip().lower()
+
+
+def iter_json_array(stream, chunk_size: int = _CHUNK_SIZE):
+    """
+    Yields the elements of a JSON array one at a time.
+
+    Only the element being decoded is kept in memory, besides the chunk of
+    text read from the stream.
+
+    Args:
+        stream: Text stream holding a JSON array
+        chunk_size (int): Characters read from the stream at a time
+
+    Raises:
+        ValueError: If the stream doesn't hold a JSON array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[position:position + 1] != "[":
+        raise ValueError("Expected a JSON array")
+    position += 1
+
+    skip_whitespace()
+    if buffer[position:position + 1] == "]":
+        return
+
+    while True:
+        skip_whitespace()
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+            if end == len(buffer) and not eof:
+                raise ValueError("Element may continue in the next chunk")
+        except ValueError:
+            if eof:
+                raise
+            fill()
+            continue
+        position = end
+        yield element
+
+        skip_whitespace()
+        separator = buffer[position:position + 1]
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Unexpected {separator!r} in JSON array")
+
+
+class BitwardenItem:
+    """
+    Compact record with the parts of a Bitwarden item enigma uses.
+
+    Notes, password history, attachments, URIs and the rest of the metadata
+    are dropped when the record is built.
+    """
+
+    __slots__ = (
+        "id", "name", "folder_id", "collection_ids", "revision_date",
+        "username", "password", "fields",
+    )
+
+    def __init__(self, id, name, folder_id=None, collection_ids=(), revision_date="",
+                 username=None, password=None, fields=()):
+        self.id = id
+        self.name = name
+        self.folder_id = folder_id
+        self.collection_ids = collection_ids
+        self.revision_date = revision_date
+        self.username = username
+        self.password = password
+        self.fields = fields
+
+    @classmethod
+    def from_dict(cls, item: dict) -> "BitwardenItem":
+        """Builds a record from an item as returned by the Bitwarden CLI."""
+        login = item.get("login") or {}
+        folder_id = item.get("folderId")
+        return cls(
+            id=item["id"],
+            name=item["name"],
+            folder_id=sys.intern(folder_id) if folder_id else None,
+            collection_ids=tuple(sys.intern(c) for c in item.get("collectionIds") or ()),
+            revision_date=sys.intern(item.get("revisionDate") or ""),
+            username=login.get("username"),
+            password=login.get("password"),
+            fields=tuple((field["name"], field["value"]) for field in item.get("fields") or ()),
+        )
+
+    def to_dict(self) -> dict:
+        """Returns the item in the format of the Bitwarden CLI."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "login": {"username": self.username, "password": self.password},
+            "fields": [{"name": name, "value": value} for name, value in self.fields],
+        }
+
+    def footprint(self) -> int:
+        """Approximate memory used by the record, in bytes."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.fields) + sys.getsizeof(self.collection_ids)
+        for value in (self.id, self.name, self.username, self.password):
+            if value is not None:
+                size += sys.getsizeof(value)
+        for name, value in self.fields:
+            size += sys.getsizeof((name, value)) + sys.getsizeof(name) + sys.getsizeof(value)
+        return size
+
+
+class _Ranked:
+    """Orders records by how they are resolved: smaller means resolved later."""
+
+    __slots__ = ("record",)
+
+    def __init__(self, record: BitwardenItem):
+        self.record = record
+
+    def __lt__(self, other: "_Ranked") -> bool:
+        if self.record.revision_date != other.record.revision_date:
+            return self.record.revision_date < other.record.revision_date
+        return self.record.id > other.record.id
+
+
+class BitwardenCatalog:
+    """
+    Index of the items of a Bitwarden vault.
+
+    Built from a single listing of the vault, it resolves lookups by id, by
+    exact name, by folder or collection path ("folder/name") and by name or
+    path ignoring case, in that order. When several items share a key the
+    most recently revised one wins, ties being broken by the lowest id, so
+    the same vault always resolves to the same item.
+
+    Items are kept as BitwardenItem records. When they don't fit in
+    max_bytes, the most recently revised items that fit are kept, whatever
+    the order of the listing, and the catalog is marked as incomplete.
+    """
+
+    def __init__(self, items, paths_loader=None, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            items (iterable): Items as listed by `bw list items`, or BitwardenItem records
+            paths_loader (callable, optional): Function returning a tuple with the
+                folders and the collections of the vault, as lists of dicts with
+                id and name. Called the first time a lookup needs a path.
+            max_bytes (int): Memory budget of the catalog, in bytes
+        """
+        self._paths_loader = paths_loader
+        self.max_bytes = max_bytes
+
+        records = (item if isinstance(item, BitwardenItem) else BitwardenItem.from_dict(item) for item in items)
+        records, self._records_bytes, self.complete = self._within_budget(records)
+
+        self._items = self._sorted(records)
+        self._by_id = {}
+        self._by_name = {}
+        self._by_normalized_name = {}
+        self._by_path = None
+        self._by_normalized_path = None
+
+        for item in self._items:
+            self._by_id.setdefault(item.id, item)
+            self._by_name.setdefault(item.name, item)
+            self._by_normalized_name.setdefault(_normalize(item.name), item)
+
+    @classmethod
+    def from_json(cls, text: str, **kwargs) -> "BitwardenCatalog":
+        """
+        Builds a catalog from the output of `bw list items`.
+
+        Items are decoded and turned into records one at a time, so the whole
+        listing is never held as Python objects.
+        """
+        return cls(iter_json_array(io.StringIO(text)), **kwargs)
+
+    def update(self, items) -> list:
+        """
+        Applies a new listing of the vault.
+
+        Records of items whose revision date didn't change are reused, and
+        only the index entries of added, changed or removed items are
+        computed again. Paths are indexed again on the next path lookup.
+
+        Args:
+            items (iterable): Items as listed by `bw list items`, or BitwardenItem records
+
+        Returns:
+            list: Ids of the items added, changed or removed
+        """
+        def reuse():
+            for item in items:
+                item_id = item.id if isinstance(item, BitwardenItem) else item["id"]
+                revision_date = item.revision_date if isinstance(item, BitwardenItem) else item.get("revisionDate") or ""
+                record = self._by_id.get(item_id)
+                if record is None or record.revision_date != revision_date:
+                    record = item if isinstance(item, BitwardenItem) else BitwardenItem.from_dict(item)
+                yield record
+
+        records, records_bytes, self.complete = self._within_budget(reuse())
+        changed = [record for record in records if self._by_id.get(record.id) is not record]
+
+        listed = {record.id for record in records}
+        removed = [record for record in self._items if record.id not in listed]
+        if not changed and not removed:
+            return []
+
+        affected = set()
+        for record in changed + removed:
+            previous = self._by_id.get(record.id)
+            for each in (record, previous):
+                if each is not None:
+                    affected.update((("id", each.id), ("name", each.name), ("normalized", _normalize(each.name))))
+
+        self._items = self._sorted(records)
+        self._records_bytes = records_bytes
+        self._by_path = None
+        self._by_normalized_path = None
+        indexes = {"id": self._by_id, "name": self._by_name, "normalized": self._by_normalized_name}
+        for index, key in affected:
+            indexes[index].pop(key, None)
+        for item in self._items:
+            for index, key in (("id", item.id), ("name", item.name), ("normalized", _normalize(item.name))):
+                if (index, key) in affected:
+                    indexes[index].setdefault(key, item)
+
+        return [record.id for record in changed + removed]
+
+    def _within_budget(self, records) -> tuple:
+        """
+        Keeps the most recently revised records that fit in max_bytes.
+
+        Records are kept in a heap with the one that would be resolved last
+        on top. While they are over the budget that one is dropped, and so
+        is every later record ranked below a dropped one, so the records
+        kept don't depend on the order of the listing.
+
+        Returns:
+            tuple: Records kept, bytes they take and whether none was dropped
+        """
+        heap = []
+        records_bytes = 0
+        cutoff = None
+        for record in records:
+            ranked = _Ranked(record)
+            if cutoff is not None and ranked < cutoff:
+                continue
+            heapq.heappush(heap, ranked)
+            records_bytes += record.footprint()
+            while records_bytes > self.max_bytes:
+                dropped = heapq.heappop(heap)
+                records_bytes -= dropped.record.footprint()
+                if cutoff is None or cutoff < dropped:
+                    cutoff = dropped
+
+        if cutoff is not None:
+            _logger.warning("Bitwarden catalog over %s bytes, indexed %s items", self.max_bytes, len(heap))
+        return [ranked.record for ranked in heap], records_bytes, cutoff is None
+
+    @staticmethod
+    def _sorted(items: list) -> list:
+        """Sorts items by revision date, newest first, then by id."""
+        items.sort(key=lambda item: item.id)
+        items.sort(key=lambda item: item.revision_date, reverse=True)
+        return items
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def footprint(self) -> int:
+        """Approximate memory used by the records and the indexes, in bytes."""
+        size = self._records_bytes + sys.getsizeof(self._items)
+        for index in (self._by_id, self._by_name, self._by_normalized_name,
+                      self._by_path, self._by_normalized_path):
+            if index is not None:
+                size += sys.getsizeof(index)
+        for key, item in self._by_normalized_name.items():
+            if key != item.name:
+                size += sys.getsizeof(key)
+        return size
+
+    def resolve(self, name: str):
+        """
+        Finds the item a name refers to.
+
+        Args:
+            name (str): Id, name or folder/collection path of the item
+
+        Returns:
+            BitwardenItem: The item, or None if no item matches
+        """
+        item = self._by_id.get(name) or self._by_name.get(name)
+        if item is not None:
+            return item
+
+        if "/" in name:
+            self._index_paths()
+            item = self._by_path.get(name) or self._by_normalized_path.get(_normalize(name))
+            if item is not None:
+                return item
+
+        return self._by_normalized_name.get(_normalize(name))
+
+    def _index_paths(self) -> None:
+        if self._by_path is not None:
+            return
+
+        self._by_path = {}
+        self._by_normalized_path = {}
+        if self._paths_loader is None:
+            return
+
+        folders, collections = self._paths_loader()
+        folder_names = {folder["id"]: folder["name"] for folder in folders if folder.get("id")}
+        collection_names = {collection["id"]: collection["name"] for collection in collections}
+
+        for item in self._items:
+            prefixes = []
+            if item.folder_id in folder_names:
+                prefixes.append(folder_names[item.folder_id])
+            for collection_id in item.collection_ids:
+                if collection_id in collection_names:
+                    prefixes.append(collection_names[collection_id])
+
+            for prefix in prefixes:
+                path = f"{prefix}/{item.name}"
+                self._by_path.setdefault(path, item)
+                self._by_normalized_path.setdefault(_normalize(path), item)
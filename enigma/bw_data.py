@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+PROTECTED_PREFIX = "__PROTECTED__"
+ENCRYPTION_TYPE = 2  # AES-256-CBC with HMAC-SHA256
+
+
+class _SymmetricKey:
+    """AES-256 encryption key and HMAC-SHA256 key of a Bitwarden key."""
+
+    __slots__ = ("enc_key", "mac_key")
+
+    def __init__(self, key: bytes):
+        if len(key) != 64:
+            raise ValueError(f"Expected a 64 bytes key, got {len(key)} bytes")
+        self.enc_key = key[:32]
+        self.mac_key = key[32:]
+
+
+def _decrypt(key: _SymmetricKey, iv: bytes, ciphertext: bytes, mac: bytes) -> bytes:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    expected = hmac.new(key.mac_key, iv + ciphertext, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, mac):
+        raise ValueError("Invalid MAC, wrong key or corrupted data")
+
+    decryptor = Cipher(algorithms.AES(key.enc_key), modes.CBC(iv)).decryptor()
+    padded = decryptor.update(ciphertext) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    return unpadder.update(padded) + unpadder.finalize()
+
+
+def decrypt_enc_string(value: str, key: _SymmetricKey) -> bytes:
+    """
+    Decrypts a Bitwarden EncString such as "2.<iv>|<ciphertext>|<mac>".
+
+    Raises:
+        ValueError: If the string is not of type 2 or can't be decrypted with key
+    """
+    enc_type, _, data = value.partition(".")
+    if enc_type != str(ENCRYPTION_TYPE):
+        raise ValueError(f"Unsupported encryption type: {enc_type}")
+    try:
+        iv, ciphertext, mac = (base64.b64decode(part) for part in data.split("|"))
+    except ValueError as e:
+        raise ValueError(f"Malformed encrypted string: {e}") from e
+    return _decrypt(key, iv, ciphertext, mac)
+
+
+def decrypt_protected(value: str, key: _SymmetricKey) -> bytes:
+    """
+    Decrypts a value protected by the CLI with the session key.
+
+    Protected values are the base64 of the encryption type, the IV, the MAC
+    and the ciphertext, concatenated.
+
+    Raises:
+        ValueError: If the value can't be decrypted with key
+    """
+    data = base64.b64decode(value)
+    if len(data) < 50 or data[0] != ENCRYPTION_TYPE:
+        raise ValueError("Unsupported protected value")
+    return _decrypt(key, data[1:17], data[49:], data[17:49])
+
+
+def _active_user(data: dict) -> str:
+    """Id of the account logged in the CLI."""
+    user_id = data.get("global_account_activeAccountId") or data.get("activeUserId")
+    if not user_id:
+        raise ValueError("No active account in the Bitwarden data file")
+    return user_id
+
+
+def data_file_revision(path: str) -> str:
+    """
+    Returns a digest of the revisions of the items in a CLI data file.
+
+    The CLI rewrites its data file on every sync, even when the vault
+    didn't change, so the id, revision date and deletion date of every
+    item tell whether it changed instead. Nothing is decrypted.
+
+    Args:
+        path (str): Path of data.json
+
+    Raises:
+        OSError: If the file can't be read
+        ValueError: If the file has no vault
+    """
+    with open(path) as fd:
+        data = json.load(fd)
+
+    ciphers = BitwardenDataFile._ciphers(data, _active_user(data))
+    digest = hashlib.sha256()
+    for cipher_id in sorted(ciphers):
+        cipher = ciphers[cipher_id]
+        digest.update(f"{cipher_id}\0{cipher.get('revisionDate')}\0{cipher.get('deletedDate')}\n".encode())
+    return digest.hexdigest()
+
+
+class BitwardenDataFile:
+    """
+    Reads the vault items from the local data file of the Bitwarden CLI.
+
+    The CLI keeps the synced vault encrypted in its data.json, and the user
+    key in it protected with the session key. With the session key, names,
+    logins and custom fields of the personal items are decrypted in the
+    process, without running the CLI. Items of organizations, encrypted with
+    keys only the CLI can unwrap, are skipped and counted in skipped.
+
+    Requires the cryptography package.
+    """
+
+    def __init__(self, path: str, session_key: str):
+        """
+        Args:
+            path (str): Path of data.json
+            session_key (str): Session key of the CLI (BW_SESSION)
+
+        Raises:
+            ImportError: If cryptography is not installed
+            ValueError: If the session key is not valid
+        """
+        try:
+            import cryptography  # noqa: F401
+        except ImportError as e:
+            _logger.error("cryptography is not installed: %s", e)
+            raise e
+
+        self.path = path
+        self.session_key = _SymmetricKey(base64.b64decode(session_key))
+        self.skipped = 0
+
+    def items(self):
+        """
+        Yields the personal items of the vault, as listed by `bw list items`.
+
+        Raises:
+            OSError: If the file can't be read
+            ValueError: If the file has no vault or the session key can't decrypt it
+        """
+        with open(self.path) as fd:
+            data = json.load(fd)
+
+        user_id = _active_user(data)
+        user_key = self._user_key(data, user_id)
+
+        self.skipped = 0
+        for cipher in self._ciphers(data, user_id).values():
+            if cipher.get("deletedDate"):
+                continue
+            if cipher.get("organizationId"):
+                self.skipped += 1
+                continue
+            try:
+                yield self._decrypt_cipher(cipher, user_key)
+            except ValueError as e:
+                _logger.debug("Could not decrypt Bitwarden item %s: %s", cipher.get("id"), e)
+                self.skipped += 1
+
+    def _user_key(self, data: dict, user_id: str) -> _SymmetricKey:
+        """Finds the protected user key and decrypts it with the session key."""
+        for name, value in data.items():
+            if not name.startswith(PROTECTED_PREFIX) or user_id not in name:
+                continue
+            try:
+                plaintext = decrypt_protected(value, self.session_key)
+            except ValueError:
+                continue
+            if len(plaintext) != 64:
+                # Stored as a base64 string, sometimes JSON encoded
+                plaintext = base64.b64decode(plaintext.decode().strip('"'))
+            return _SymmetricKey(plaintext)
+        raise ValueError("The session key can't decrypt the Bitwarden user key")
+
+    @staticmethod
+    def _ciphers(data: dict, user_id: str) -> dict:
+        """Encrypted items of the account, by id."""
+        ciphers = data.get(f"user_{user_id}_ciphers_ciphers")
+        if ciphers is None:
+            # Layout of CLI versions older than 2024
+            ciphers = ((data.get(user_id) or {}).get("data") or {}).get("ciphers", {}).get("encrypted")
+        if ciphers is None:
+            raise ValueError("No items in the Bitwarden data file, sync the vault first")
+        return ciphers
+
+    @staticmethod
+    def _decrypt_cipher(cipher: dict, user_key: _SymmetricKey) -> dict:
+        key = user_key
+        if cipher.get("key"):
+            key = _SymmetricKey(decrypt_enc_string(cipher["key"], user_key))
+
+        def text(value):
+            return decrypt_enc_string(value, key).decode() if value else None
+
+        login = cipher.get("login") or {}
+        return {
+            "id": cipher["id"],
+            "name": text(cipher["name"]),
+            "folderId": cipher.get("folderId"),
+            "collectionIds": cipher.get("collectionIds") or [],
+            "revisionDate": cipher.get("revisionDate"),
+            "login": {"username": text(login.get("username")), "password": text(login.get("password"))},
+            "fields": [
+                {"name": text(field.get("name")), "value": text(field.get("value"))}
+                for field in cipher.get("fields") or ()
+            ],
+        }
@@ -19,40 +19,90 @@
 #       Alberto Ferrer Sánchez (alberefe@gmail.com)
 #
 
+import io
 import json
+import os
 import subprocess
 import logging
+import sys
+import threading
 from datetime import datetime, timedelta
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from .bw_catalog import BitwardenCatalog, BitwardenItem, iter_json_array
+from .bw_data import BitwardenDataFile, data_file_revision
+from .bw_session import SessionStore
+from .command_queue import get_command_queue
+from .deadline import DeadlineExceeded, deadline_scope, timeout_for
+from .cache import SecretCache
+from .events import EventLogger
+from .tracing import get_tracer, OUTCOME_NOT_FOUND
+
 _logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+DEFAULT_BW_PATH = "/snap/bin/bw"
+
+# Failures after which the last retrieved item can still be served
+UNAVAILABLE_ERRORS = (subprocess.CalledProcessError, subprocess.TimeoutExpired, DeadlineExceeded)
+
+# Seconds a CLI command may run when no deadline is shorter
+DEFAULT_COMMAND_TIMEOUT = 120
 
 
 class BitwardenManager:
 
-    def __init__(self, email: str, password: str):
+    def __init__(
+        self,
+        email: str,
+        password: str,
+        bw_path: str = None,
+        cache: SecretCache = None,
+        session_store: SessionStore = None,
+        read_data_file: bool = False,
+        command_timeout: float = DEFAULT_COMMAND_TIMEOUT,
+    ):
         """
         Logs in bitwarden if not already.
 
         Args:
             email (str): The email of the user
             password (str): The password of the user
+            bw_path (str, optional): Path to the Bitwarden CLI executable. Defaults to
+                                     GRIMOIRELAB_ENIGMA_BW_PATH or /snap/bin/bw.
+            cache (SecretCache, optional): Cache for the retrieved items
+            session_store (SessionStore, optional): Where to keep the session key, so
+                                                    other processes don't unlock the vault again
+            read_data_file (bool): Whether to decrypt the items from the data file of
+                                   the CLI in the process instead of listing them with it
+            command_timeout (float): Seconds a CLI command may run before it is killed
 
         Raises:
             FileNotFoundError: If no credentials file is found
         """
         # Session key of the bw session
         self.session_key = None
-        self.formatted_credentials = {}
+        self.bw_path = bw_path or os.environ.get("GRIMOIRELAB_ENIGMA_BW_PATH", DEFAULT_BW_PATH)
+        self.catalog = None
+        self._catalog_time = None
+        self._catalog_revision = None
+        # Signature of the data file and revision of its items, last time it was read
+        self._data_file_state = None
+        self.cache = cache if cache is not None else SecretCache()
+        self.session_store = session_store
+        self.read_data_file = read_data_file
+        self.command_timeout = command_timeout
+        # Guards the session, the sync state and the catalog
+        self._lock = threading.RLock()
+        # Commands for the same CLI data are run one at a time
+        self._commands = get_command_queue((self.bw_path, os.path.dirname(self._data_file())))
         # store email for session validation
         self._email = email
         self.last_sync_time = None
         self.sync_interval = timedelta(minutes=3)
 
         try:
-            self._login(email, password)
+            with get_tracer().span("bitwarden.login", backend="bitwarden"):
+                self._login(email, password)
         except FileNotFoundError:
             _logger.error("File not found")
 
@@ -74,6 +124,11 @@ class BitwardenManager:
             Exception: If unlocking or logging into Bitwarden fails.
         """
         try:
+            if not self.session_key and self._restore_session(bw_email):
+                if self._should_sync():
+                    self._sync_vault()
+                return self.session_key
+
             # If we have a session key, check if sync is needed
             if self.session_key and self._validate_session():
                 if self._should_sync():
@@ -81,8 +136,8 @@ class BitwardenManager:
                 return self.session_key
 
             _logger.info("Checking Bitwarden login status")
-            status_result = subprocess.run(
-                ["/snap/bin/bw", "status"], capture_output=True, text=True, check=False
+            status_result = self._run(
+                [self.bw_path, "status"], capture_output=True, text=True, check=False
             )
 
             if status_result.returncode == 0:
@@ -98,12 +153,13 @@ class BitwardenManager:
 
                     elif status.get("status") == "locked":
                         _logger.info("Vault locked, unlocking")
-                        unlock_result = subprocess.run(
-                            ["/snap/bin/bw", "unlock", bw_password, "--raw"],
-                            capture_output=True,
-                            text=True,
-                            check=False,
-                        )
+                        with get_tracer().span("bitwarden.unlock", backend="bitwarden"):
+                            unlock_result = self._run(
+                                [self.bw_path, "unlock", bw_password, "--raw"],
+                                capture_output=True,
+                                text=True,
+                                check=False,
+                            )
 
                         if unlock_result.returncode != 0:
                             _logger.error(
@@ -119,8 +175,8 @@ class BitwardenManager:
 
                 else:
                     _logger.info("Login in: %s", bw_email)
-                    result = subprocess.run(
-                        ["/snap/bin/bw", "login", bw_email, bw_password, "--raw"],
+                    result = self._run(
+                        [self.bw_path, "login", bw_email, bw_password, "--raw"],
                         capture_output=True,
                         text=True,
                         check=False,
@@ -134,13 +190,15 @@ class BitwardenManager:
                     self.session_key = result.stdout.strip()
 
             if self.session_key:
+                self._store_session(bw_email)
                 # Only sync if needed based on time interval
                 if self._should_sync():
                     _logger.info("Syncing local vault with Bitwarden")
-                    subprocess.run(
-                        ["/snap/bin/bw", "sync", "--session", self.session_key],
-                        check=True,
-                    )
+                    with get_tracer().span("bitwarden.sync", backend="bitwarden"):
+                        self._run(
+                            [self.bw_path, "sync", "--session", self.session_key],
+                            check=True,
+                        )
                     self.last_sync_time = datetime.now()
                 return self.session_key
 
@@ -151,11 +209,62 @@ class BitwardenManager:
             _logger.error("There was a problem login in: %s", e)
             raise e
 
+    def _run(self, args: list, **kwargs) -> subprocess.CompletedProcess:
+        """
+        Runs a CLI command through the command queue of the CLI data.
+
+        The command is killed when it runs past the command timeout or the
+        deadline of the lookup, raising subprocess.TimeoutExpired.
+        """
+        kwargs.setdefault("timeout", timeout_for(self.command_timeout))
+        return self._commands.run(args, **kwargs)
+
+    def _restore_session(self, bw_email: str) -> bool:
+        """
+        Reuses the session key stored by a previous process, if still valid.
+
+        Returns:
+            bool: Whether a valid session key was restored
+        """
+        if self.session_store is None:
+            return False
+
+        session_key = self.session_store.load(bw_email)
+        if not session_key:
+            return False
+
+        if self._check_session(session_key):
+            _logger.info("Reusing stored Bitwarden session")
+            self.session_key = session_key
+            return True
+
+        _logger.info("Stored Bitwarden session is no longer valid")
+        self.session_store.clear(bw_email)
+        return False
+
+    def _store_session(self, bw_email: str) -> None:
+        if self.session_store is None:
+            return
+        try:
+            self.session_store.save(bw_email, self.session_key)
+        except OSError as e:
+            _logger.warning("Could not store the Bitwarden session: %s", e)
+
+    def _check_session(self, session_key: str) -> bool:
+        """Checks that a session key unlocks the vault, without running the KDF."""
+        result = self._run(
+            [self.bw_path, "unlock", "--check", "--session", session_key],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        return result.returncode == 0
+
     def _validate_session(self) -> bool:
         """Checks current session."""
         try:
-            status_result = subprocess.run(
-                ["/snap/bin/bw", "status"], capture_output=True, text=True, check=False
+            status_result = self._run(
+                [self.bw_path, "status"], capture_output=True, text=True, check=False
             )
 
             if status_result.returncode != 0:
@@ -180,54 +289,288 @@ class BitwardenManager:
     def _sync_vault(self) -> None:
         """Syncs the vault and updates last sync time."""
         try:
-            _logger.info("Syncing vault")
-            subprocess.run(
-                ["/snap/bin/bw", "sync", "--session", self.session_key], check=True
-            )
-            self.last_sync_time = datetime.now()
+            _events.emit("bitwarden.sync", logging.DEBUG, "Syncing vault", backend="bitwarden")
+            with get_tracer().span("bitwarden.sync", backend="bitwarden"), self._lock:
+                self._run(
+                    [self.bw_path, "sync", "--session", self.session_key], check=True
+                )
+                self.last_sync_time = datetime.now()
         except subprocess.CalledProcessError as e:
-            _logger.error("Sync failed: %s", e)
+            _events.emit("bitwarden.sync_error", logging.ERROR, "Sync failed: %s", e, backend="bitwarden")
 
     def _retrieve_credentials(self, service_name: str) -> dict:
         """
         Retrieves a secret from a particular service from the Bitwarden vault.
 
+        Items are kept in the manager cache. If the CLI fails, the last item
+        retrieved is served while the cache grace period lasts.
+
         Args:
             service_name (str): The name of the data source for which to retrieve the secret.
 
         Returns:
             dict: The secret item retrieved from Bitwarden as a dictionary.
+                  Empty if the item could not be retrieved.
 
         Raises:
             Exception: If retrieval of the secret fails.
         """
         try:
-            _logger.info("Retrieving credential from Bitwarden CLI: %s", service_name)
-            result = subprocess.run(
-                [
-                    "/snap/bin/bw",
-                    "get",
-                    "item",
-                    service_name,
-                    "--session",
-                    self.session_key,
-                ],
-                capture_output=True,
-                text=True,
-                check=False,
+            return self.cache.get(
+                service_name,
+                lambda: self._fetch_item(service_name),
+                fallback_errors=UNAVAILABLE_ERRORS,
             )
+        except LookupError as e:
+            _events.emit("bitwarden.retrieve_error", logging.ERROR, "Failed to retrieve secret %s: %s",
+                         service_name, e, backend="bitwarden", service=service_name)
+            return {}
+        except subprocess.CalledProcessError as e:
+            _events.emit("bitwarden.retrieve_error", logging.ERROR, "Failed to retrieve secret %s: %s",
+                         service_name, e.stderr, backend="bitwarden", service=service_name)
+            return {}
+        except Exception as e:
+            _events.emit("bitwarden.error", logging.ERROR, "There was a problem retrieving secret %s: %s",
+                         service_name, e, backend="bitwarden", service=service_name)
+            raise e
 
-            if result.returncode != 0:
-                _logger.error("Failed to retrieve secret: %s", result.stderr)
-                return {}
+    def _fetch_item(self, service_name: str) -> dict:
+        """
+        Finds an item in the catalog of the vault.
 
-            retrieved_secrets = json.loads(result.stdout)
-            _logger.info("Secrets successfully retrieved")
-            return retrieved_secrets
+        If the item is not found and the vault is due for a sync, the vault is
+        synced and the lookup is done once more. Items left out of a catalog
+        over its memory budget are asked to the CLI.
 
-        except Exception as e:
-            _logger.error("There was a problem retrieving secret: %s", e)
-            raise e
+        Args:
+            service_name (str): Id, name or folder/collection path of the item.
+
+        Returns:
+            dict: The item as a dictionary.
+
+        Raises:
+            LookupError: If the item does not exist.
+            subprocess.CalledProcessError: If the CLI failed.
+        """
+        with get_tracer().span("bitwarden.resolve", backend="bitwarden", service=service_name) as span, \
+                self._lock:
+            item = self._get_catalog().resolve(service_name)
+            if item is None and self._should_sync():
+                self._sync_vault()
+                item = self._get_catalog().resolve(service_name)
+            if item is None and not self.catalog.complete:
+                item = self._get_item(service_name)
+
+            if item is None:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                raise LookupError(f"Not found: {service_name}")
+            return item.to_dict()
+
+    def _get_catalog(self) -> BitwardenCatalog:
+        """
+        Returns the catalog of the vault, updating it after a sync.
+
+        `bw sync` rewrites the local data file every time, but the items in
+        it only change when the vault changed on the server. The catalog is
+        updated after a sync only if the revisions of those items changed,
+        and the update only rebuilds the entries of the items that changed.
+        """
+        if self.catalog is None:
+            revision = self._data_file_revision()
+            self.catalog, complete = self._load_items(
+                lambda items: BitwardenCatalog(items, paths_loader=self._list_paths)
+            )
+            self.catalog.complete = self.catalog.complete and complete
+            self._catalog_time = datetime.now()
+            self._catalog_revision = revision
+            _logger.info("Indexed %s Bitwarden items", len(self.catalog))
+
+        elif self.last_sync_time and self._catalog_time < self.last_sync_time:
+            revision = self._data_file_revision()
+            if revision is None or revision != self._catalog_revision:
+                changed, complete = self._load_items(self.catalog.update)
+                self.catalog.complete = self.catalog.complete and complete
+                _logger.info("Updated %s Bitwarden items", len(changed))
+            else:
+                _logger.debug("Bitwarden vault unchanged since the last sync")
+            self._catalog_time = datetime.now()
+            self._catalog_revision = revision
+        return self.catalog
+
+    def _load_items(self, apply) -> tuple:
+        """
+        Passes the items of the vault to apply.
+
+        Items are decrypted from the data file of the CLI when enabled, and
+        listed with the CLI otherwise or if the file can't be read.
+
+        Args:
+            apply (callable): Function taking an iterable of items
+
+        Returns:
+            tuple: What apply returned, and whether every item was passed
+        """
+        if self.read_data_file:
+            try:
+                data_file = BitwardenDataFile(self._data_file(), self.session_key)
+                with get_tracer().span("bitwarden.parse", backend="bitwarden"):
+                    result = apply(data_file.items())
+                if data_file.skipped:
+                    _logger.info("%s Bitwarden items left to the CLI", data_file.skipped)
+                return result, not data_file.skipped
+            except (ImportError, OSError, ValueError) as e:
+                _logger.warning("Could not read the Bitwarden data file, listing with the CLI: %s", e)
+
+        output = self._run_list("items")
+        with get_tracer().span("bitwarden.parse", backend="bitwarden"):
+            return apply(iter_json_array(io.StringIO(output))), True
+
+    def _data_file(self) -> str:
+        """Path of the local data file of the Bitwarden CLI."""
+        directory = os.environ.get("BITWARDENCLI_APPDATA_DIR")
+        if not directory:
+            if sys.platform == "darwin":
+                base = os.path.expanduser(os.path.join("~", "Library", "Application Support"))
+            elif sys.platform == "win32":
+                base = os.environ.get("APPDATA", "")
+            elif self.bw_path.startswith("/snap/"):
+                base = os.path.expanduser(os.path.join("~", "snap", "bw", "current", ".config"))
+            else:
+                base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser(os.path.join("~", ".config"))
+            directory = os.path.join(base, "Bitwarden CLI")
+        return os.path.join(directory, "data.json")
+
+    def _data_file_revision(self) -> str:
+        """
+        Revision of the items in the local data file, None if it can't be read.
+
+        The file is rewritten on every sync, so the revisions of its items
+        are compared instead, and only read again when the file changed.
+        """
+        path = self._data_file()
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if self._data_file_state is not None and self._data_file_state[0] == signature:
+                return self._data_file_state[1]
+            revision = data_file_revision(path)
+        except (OSError, ValueError) as e:
+            _logger.debug("Could not read the revision of the Bitwarden data file: %s", e)
+            return None
+        self._data_file_state = (signature, revision)
+        return revision
+
+    def _list_paths(self) -> tuple:
+        return self._list("folders"), self._list("collections")
+
+    def _list(self, kind: str) -> list:
+        """
+        Lists objects of the vault with the Bitwarden CLI.
+
+        Args:
+            kind (str): Type of object: items, folders or collections.
+
+        Returns:
+            list: The objects listed.
+
+        Raises:
+            subprocess.CalledProcessError: If the CLI failed.
+        """
+        output = self._run_list(kind)
+        with get_tracer().span("bitwarden.parse", backend="bitwarden"):
+            return json.loads(output)
+
+    def _run_list(self, kind: str) -> str:
+        """Runs `bw list` and returns its JSON output."""
+        _events.emit("bitwarden.list", logging.DEBUG, "Listing Bitwarden %s", kind, backend="bitwarden")
+        with get_tracer().span("bitwarden.fetch", backend="bitwarden"):
+            return self._run_bw(["list", kind])
+
+    def _get_item(self, service_name: str):
+        """
+        Gets an item left out of the catalog with the Bitwarden CLI.
+
+        `bw get item` fails when a name matches several items, so the items
+        found searching the name (its last segment, for paths) are resolved
+        the way the catalog does. Only if none of them resolves is the CLI
+        asked for the item, which finds it when it is looked up by id.
+
+        Returns:
+            BitwardenItem: The item, or None if the CLI can't find it.
+        """
+        _events.emit("bitwarden.fetch", logging.DEBUG, "Getting Bitwarden item %s", service_name,
+                     backend="bitwarden", service=service_name)
+        with get_tracer().span("bitwarden.fetch", backend="bitwarden", service=service_name):
+            output = self._run_bw(["list", "items", "--search", service_name.rsplit("/", 1)[-1]])
+            with get_tracer().span("bitwarden.parse", backend="bitwarden", service=service_name):
+                item = BitwardenCatalog.from_json(output, paths_loader=self._list_paths).resolve(service_name)
+            if item is not None:
+                return item
+            try:
+                output = self._run_bw(["get", "item", service_name])
+            except subprocess.CalledProcessError as e:
+                if "Not found" in (e.stderr or ""):
+                    return None
+                raise
+        return BitwardenItem.from_dict(json.loads(output))
+
+    def _run_bw(self, command: list) -> str:
+        """
+        Runs a command of the Bitwarden CLI in the current session.
+
+        Raises:
+            subprocess.CalledProcessError: If the CLI failed.
+        """
+        args = [self.bw_path] + command + ["--session", self.session_key]
+        result = self._run(
+            args,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(
+                result.returncode, args, result.stdout, result.stderr
+            )
+        return result.stdout
+
+    def get_versions(self, services: list) -> dict:
+        """
+        Returns the revision date of each item, syncing the vault if due.
+
+        Args:
+            services (list): Ids, names or folder/collection paths of the items
+
+        Returns:
+            dict: Revision date of each item found, by the name given
+        """
+        with self._lock:
+            if self._should_sync():
+                self._sync_vault()
+            catalog = self._get_catalog()
+
+            versions = {}
+            for service_name in services:
+                item = catalog.resolve(service_name)
+                if item is not None:
+                    versions[service_name] = item.revision_date
+            return versions
+
+    def warmup(self) -> None:
+        """
+        Indexes the vault, so the first lookup doesn't wait for it.
+
+        The vault is unlocked and synced when the manager is created; the
+        items are listed, or decrypted from the data file, here.
+        """
+        with get_tracer().span("bitwarden.warmup", backend="bitwarden"), self._lock:
+            if self._should_sync():
+                self._sync_vault()
+            self._get_catalog()
+
+    def invalidate(self, service_name: str) -> None:
+        """Drops an item from the cache, so it is retrieved again."""
+        self.cache.invalidate(service_name)
 
     def _format_credentials(self, credentials: dict) -> dict:
         """
@@ -254,36 +597,44 @@ class BitwardenManager:
 
         return formatted
 
-    def get_secret(self, service_name: str, credential_name: str) -> str:
+    def get_secret(self, service_name: str, credential_name: str, deadline=None) -> str:
         """
         Retrieves a secret by name from the Bitwarden vault.
 
         Args:
             service_name (str): The name of the secret to retrieve.
             credential_name (str): The concrete credential to retrieve.
+            deadline (Deadline or float, optional): Deadline of the lookup, or seconds it may take
 
         Returns:
             str: The secret value retrieved.
+
+        Raises:
+            subprocess.TimeoutExpired: If the CLI didn't answer before the deadline.
+            DeadlineExceeded: If the deadline passed before running the CLI.
         """
 
-        # If stored credentials are not available or belong to a different service
-        if (
-            not self.formatted_credentials
-            or self.formatted_credentials.get("service_name") != service_name
-        ):
+        with get_tracer().span("bitwarden.get_secret", backend="bitwarden", service=service_name) as span, \
+                deadline_scope(deadline):
+            # Items are cached by the exact name looked up, so services whose
+            # names differ in case never get each other's item
             unformatted_credentials = self._retrieve_credentials(service_name)
-            self.formatted_credentials = self._format_credentials(
-                unformatted_credentials
-            )
-
-        secret = self.formatted_credentials.get(credential_name)
-        # in case nothing was found
-        if not secret:
-            _logger.error(
-                "The credential %s:%s, was not found.", service_name, credential_name
-            )
-            _logger.error("In the meantime here you got an empty string")
-            return ""
-        else:
-            # Return the requested credential
-            return secret
+            if not unformatted_credentials:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("bitwarden.not_found", logging.ERROR, "The service %s was not found.",
+                             service_name, backend="bitwarden", service=service_name)
+                return ""
+            with get_tracer().span("bitwarden.format", backend="bitwarden", service=service_name):
+                formatted_credentials = self._format_credentials(unformatted_credentials)
+
+            secret = formatted_credentials.get(credential_name)
+            # in case nothing was found
+            if not secret:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("bitwarden.not_found", logging.ERROR,
+                             "The credential %s:%s, was not found. Returning an empty string.",
+                             service_name, credential_name, backend="bitwarden", service=service_name)
+                return ""
+            else:
+                # Return the requested credential
+                return secret
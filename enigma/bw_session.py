@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_TTL = 8 * 3600
+DEFAULT_SESSION_FILE = os.path.join("~", ".cache", "grimoirelab-enigma", "bw-sessions.json")
+KEYRING_SERVICE = "grimoirelab-enigma-bw"
+
+
+class SessionStore:
+    """
+    Keeps Bitwarden session keys between processes.
+
+    Keys are stored per account email together with an expiration time.
+    Expired keys are never returned.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_SESSION_TTL):
+        """
+        Args:
+            ttl (float): Seconds a stored session key is reused
+        """
+        self.ttl = ttl
+
+    def load(self, email: str) -> str:
+        """Returns the session key stored for an account, None if there is none or it expired."""
+        record = self._read(email)
+        if not record or record.get("expires", 0) <= time.time():
+            return None
+        return record.get("key")
+
+    def save(self, email: str, session_key: str) -> None:
+        """Stores the session key of an account."""
+        self._write(email, {"key": session_key, "expires": time.time() + self.ttl})
+
+    def clear(self, email: str) -> None:
+        """Forgets the session key of an account."""
+        self._write(email, None)
+
+    def _read(self, email: str) -> dict:
+        raise NotImplementedError
+
+    def _write(self, email: str, record: dict) -> None:
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """
+    Stores session keys in a JSON file only readable by its owner.
+
+    The file is replaced atomically on every change, so concurrent
+    processes never read it half written.
+    """
+
+    def __init__(self, path: str = DEFAULT_SESSION_FILE, ttl: float = DEFAULT_SESSION_TTL):
+        """
+        Args:
+            path (str): Path of the file
+            ttl (float): Seconds a stored session key is reused
+        """
+        super().__init__(ttl)
+        self.path = os.path.expanduser(path)
+
+    def _load_file(self) -> dict:
+        try:
+            with open(self.path) as fd:
+                records = json.load(fd)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            _logger.warning("Could not read the Bitwarden session file: %s", e)
+            return {}
+        return records if isinstance(records, dict) else {}
+
+    def _read(self, email: str) -> dict:
+        if os.path.exists(self.path) and os.stat(self.path).st_mode & 0o077:
+            _logger.warning("Ignoring %s, it can be read by other users", self.path)
+            return None
+        return self._load_file().get(email)
+
+    def _write(self, email: str, record: dict) -> None:
+        records = self._load_file()
+        if record is None:
+            if email not in records:
+                return
+            del records[email]
+        else:
+            records[email] = record
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".bw-sessions-")
+        try:
+            with os.fdopen(fd, "w") as temporary:
+                json.dump(records, temporary)
+            os.chmod(temporary_path, 0o600)
+            os.replace(temporary_path, self.path)
+        except OSError:
+            os.unlink(temporary_path)
+            raise
+
+
+class KeyringSessionStore(SessionStore):
+    """
+    Stores session keys in the keyring of the operating system.
+
+    Requires the keyring package.
+    """
+
+    def __init__(self, service: str = KEYRING_SERVICE, ttl: float = DEFAULT_SESSION_TTL):
+        """
+        Args:
+            service (str): Name the keys are stored under in the keyring
+            ttl (float): Seconds a stored session key is reused
+
+        Raises:
+            ImportError: If keyring is not installed
+        """
+        super().__init__(ttl)
+        try:
+            import keyring
+        except ImportError as e:
+            _logger.error("keyring is not installed: %s", e)
+            raise e
+        self._keyring = keyring
+        self.service = service
+
+    def _read(self, email: str) -> dict:
+        try:
+            value = self._keyring.get_password(self.service, email)
+            return json.loads(value) if value else None
+        except Exception as e:
+            _logger.warning("Could not read the Bitwarden session from the keyring: %s", e)
+            return None
+
+    def _write(self, email: str, record: dict) -> None:
+        try:
+            if record is None:
+                if self._keyring.get_password(self.service, email) is not None:
+                    self._keyring.delete_password(self.service, email)
+            else:
+                self._keyring.set_password(self.service, email, json.dumps(record))
+        except Exception as e:
+            _logger.warning("Could not store the Bitwarden session in the keyring: %s", e)
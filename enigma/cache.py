@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .events import EventLogger
+
+_logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+DEFAULT_TTL = 300
+DEFAULT_STALE_TTL = 60
+DEFAULT_GRACE_PERIOD = 900
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def sizeof(value) -> int:
+    """
+    Approximate memory used by a credential document, in bytes.
+
+    Containers are measured together with everything they hold.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sizeof(key) + sizeof(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += sizeof(item)
+    return size
+
+
+class _Entry:
+    """A cached value, the moment it was loaded and its size."""
+
+    __slots__ = ("value", "loaded", "ttl", "size")
+
+    def __init__(self, value, loaded: float, ttl: float, size: int):
+        self.value = value
+        self.loaded = loaded
+        self.ttl = ttl
+        self.size = size
+
+
+class SecretCache:
+    """
+    In-memory cache for the credential documents retrieved by the managers.
+
+    Entries go through three stages once loaded:
+
+    - fresh, while younger than ttl: the cached value is returned.
+    - stale, for stale_ttl seconds more: the cached value is returned right
+      away and a background refresh is started.
+    - expired: the value is loaded again before returning. If the backend
+      is unreachable the last known good value is served until grace_period
+      seconds after its expiration.
+
+    The cache holds at most max_bytes of credential documents. When a new
+    value doesn't fit, the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        stale_ttl: float = DEFAULT_STALE_TTL,
+        grace_period: float = DEFAULT_GRACE_PERIOD,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        """
+        Args:
+            ttl (float): Seconds a loaded value is considered fresh
+            stale_ttl (float): Seconds after ttl a stale value is served while refreshing
+            grace_period (float): Seconds after ttl the last good value is served on errors
+            max_bytes (int): Memory budget of the cached values, in bytes
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.grace_period = grace_period
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._usage = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader, ttl=None, fallback_errors: tuple = ()):
+        """
+        Returns the value cached for key, loading it with loader when needed.
+
+        Args:
+            key (str): Cache key, usually the service name
+            loader (callable): Function without arguments returning the value
+            ttl (float or callable, optional): Time to live for this value, or a
+                function computing it from the loaded value. Defaults to the cache ttl.
+            fallback_errors (tuple): Exceptions raised by loader meaning that the
+                backend is unavailable, so the last known good value can be served
+
+        Returns:
+            The cached or loaded value
+
+        Raises:
+            Exception: Whatever loader raises when no value can be served instead
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            age = now - entry.loaded
+            if age < entry.ttl:
+                return entry.value
+            if age < entry.ttl + self.stale_ttl:
+                self._refresh_in_background(key, loader, ttl, fallback_errors)
+                return entry.value
+
+        try:
+            return self._load(key, loader, ttl)
+        except fallback_errors as e:
+            if entry is not None and now - entry.loaded < entry.ttl + self.grace_period:
+                _events.emit("cache.grace", logging.WARNING,
+                             "Backend unavailable, serving last known value for %s: %s", key, e, service=key)
+                return entry.value
+            raise e
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        Removes an entry from the cache.
+
+        Args:
+            key (str, optional): Key to remove. If not given, the whole cache is cleared.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._usage = 0
+            else:
+                self._remove(key)
+
+    def put(self, key: str, value, ttl: float = None) -> None:
+        """
+        Caches a value loaded outside of get, such as in a bulk fetch.
+
+        Args:
+            key (str): Cache key, usually the service name
+            value: Value to cache
+            ttl (float, optional): Time to live for this value. Defaults to the cache ttl.
+        """
+        self._store(key, value, self._ttl_for(value, ttl), time.monotonic())
+
+    @property
+    def usage(self) -> int:
+        """Bytes taken by the cached values."""
+        with self._lock:
+            return self._usage
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _load(self, key: str, loader, ttl):
+        value = loader()
+        self._store(key, value, self._ttl_for(value, ttl), time.monotonic())
+        return value
+
+    def _ttl_for(self, value, ttl) -> float:
+        if ttl is None:
+            return self.ttl
+        if callable(ttl):
+            return ttl(value)
+        return ttl
+
+    def _store(self, key: str, value, ttl: float, loaded: float) -> None:
+        """Keeps a value loaded at the given monotonic time, evicting others if needed."""
+        entry = _Entry(value, loaded, ttl, sizeof(value))
+        with self._lock:
+            self._remove(key)
+            if entry.size > self.max_bytes:
+                _logger.warning("%s takes %s bytes, over the cache budget; not caching it", key, entry.size)
+                return
+            while self._usage + entry.size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._usage -= evicted.size
+                _logger.debug("Evicted %s from the cache", evicted_key)
+            self._entries[key] = entry
+            self._usage += entry.size
+
+    def _remove(self, key: str) -> None:
+        """Drops an entry. Must be called holding the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._usage -= entry.size
+
+    def _refresh_in_background(self, key: str, loader, ttl, fallback_errors: tuple) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        thread = threading.Thread(
+            target=self._refresh,
+            args=(key, loader, ttl, fallback_errors),
+            name=f"enigma-refresh-{key}",
+            daemon=True,
+        )
+        thread.start()
+
+    def _refresh(self, key: str, loader, ttl, fallback_errors: tuple) -> None:
+        try:
+            self._load(key, loader, ttl)
+        except fallback_errors as e:
+            _events.emit("cache.refresh_error", logging.WARNING,
+                         "Could not refresh %s, keeping the stale value: %s", key, e, service=key)
+        except Exception as e:
+            _events.emit("cache.refresh_error", logging.ERROR,
+                         "Could not refresh %s, dropping it from the cache: %s", key, e, service=key)
+            self.invalidate(key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
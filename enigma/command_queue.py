@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import concurrent.futures
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+class CommandQueue:
+    """
+    Runs commands one at a time in a worker thread.
+
+    The Bitwarden CLI keeps its state in a data directory that concurrent
+    invocations can corrupt, so every command for the same directory goes
+    through one queue. The queue is bounded: when it is full, callers wait
+    for room instead of piling up commands.
+
+    The timeout of a command covers the time it waits in the queue too:
+    the caller stops waiting when it runs out, even behind a slow command.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE):
+        """
+        Args:
+            maxsize (int): Commands that can wait in the queue
+        """
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run(self, args: list, **kwargs) -> subprocess.CompletedProcess:
+        """
+        Runs a command once the previous ones have finished.
+
+        Takes the same arguments as subprocess.run and returns or raises what it does.
+        """
+        if threading.current_thread() is self._thread:
+            return subprocess.run(args, **kwargs)
+
+        timeout = kwargs.get("timeout")
+        expires = time.monotonic() + timeout if timeout is not None else None
+        future = concurrent.futures.Future()
+        self._start()
+        try:
+            self._queue.put((future, args, kwargs, expires), timeout=timeout)
+        except queue.Full:
+            raise subprocess.TimeoutExpired(args, timeout)
+        try:
+            return future.result(timeout=max(expires - time.monotonic(), 0) if expires is not None else None)
+        except concurrent.futures.TimeoutError:
+            # Not run if still queued; if running, subprocess.run kills it at the same time
+            future.cancel()
+            raise subprocess.TimeoutExpired(args, timeout)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name="enigma-bw-commands", daemon=True)
+                self._thread.start()
+
+    def _work(self) -> None:
+        while True:
+            future, args, kwargs, expires = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    if expires is not None:
+                        remaining = expires - time.monotonic()
+                        if remaining <= 0:
+                            raise subprocess.TimeoutExpired(args, kwargs["timeout"])
+                        kwargs = dict(kwargs, timeout=remaining)
+                    future.set_result(subprocess.run(args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            self._queue.task_done()
+
+
+def get_command_queue(key) -> CommandQueue:
+    """
+    Returns the command queue shared by the process for a key.
+
+    Args:
+        key: What the commands act on, such as the CLI data directory
+    """
+    with _queues_lock:
+        command_queue = _queues.get(key)
+        if command_queue is None:
+            command_queue = _queues[key] = CommandQueue()
+        return command_queue
+
+
+def _reset_command_queues() -> None:
+    """Forgets the queues, whose worker threads don't survive a fork."""
+    global _queues_lock
+    _queues_lock = threading.Lock()
+    _queues.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_command_queues)
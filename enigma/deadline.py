@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import contextlib
+import contextvars
+import time
+
+_current = contextvars.ContextVar("enigma_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The time given to retrieve a secret ran out."""
+
+
+class Deadline:
+    """
+    Point in time by which a lookup must be finished.
+
+    A deadline is set once by the caller and every request made on its
+    behalf (CLI commands, HTTP calls) gets the time that is left of it as
+    its timeout.
+    """
+
+    __slots__ = ("expires",)
+
+    def __init__(self, timeout: float):
+        """
+        Args:
+            timeout (float): Seconds from now until the deadline
+        """
+        self.expires = time.monotonic() + timeout
+
+    @classmethod
+    def of(cls, deadline) -> "Deadline":
+        """
+        Returns a deadline from a Deadline or a number of seconds.
+
+        None is returned as is, meaning there is no deadline.
+        """
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline)
+
+    def remaining(self) -> float:
+        """Seconds left until the deadline, 0 once it passed."""
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def timeout(self, default: float = None) -> float:
+        """
+        Returns the timeout for a request made now.
+
+        Args:
+            default (float, optional): Timeout of the request when it is shorter
+                than the time left
+
+        Raises:
+            DeadlineExceeded: If the deadline already passed
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
+        if default is not None:
+            return min(default, remaining)
+        return remaining
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """
+    Makes a deadline the current one within the block.
+
+    A deadline already in place is kept when it is earlier than the new one.
+
+    Args:
+        deadline (Deadline or float): Deadline or seconds from now, None for no new deadline
+    """
+    deadline = Deadline.of(deadline)
+    current = _current.get()
+    if deadline is None or (current is not None and current.expires <= deadline.expires):
+        yield current
+        return
+
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current_deadline() -> Deadline:
+    """Returns the deadline of the lookup in progress, None if there is none."""
+    return _current.get()
+
+
+def timeout_for(default: float = None) -> float:
+    """
+    Timeout for a request made now under the current deadline.
+
+    Args:
+        default (float, optional): Timeout to use without a deadline, or when shorter
+
+    Raises:
+        DeadlineExceeded: If the current deadline already passed
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return deadline.timeout(default)
+
+
+def check_deadline() -> None:
+    """
+    Raises DeadlineExceeded if the deadline of the lookup in progress passed.
+
+    Called before requests whose timeout is fixed when their client is created.
+    """
+    timeout_for()
@@ -19,53 +19,321 @@
 #
 
 import argparse
+import concurrent.futures
 import logging
+import os
 import sys
+import threading
+import time
 
+from .deadline import Deadline, DeadlineExceeded, deadline_scope
+from .events import EventLogger
 from .secrets_manager_factory import SecretsManagerFactory
+from .tracing import get_tracer, OUTCOME_NOT_FOUND
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 _logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+SUPPORTED_MANAGERS = ("bitwarden", "hashicorp", "aws", "local")
+
+# Backend that answered last time for every (chain, service)
+_resolved_backends = {}
+_resolved_lock = threading.Lock()
+
+
+def _get_manager(secrets_manager_name: str):
+    """Returns the manager for the given secrets manager name."""
+    if secrets_manager_name == "bitwarden":
+        return SecretsManagerFactory.get_bitwarden_manager()
+
+    elif secrets_manager_name == "hashicorp":
+        return SecretsManagerFactory.get_hashicorp_manager()
+
+    elif secrets_manager_name == "aws":
+        return SecretsManagerFactory.get_aws_manager()
+
+    elif secrets_manager_name == "local":
+        return SecretsManagerFactory.get_local_manager()
+
+    else:
+        raise ValueError(f"Unsupported secrets manager: {secrets_manager_name}")
+
+
+def _lookup(
+    secrets_manager_name: str, service_name: str, credential_name: str, deadline: Deadline = None
+) -> str:
+    # The deadline also bounds the login of a manager created for this lookup
+    with deadline_scope(deadline):
+        manager = _get_manager(secrets_manager_name)
+        # Managers written before deadlines existed are still supported
+        if deadline is None:
+            return manager.get_secret(service_name, credential_name)
+        return manager.get_secret(service_name, credential_name, deadline=deadline)
+
+
+def _lookup_with_timeout(
+    secrets_manager_name: str,
+    service_name: str,
+    credential_name: str,
+    timeout: float,
+    deadline: Deadline = None,
+) -> str:
+    """
+    Runs a lookup in its own thread and waits for it at most timeout seconds.
+
+    The lookup is not interrupted when the timeout expires, it is just not
+    waited for anymore. Every lookup gets a new daemon thread instead of a
+    pool worker, so lookups left hanging never hold up later ones, and the
+    timeout is spent waiting for the backend only.
+    """
+    future = concurrent.futures.Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(_lookup(secrets_manager_name, service_name, credential_name, deadline))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"enigma-lookup-{secrets_manager_name}", daemon=True).start()
+    return future.result(timeout=timeout)
+
+
+def _get_secret_with_failover(
+    chain: tuple, service_name: str, credential_name: str, timeouts: dict, deadline: Deadline = None
+) -> str:
+    """
+    Tries every backend of the chain in order until one returns the secret.
+
+    The backend that answered is remembered, so later lookups of the same
+    service start with it. Backends are not waited for past the deadline.
+    """
+    with _resolved_lock:
+        resolved = _resolved_backends.get((chain, service_name))
+    if resolved:
+        backends = [resolved] + [backend for backend in chain if backend != resolved]
+    else:
+        backends = list(chain)
+
+    last_error = None
+    answered = False
+    for backend in backends:
+        timeout = timeouts.get(backend)
+        if deadline is not None:
+            if deadline.expired:
+                last_error = DeadlineExceeded(f"Deadline exceeded before trying {backend}")
+                break
+            timeout = deadline.timeout(timeout)
+        try:
+            if timeout is None:
+                secret = _lookup(backend, service_name, credential_name)
+            else:
+                secret = _lookup_with_timeout(backend, service_name, credential_name, timeout, deadline)
+        except concurrent.futures.TimeoutError:
+            _events.emit("enigma.failover", logging.WARNING,
+                         "%s did not answer in %s seconds, trying next backend", backend, timeout,
+                         backend=backend, service=service_name)
+            last_error = TimeoutError(f"{backend} timed out after {timeout} seconds")
+            continue
+        except Exception as e:
+            _events.emit("enigma.failover", logging.WARNING, "%s failed, trying next backend: %s", backend, e,
+                         backend=backend, service=service_name)
+            last_error = e
+            continue
+
+        answered = True
+        if secret:
+            with _resolved_lock:
+                _resolved_backends[(chain, service_name)] = backend
+            return secret
+        _events.emit("enigma.not_found", logging.INFO, "%s:%s not found in %s, trying next backend",
+                     service_name, credential_name, backend, backend=backend, service=service_name)
+
+    with _resolved_lock:
+        _resolved_backends.pop((chain, service_name), None)
+    if not answered and last_error is not None:
+        raise last_error
+    return ""
 
 
 def get_secret(
-    secrets_manager_name: str, service_name: str, credential_name: str
+    secrets_manager_name,
+    service_name: str,
+    credential_name: str,
+    timeouts: dict = None,
+    deadline: float = None,
 ) -> str:
     """
     Retrieve a secret from the secrets manager.
 
+    A list of secrets managers can be given instead of a single one. They
+    are tried in order, falling through to the next one when a manager
+    fails, times out or doesn't have the secret.
+
+    A deadline bounds the whole lookup: CLI commands and requests made for
+    it get the time left as their timeout, and no backend is waited for
+    once it passes.
+
     Args:
-        secrets_manager_name (str): The name of the secrets manager to be used
+        secrets_manager_name (str or list): The name of the secrets manager to be used,
+            or an ordered list of them
         service_name (str): The name of the service we want to access
         credential_name (str): The name of the credential we want to retrieve
+        timeouts (dict, optional): Seconds to wait for each secrets manager, by name
+        deadline (float or Deadline, optional): Seconds the whole lookup may take
 
     Returns:
         str: The credential retrieved
 
     Raises:
         ValueError: If the secrets manager is not supported or initialization fails
+        TimeoutError: If no secrets manager answered before the deadline
     """
-    try:
-        if secrets_manager_name == "bitwarden":
-            manager = SecretsManagerFactory.get_bitwarden_manager()
-            return manager.get_secret(service_name, credential_name)
+    if isinstance(secrets_manager_name, str):
+        chain = (secrets_manager_name,)
+    else:
+        chain = tuple(secrets_manager_name)
+    timeouts = timeouts or {}
+    deadline = Deadline.of(deadline)
 
-        elif secrets_manager_name == "hashicorp":
-            manager = SecretsManagerFactory.get_hashicorp_manager()
-            return manager.get_secret(service_name, credential_name)
+    with get_tracer().span(
+        "enigma.get_secret", backend=",".join(chain), service=service_name
+    ) as span:
+        try:
+            for backend in chain:
+                if backend not in SUPPORTED_MANAGERS:
+                    raise ValueError(f"Unsupported secrets manager: {backend}")
 
-        elif secrets_manager_name == "aws":
-            manager = SecretsManagerFactory.get_aws_manager()
-            return manager.get_secret(service_name, credential_name)
+            if len(chain) == 1 and not timeouts and deadline is None:
+                secret = _lookup(chain[0], service_name, credential_name)
+            else:
+                secret = _get_secret_with_failover(
+                    chain, service_name, credential_name, timeouts, deadline
+                )
+
+            if not secret:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+            return secret
+
+        except Exception as e:
+            _events.emit("enigma.error", logging.ERROR, "Error retrieving secret %s: %s", service_name, e,
+                         service=service_name)
+            raise
+
+
+def configured_managers() -> list:
+    """
+    Returns the secrets managers configured in the environment.
 
+    A manager is configured when the variables it needs to be created
+    without asking for anything are set: the Bitwarden email and password,
+    the Vault address and CA certificate, an AWS region or profile, or the
+    path of the local secrets.
+    """
+    environ = os.environ
+    managers = []
+    if environ.get("GRIMOIRELAB_ENIGMA_BW_EMAIL") and environ.get("GRIMOIRELAB_ENIGMA_BW_PASSWORD"):
+        managers.append("bitwarden")
+    if (
+        environ.get("GRIMOIRELAB_ENIGMA_VAULT_ADDR")
+        and environ.get("GRIMOIRELAB_ENIGMA_VAULT_CACERT")
+        and (environ.get("GRIMOIRELAB_ENIGMA_VAULT_TOKEN") or environ.get("GRIMOIRELAB_ENIGMA_VAULT_AUTH_METHOD"))
+    ):
+        managers.append("hashicorp")
+    if any(
+        environ.get(name)
+        for name in ("GRIMOIRELAB_ENIGMA_AWS_REGIONS", "AWS_REGION", "AWS_DEFAULT_REGION", "AWS_PROFILE")
+    ):
+        managers.append("aws")
+    if environ.get("GRIMOIRELAB_ENIGMA_LOCAL_PATH"):
+        managers.append("local")
+    return managers
+
+
+def _warmup(secrets_manager_name: str, deadline: Deadline = None) -> float:
+    """Creates and warms up a manager, returning the seconds it took."""
+    start = time.monotonic()
+    with deadline_scope(deadline):
+        manager = _get_manager(secrets_manager_name)
+        # Managers without warmup are ready once created
+        if hasattr(manager, "warmup"):
+            manager.warmup()
+    return time.monotonic() - start
+
+
+def warmup(secrets_managers: list = None, deadline: float = None) -> dict:
+    """
+    Creates the secrets managers and opens their connections, concurrently.
+
+    Otherwise every manager is created on its first lookup: Bitwarden
+    unlocks and indexes the vault, Vault logs in and connects to every
+    address, and AWS resolves its credentials and connects to the endpoint.
+    Warming them up at startup runs all of that at the same time, off the
+    path of the first lookups.
+
+    A manager that fails to warm up is not retried here; its first lookup
+    will try to create it again.
+
+    Args:
+        secrets_managers (list, optional): Names of the secrets managers. Defaults
+            to the ones configured in the environment.
+        deadline (float or Deadline, optional): Seconds the warmup may take
+
+    Returns:
+        dict: For every secrets manager, None if it is ready or the error that stopped it
+
+    Raises:
+        ValueError: If a secrets manager is not supported
+    """
+    if secrets_managers is None:
+        secrets_managers = configured_managers()
+    elif isinstance(secrets_managers, str):
+        secrets_managers = [secrets_managers]
+    for backend in secrets_managers:
+        if backend not in SUPPORTED_MANAGERS:
+            raise ValueError(f"Unsupported secrets manager: {backend}")
+    if not secrets_managers:
+        return {}
+    deadline = Deadline.of(deadline)
+
+    results = {}
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(secrets_managers), thread_name_prefix="enigma-warmup"
+    )
+    with get_tracer().span("enigma.warmup", backend=",".join(secrets_managers)):
+        futures = {
+            executor.submit(_warmup, backend, deadline): backend for backend in secrets_managers
+        }
+        # Managers still warming up at the deadline are left running in the background
+        executor.shutdown(wait=False)
+        done, pending = concurrent.futures.wait(
+            futures, timeout=deadline.remaining() if deadline is not None else None
+        )
+
+    for future, backend in futures.items():
+        if future in pending:
+            results[backend] = DeadlineExceeded(f"{backend} was not ready before the deadline")
         else:
-            raise ValueError(f"Unsupported secrets manager: {secrets_manager_name}")
+            results[backend] = future.exception()
 
-    except Exception as e:
-        _logger.error("Error retrieving secret: %s", e)
-        raise
+        if results[backend] is None:
+            _events.emit("enigma.warmup", logging.DEBUG, "%s ready in %.2f seconds",
+                         backend, future.result(), backend=backend)
+        else:
+            _events.emit("enigma.warmup_error", logging.WARNING, "Could not warm up %s: %s",
+                         backend, results[backend], backend=backend)
+    return results
+
+
+def _managers_list(value: str) -> list:
+    """Parses a comma separated list of secrets managers."""
+    managers = [manager.strip() for manager in value.split(",") if manager.strip()]
+    for manager in managers:
+        if manager not in SUPPORTED_MANAGERS:
+            raise argparse.ArgumentTypeError(
+                f"invalid choice: '{manager}' (choose from {', '.join(SUPPORTED_MANAGERS)})"
+            )
+    return managers
 
 
 def main():
@@ -78,19 +346,84 @@ def main():
     )
     parser.add_argument(
         "manager",
-        choices=["bitwarden", "hashicorp", "aws"],
-        help="The name of the secrets manager to use.",
+        type=_managers_list,
+        nargs="?",
+        help="The name of the secrets manager to use (bitwarden, hashicorp, aws, local). "
+             "A comma separated list is tried in order.",
+    )
+    parser.add_argument(
+        "service", nargs="?", help="The name of the service for which to retrieve the credential."
+    )
+    parser.add_argument("credential", nargs="?", help="The name of the credential to retrieve.")
+    parser.add_argument(
+        "--resolve",
+        metavar="CONFIG",
+        help="Replace the secret references (enigma://manager/service/credential or "
+             "${enigma:manager:service:credential}) of a config file by their values.",
+    )
+    parser.add_argument(
+        "--output",
+        help="File where the resolved config is written. Printed if not given.",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Fail when a secret reference can't be resolved.",
     )
     parser.add_argument(
-        "service", help="The name of the service for which to retrieve the credential."
+        "--timeout",
+        type=float,
+        help="Seconds to wait for each secrets manager before trying the next one.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds the whole lookup may take, across every secrets manager.",
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="Create the secrets managers and open their connections concurrently first. "
+             "Warms up the given ones, or every one configured in the environment.",
     )
-    parser.add_argument("credential", help="The name of the credential to retrieve.")
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    logging.getLogger("botocore").setLevel(logging.WARNING)
+
+    # The warmup counts against the deadline of the lookups
+    deadline = Deadline.of(args.deadline)
+
+    if args.warmup:
+        results = warmup(args.manager if args.manager and not args.resolve else None, deadline)
+        if not (args.resolve or args.service):
+            for backend, error in results.items():
+                print(f"{backend}: {'failed' if error else 'ready'}")
+            if any(results.values()):
+                sys.exit(1)
+            return
+
+    if args.resolve:
+        from .references import resolve_file
+
+        try:
+            resolved = resolve_file(args.resolve, args.output, strict=args.strict, deadline=deadline)
+        except Exception as e:
+            _logger.error("Failed to resolve %s: %s", args.resolve, e)
+            sys.exit(1)
+        if args.output is None:
+            sys.stdout.write(resolved)
+        return
+
+    if not (args.manager and args.service and args.credential):
+        parser.error("the manager, service and credential are required unless --resolve or --warmup is given")
+    timeouts = {manager: args.timeout for manager in args.manager} if args.timeout else None
+
     try:
-        secret = get_secret(args.manager, args.service, args.credential)
+        secret = get_secret(args.manager, args.service, args.credential, timeouts, deadline)
         print(f"Retrieved {args.credential} for {args.service}: {secret}")
     except Exception as e:
         _logger.error("Failed to retrieve secret: %s", e)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import logging
+import os
+import threading
+import time
+
+MODE_EVENTS = "events"
+MODE_SUMMARY = "summary"
+
+# Seconds of the rate limiting windows and of the summaries
+DEFAULT_INTERVAL = 60.0
+# Repeats of an event logged per window, the rest are counted
+DEFAULT_BURST = 5
+
+# Rate limiting windows kept before they are forgotten
+_MAX_WINDOWS = 10000
+
+_summary_logger = logging.getLogger("enigma")
+_lock = threading.Lock()
+_levels = {}
+_windows = {}
+_counts = {}
+_mode = os.environ.get("GRIMOIRELAB_ENIGMA_LOG_MODE", MODE_EVENTS)
+_interval = float(os.environ.get("GRIMOIRELAB_ENIGMA_LOG_INTERVAL", DEFAULT_INTERVAL))
+_burst = int(os.environ.get("GRIMOIRELAB_ENIGMA_LOG_BURST", DEFAULT_BURST))
+_summary_start = time.monotonic()
+
+
+def configure_logging(mode: str = None, interval: float = None, burst: int = None, levels: dict = None) -> None:
+    """
+    Configures how enigma logs its events.
+
+    enigma never configures logging handlers itself. Every event has a name
+    (such as "aws.not_found") and a level, and is logged through the logger
+    of its module with the event name and its fields (backend, service...)
+    as record attributes, for structured formatters to use.
+
+    In "events" mode, repeats of an event for the same service are logged
+    at most burst times per interval; the next record tells how many were
+    suppressed. In "summary" mode, events below WARNING are only counted
+    and their counts are logged by the "enigma" logger once per interval.
+
+    The defaults come from GRIMOIRELAB_ENIGMA_LOG_MODE,
+    GRIMOIRELAB_ENIGMA_LOG_INTERVAL and GRIMOIRELAB_ENIGMA_LOG_BURST.
+
+    Args:
+        mode (str, optional): "events" or "summary"
+        interval (float, optional): Seconds of the rate limiting windows and the summaries.
+            0 disables rate limiting.
+        burst (int, optional): Repeats of an event logged per window
+        levels (dict, optional): Level of some events, by name, instead of their default one
+
+    Raises:
+        ValueError: If the mode is not supported
+    """
+    global _mode, _interval, _burst
+
+    if mode is not None and mode not in (MODE_EVENTS, MODE_SUMMARY):
+        raise ValueError(f"Unsupported log mode: {mode}")
+
+    with _lock:
+        if mode is not None:
+            _mode = mode
+        if interval is not None:
+            _interval = interval
+        if burst is not None:
+            _burst = burst
+        if levels:
+            _levels.update(levels)
+        _windows.clear()
+
+
+def event_counts(reset: bool = False) -> dict:
+    """
+    Returns how many times each event was counted in summary mode.
+
+    Args:
+        reset (bool): Whether to start counting again
+    """
+    global _summary_start
+
+    with _lock:
+        counts = dict(_counts)
+        if reset:
+            _counts.clear()
+            _summary_start = time.monotonic()
+    return counts
+
+
+def log_summary() -> None:
+    """Logs the events counted since the last summary and starts counting again."""
+    elapsed = time.monotonic() - _summary_start
+    counts = event_counts(reset=True)
+    if counts:
+        _summary_logger.info(
+            "enigma events in the last %.0f seconds: %s",
+            elapsed,
+            ", ".join(f"{event}={count}" for event, count in sorted(counts.items())),
+            extra={"event": "enigma.summary", "counts": counts},
+        )
+
+
+def _count(event: str) -> bool:
+    """Counts an event, returning whether a summary is due."""
+    with _lock:
+        _counts[event] = _counts.get(event, 0) + 1
+        return time.monotonic() - _summary_start >= _interval
+
+
+def _admit(key: tuple):
+    """
+    Decides whether an event is logged.
+
+    Returns:
+        int: Repeats suppressed since the last one logged, None if this one is suppressed
+    """
+    if _interval <= 0:
+        return 0
+    now = time.monotonic()
+    with _lock:
+        window = _windows.get(key)
+        if window is None or now - window[0] >= _interval:
+            if window is None and len(_windows) >= _MAX_WINDOWS:
+                _windows.clear()
+            _windows[key] = [now, 1, 0]
+            return window[2] if window is not None else 0
+        if window[1] < _burst:
+            window[1] += 1
+            return 0
+        window[2] += 1
+        return None
+
+
+class EventLogger:
+    """Logs the events of a module through its logger."""
+
+    __slots__ = ("logger",)
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): Name of the logger, usually the module __name__
+        """
+        self.logger = logging.getLogger(name)
+
+    def emit(self, event: str, level: int, message: str, *args, **fields) -> None:
+        """
+        Logs an event, unless it is rate limited or only counted.
+
+        Cheap when the level of the event is not enabled, as on the
+        success path with the default configuration.
+
+        Args:
+            event (str): Name of the event
+            level (int): Default level of the event
+            message (str): Message, formatted with args as logging does
+            fields: Attributes added to the record, such as backend or service
+        """
+        level = _levels.get(event, level)
+        if _mode == MODE_SUMMARY and level < logging.WARNING:
+            if _count(event):
+                log_summary()
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+
+        suppressed = _admit((event, fields.get("service")))
+        if suppressed is None:
+            return
+        if suppressed:
+            message += " (%s similar messages suppressed)"
+            args += (suppressed,)
+        fields["event"] = event
+        self.logger.log(level, message, *args, extra=fields)
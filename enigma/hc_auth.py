@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+import logging
+import threading
+import time
+
+import hvac.exceptions
+
+_logger = logging.getLogger(__name__)
+
+METHOD_TOKEN = "token"
+METHOD_APPROLE = "approle"
+METHOD_KUBERNETES = "kubernetes"
+AUTH_METHODS = (METHOD_TOKEN, METHOD_APPROLE, METHOD_KUBERNETES)
+
+DEFAULT_KUBERNETES_JWT_PATH = "/var/run/secrets/kubernetes.io/serviceaccount/token"
+DEFAULT_RENEW_FRACTION = 2 / 3
+MIN_RENEW_INTERVAL = 5
+
+# Tokens obtained in this process, by Vault address and identity
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+class _Token:
+    """A Vault token and its lease."""
+
+    __slots__ = ("value", "ttl", "renewable", "obtained")
+
+    def __init__(self, value: str, ttl: int, renewable: bool):
+        self.value = value
+        self.ttl = ttl
+        self.renewable = renewable
+        self.obtained = time.monotonic()
+
+    def expires_in(self) -> float:
+        """Seconds until the token expires. Infinite for tokens without ttl."""
+        if not self.ttl:
+            return float("inf")
+        return self.ttl - (time.monotonic() - self.obtained)
+
+
+class VaultAuth:
+    """
+    Authenticates Vault clients and keeps their token alive.
+
+    Supports static tokens, AppRole and Kubernetes auth. Tokens are cached in
+    the process together with their TTL, so managers sharing an identity
+    don't log in again. A background thread renews the token when a fraction
+    of its lease has passed, and logs in again when it can't be renewed.
+    """
+
+    def __init__(
+        self,
+        method: str = METHOD_TOKEN,
+        token: str = None,
+        role_id: str = None,
+        secret_id: str = None,
+        role: str = None,
+        jwt: str = None,
+        jwt_path: str = DEFAULT_KUBERNETES_JWT_PATH,
+        mount_point: str = None,
+        renew_fraction: float = DEFAULT_RENEW_FRACTION,
+    ):
+        """
+        Args:
+            method (str): Auth method: token, approle or kubernetes
+            token (str, optional): Token for the token method
+            role_id (str, optional): AppRole role id
+            secret_id (str, optional): AppRole secret id
+            role (str, optional): Kubernetes role
+            jwt (str, optional): Kubernetes service account token. Read from jwt_path if not given.
+            jwt_path (str): Path of the Kubernetes service account token
+            mount_point (str, optional): Mount point of the auth method, if not the default one
+            renew_fraction (float): Fraction of the token ttl after which it is renewed
+
+        Raises:
+            ValueError: If the method is unknown or its parameters are missing
+        """
+        if method not in AUTH_METHODS:
+            raise ValueError(f"Unsupported Vault auth method: {method}")
+        if method == METHOD_TOKEN and not token:
+            raise ValueError("A token is required for the token auth method")
+        if method == METHOD_APPROLE and not role_id:
+            raise ValueError("A role id is required for the approle auth method")
+        if method == METHOD_KUBERNETES and not role:
+            raise ValueError("A role is required for the kubernetes auth method")
+
+        self.method = method
+        self.token = token
+        self.role_id = role_id
+        self.secret_id = secret_id
+        self.role = role
+        self.jwt = jwt
+        self.jwt_path = jwt_path
+        self.mount_point = mount_point
+        self.renew_fraction = renew_fraction
+        self._current = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def identity(self) -> tuple:
+        """Returns what identifies the Vault credentials used."""
+        if self.method == METHOD_TOKEN:
+            return (self.method, self.token)
+        if self.method == METHOD_APPROLE:
+            return (self.method, self.mount_point, self.role_id)
+        return (self.method, self.mount_point, self.role)
+
+    def login(self, clients: list) -> None:
+        """
+        Sets a valid token on the clients, logging in if needed.
+
+        A token cached by this process for the same Vault and identity is
+        reused while it isn't about to expire.
+
+        Args:
+            clients (list): hvac clients of the same Vault cluster
+        """
+        with self._lock:
+            self._clients = list(clients)
+        key = (self._clients[0].url,) + self.identity()
+
+        with _tokens_lock:
+            token = _tokens.get(key)
+        if token is None or token.expires_in() < MIN_RENEW_INTERVAL:
+            token = self._authenticate(self._clients[0])
+            with _tokens_lock:
+                _tokens[key] = token
+
+        self._use(token)
+
+    def _authenticate(self, client) -> _Token:
+        """Obtains a token from Vault with the configured method."""
+        if self.method == METHOD_TOKEN:
+            _logger.info("Looking up Vault token")
+            client.token = self.token
+            data = client.auth.token.lookup_self()["data"]
+            return _Token(self.token, int(data.get("ttl") or 0), bool(data.get("renewable")))
+
+        if self.method == METHOD_APPROLE:
+            _logger.info("Logging in Vault with AppRole")
+            kwargs = {"mount_point": self.mount_point} if self.mount_point else {}
+            response = client.auth.approle.login(
+                role_id=self.role_id, secret_id=self.secret_id, use_token=False, **kwargs
+            )
+        else:
+            _logger.info("Logging in Vault with Kubernetes auth")
+            jwt = self.jwt
+            if jwt is None:
+                with open(self.jwt_path) as fd:
+                    jwt = fd.read().strip()
+            kwargs = {"mount_point": self.mount_point} if self.mount_point else {}
+            response = client.auth.kubernetes.login(
+                role=self.role, jwt=jwt, use_token=False, **kwargs
+            )
+
+        auth = response["auth"]
+        return _Token(
+            auth["client_token"], int(auth.get("lease_duration") or 0), bool(auth.get("renewable"))
+        )
+
+    def _use(self, token: _Token) -> None:
+        with self._lock:
+            self._current = token
+            for client in self._clients:
+                client.token = token.value
+
+    def can_login(self) -> bool:
+        """Whether a new token can be obtained when the current one expires."""
+        return self.method != METHOD_TOKEN
+
+    @property
+    def current_token(self) -> str:
+        """Value of the token set on the clients, None before logging in."""
+        token = self._current
+        return token.value if token is not None else None
+
+    def relogin(self, rejected: str = None) -> None:
+        """
+        Discards the current token and logs in again.
+
+        Threads whose requests were rejected at the same time log in only
+        once: when the token was already replaced since it was rejected,
+        the new one is kept.
+
+        Args:
+            rejected (str, optional): Token Vault rejected
+        """
+        with self._login_lock:
+            if rejected is not None and self.current_token != rejected:
+                return
+            key = (self._clients[0].url,) + self.identity()
+            with _tokens_lock:
+                _tokens.pop(key, None)
+            self.login(self._clients)
+
+    def renew(self) -> None:
+        """
+        Renews the current token, logging in again if that is not possible.
+        """
+        token = self._current
+        client = self._clients[0]
+        key = (client.url,) + self.identity()
+
+        if token.renewable:
+            try:
+                auth = client.auth.token.renew_self()["auth"]
+                renewed = _Token(
+                    token.value, int(auth.get("lease_duration") or 0), bool(auth.get("renewable"))
+                )
+                # The lease can't be extended past the max ttl
+                if renewed.ttl >= MIN_RENEW_INTERVAL or not self.can_login():
+                    with _tokens_lock:
+                        _tokens[key] = renewed
+                    self._use(renewed)
+                    _logger.debug("Vault token renewed for %s seconds", renewed.ttl)
+                    return
+            except hvac.exceptions.VaultError as e:
+                _logger.warning("Could not renew Vault token: %s", e)
+
+        if self.can_login():
+            self.relogin()
+        else:
+            _logger.warning("Vault token can't be renewed and will expire")
+
+    def next_renewal(self) -> float:
+        """Seconds until the current token should be renewed, None if never."""
+        token = self._current
+        if token is None or not token.ttl or not (token.renewable or self.can_login()):
+            return None
+        elapsed = time.monotonic() - token.obtained
+        return max(MIN_RENEW_INTERVAL, token.ttl * self.renew_fraction - elapsed)
+
+    def start_renewal(self) -> None:
+        """Starts the background thread renewing the token."""
+        if self._thread is not None or self.next_renewal() is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._renew_loop, name="enigma-vault-renew", daemon=True)
+        self._thread.start()
+
+    def stop_renewal(self) -> None:
+        """Stops the background renewal thread."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+    def _renew_loop(self) -> None:
+        while True:
+            delay = self.next_renewal()
+            if delay is None or self._stop.wait(delay):
+                break
+            try:
+                self.renew()
+            except Exception as e:
+                _logger.error("Vault token renewal failed: %s", e)
+                if self._stop.wait(MIN_RENEW_INTERVAL):
+                    break
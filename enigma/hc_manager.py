@@ -19,14 +19,42 @@
 #     Alberto Ferrer Sánchez (alberefe@gmail.com)
 #
 
+import concurrent.futures
 import logging
+import threading
+
 import hvac
 import hvac.exceptions
+import requests
+
+from .cache import SecretCache
+from .deadline import DeadlineExceeded, check_deadline, deadline_scope, timeout_for
+from .events import EventLogger
+from .hc_auth import VaultAuth
+from .hedging import HedgedReader
+from .tracing import get_tracer, OUTCOME_ERROR, OUTCOME_NOT_FOUND
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 _logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+# Failures after which the last retrieved secret can still be served
+UNAVAILABLE_ERRORS = (
+    hvac.exceptions.VaultDown,
+    hvac.exceptions.InternalServerError,
+    hvac.exceptions.BadGateway,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    DeadlineExceeded,
+)
+
+# Seconds a request to Vault may take
+DEFAULT_TIMEOUT = 10
+
+# KV engine read when a path doesn't start with a mount point
+DEFAULT_KV_VERSION = 2
+
+# Secrets read at the same time when prefetching a subtree
+DEFAULT_PREFETCH_WORKERS = 8
 
 
 class HashicorpManager:
@@ -34,38 +62,84 @@ class HashicorpManager:
     A class to retrieve secrets from HashicorpVault
     """
 
-    def __init__(self, vault_url: str, token: str, certificate: str):
+    def __init__(
+        self,
+        vault_url,
+        token: str,
+        certificate: str,
+        cache: SecretCache = None,
+        auth: VaultAuth = None,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
         """
         Initializes the client with the corresponding token to interact with the vault, so no login
         is required in vault.
 
+        Other auth methods, like AppRole or Kubernetes, can be used passing a
+        VaultAuth. The token is renewed in the background while the manager
+        is alive, and obtained again when it can't be renewed.
+
+        Several addresses of the same cluster (performance standbys or replicas)
+        can be given. Reads then go to the fastest one and are hedged to the
+        others when it is slow to answer.
+
         Args:
-            vault_url (str): The vault URL.
-            token (str): The access token.
+            vault_url (str or list): The vault URL, or a list of equivalent URLs.
+            token (str): The access token. Not needed if auth is given.
             certificate (str): The tls certificate.
+            cache (SecretCache, optional): Cache for the retrieved secrets
+            auth (VaultAuth, optional): How to authenticate. Defaults to the token given.
+            timeout (float): Seconds a request to Vault may take
 
         Raises:
             Exception: If couldn't inizialize the client
         """
-        try:
-            _logger.info("Creating client and logging in.")
-            self.client = hvac.Client(url=vault_url, token=token, verify=certificate)
+        self.cache = cache if cache is not None else SecretCache()
+        self.timeout = timeout
 
-        except Exception as e:
-            _logger.error("An error ocurred initializing the client: %s", str(e))
-            # this is dealt with    in the get_secret function
-            raise e
+        with get_tracer().span("hashicorp.login", backend="hashicorp"):
+            try:
+                _logger.info("Creating client and logging in.")
+                vault_urls = [vault_url] if isinstance(vault_url, str) else list(vault_url)
+                self.clients = [
+                    hvac.Client(url=url, token=token, verify=certificate, timeout=timeout)
+                    for url in vault_urls
+                ]
+                self.client = self.clients[0]
+                self.auth = auth if auth is not None else VaultAuth(token=token or self.client.token)
+
+            except Exception as e:
+                _logger.error("An error ocurred initializing the client: %s", str(e))
+                # this is dealt with    in the get_secret function
+                raise e
+
+            if self.client.sys.is_initialized():
+                _logger.info("Client is initialized")
 
-        if self.client.sys.is_initialized():
-            _logger.info("Client is initialized")
+            try:
+                self.auth.login(self.clients)
+                _logger.info("Client is authenticated")
+                self.auth.start_renewal()
+            except (hvac.exceptions.VaultError, requests.exceptions.RequestException, OSError) as e:
+                _logger.error("Client could not authenticate: %s", e)
 
-        if self.client.is_authenticated():
-            _logger.info("Client is authenticated")
+        self._reader = None
+        if len(self.clients) > 1:
+            self._reader = HedgedReader(self.clients, names=vault_urls)
+
+        # KV version of the mount points, listed on the first read
+        self._mounts = {}
+        self._mounts_listed = None
+        self._unmounted = set()
+        self._mounts_lock = threading.Lock()
 
     def _retrieve_credentials(self, service_name: str) -> dict:
         """
         Function responsible for retrieving credentials from vault
 
+        Secrets are kept in the manager cache. If Vault can't be reached, the last
+        secret retrieved is served while the cache grace period lasts.
+
         Args:
             service_name (str): The name of the service to retrieve credentials for
 
@@ -77,48 +151,299 @@ class HashicorpManager:
             Exception: If couldn't retrieve credentials'
         """
         try:
-            _logger.info("Retrieving credentials from vault.")
-            secret = self.client.secrets.kv.read_secret(path=service_name)
-            return secret
+            return self.cache.get(
+                service_name,
+                lambda: self._fetch_secret(service_name),
+                ttl=self._lease_ttl,
+                fallback_errors=UNAVAILABLE_ERRORS,
+            )
         except Exception as e:
-            _logger.error("Error retrieving the secret: %s", str(e))
+            _events.emit("hashicorp.retrieve_error", logging.ERROR, "Error retrieving the secret %s: %s",
+                         service_name, e, backend="hashicorp", service=service_name)
             # this is dealt with in the get_secret function
             raise e
 
-    def get_secret(self, service_name: str, credential_name: str) -> str:
+    def _lease_ttl(self, secret: dict) -> float:
+        """Time to cache a secret, bounded by its lease if it has one."""
+        lease_duration = secret.get("lease_duration") if isinstance(secret, dict) else None
+        if lease_duration:
+            return min(self.cache.ttl, lease_duration)
+        return self.cache.ttl
+
+    def _fetch_secret(self, service_name: str) -> dict:
+        """
+        Reads a secret from the KV engine.
+
+        If the token was rejected and the auth method allows it, logs in
+        again and retries once.
+        """
+        token = self.auth.current_token
+        try:
+            return self._read_secret(service_name)
+        except hvac.exceptions.Forbidden:
+            if not self.auth.can_login():
+                raise
+            _events.emit("hashicorp.relogin", logging.WARNING, "Vault token rejected, logging in again",
+                         backend="hashicorp", service=service_name)
+            self.auth.relogin(rejected=token)
+            return self._read_secret(service_name)
+
+    def _read_secret(self, service_name: str) -> dict:
+        _events.emit("hashicorp.fetch", logging.DEBUG, "Retrieving credentials from vault: %s", service_name,
+                     backend="hashicorp", service=service_name)
+        mount_point, version, path = self._locate(service_name)
+        check_deadline()
+        with get_tracer().span("hashicorp.fetch", backend="hashicorp", service=service_name):
+            try:
+                return self._read(mount_point, version, path)
+            except hvac.exceptions.InvalidPath:
+                if mount_point is None:
+                    raise
+                # Before mount points were detected, every path was read from the
+                # default mount, where it may start with the name of another mount
+                _logger.debug("%s not found in the %s mount, reading it from the default one",
+                              service_name, mount_point)
+                return self._read(None, DEFAULT_KV_VERSION, service_name)
+
+    def _read(self, mount_point: str, version: int, path: str) -> dict:
+        """Reads a secret from the fastest address, or from the only one."""
+        if self._reader is None:
+            return self._read_kv(self.client, mount_point, version, path)
+        return self._reader.read(
+            lambda client: self._read_kv(client, mount_point, version, path),
+            retry_errors=UNAVAILABLE_ERRORS,
+        )
+
+    @staticmethod
+    def _read_kv(client, mount_point: str, version: int, path: str) -> dict:
+        """Reads a secret, returning KV v1 secrets in the format of KV v2."""
+        if mount_point is None:
+            return client.secrets.kv.read_secret(path=path)
+        if version == 1:
+            secret = client.secrets.kv.v1.read_secret(path=path, mount_point=mount_point)
+            return dict(secret, data={"data": secret["data"]})
+        return client.secrets.kv.v2.read_secret(path=path, mount_point=mount_point)
+
+    def _locate(self, service_name: str) -> tuple:
+        """
+        Finds the KV mount point of a secret and its version.
+
+        The mount points visible to the token are listed once, and kept for
+        the lifetime of the manager. If they can't be listed, Vault is asked
+        once per first path segment. Paths that don't start with a mount
+        point are read from the default mount, as hvac does.
+
+        Returns:
+            tuple: Mount point (None for the default one), KV version and path
+                   of the secret inside the mount point
+        """
+        with self._mounts_lock:
+            self._load_mounts()
+
+            for mount_point, version in self._mounts.items():
+                if service_name == mount_point or service_name.startswith(mount_point + "/"):
+                    return mount_point, version, service_name[len(mount_point) + 1:]
+
+            first_segment = service_name.split("/", 1)[0]
+            if self._mounts_listed or "/" not in service_name or first_segment in self._unmounted:
+                return None, DEFAULT_KV_VERSION, service_name
+
+            mounts = self._list_mounts(service_name)
+            self._mounts.update(mounts)
+            for mount_point, version in mounts.items():
+                if service_name.startswith(mount_point + "/"):
+                    return mount_point, version, service_name[len(mount_point) + 1:]
+            self._unmounted.add(first_segment)
+            return None, DEFAULT_KV_VERSION, service_name
+
+    def _load_mounts(self) -> None:
+        """Lists the mount points the first time. Called with the mounts lock held."""
+        if self._mounts_listed is None:
+            self._mounts.update(self._list_mounts())
+            self._mounts_listed = bool(self._mounts)
+
+    def _list_mounts(self, service_name: str = None) -> dict:
+        """
+        Asks Vault for the KV mount points, or for the one of a secret.
+
+        Returns:
+            dict: KV version of each mount point found
+        """
+        url = "/v1/sys/internal/ui/mounts"
+        if service_name is not None:
+            url += f"/{service_name}"
+        try:
+            response = self.client.adapter.get(url, timeout=timeout_for(self.timeout))
+        except UNAVAILABLE_ERRORS:
+            raise
+        except hvac.exceptions.VaultError as e:
+            _logger.debug("Could not list the mount points: %s", e)
+            return {}
+
+        data = response.get("data") if isinstance(response, dict) else None
+        if not isinstance(data, dict):
+            return {}
+        if service_name is None:
+            mounts = data.get("secret") or {}
+        else:
+            mounts = {data.get("path", ""): data}
+
+        versions = {}
+        for path, mount in mounts.items():
+            if mount.get("type") in ("kv", "generic") and path.strip("/"):
+                versions[path.strip("/")] = int((mount.get("options") or {}).get("version") or 1)
+        _logger.debug("Found KV mount points: %s", versions)
+        return versions
+
+    def _list_kv(self, mount_point: str, version: int, path: str) -> list:
+        """Lists the keys under a path. Subpaths end with a slash."""
+        kv = self.client.secrets.kv.v1 if version == 1 else self.client.secrets.kv.v2
+        kwargs = {"mount_point": mount_point} if mount_point is not None else {}
+        try:
+            return kv.list_secrets(path=path, **kwargs)["data"]["keys"]
+        except hvac.exceptions.InvalidPath:
+            return []
+
+    def prefetch(self, path: str, max_workers: int = DEFAULT_PREFETCH_WORKERS) -> dict:
+        """
+        Loads every secret under a path into the cache.
+
+        The path is listed recursively, and then the secrets are read in
+        parallel, at most max_workers at a time. Secrets that can't be read
+        are left out.
+
+        Args:
+            path (str): Path to load, such as "grimoirelab/" or "kv/grimoirelab"
+            max_workers (int): Secrets read at the same time
+
+        Returns:
+            dict: The secret read for each path
+        """
+        path = path.strip("/")
+        mount_point, version, relative_path = self._locate(path)
+        prefix = f"{mount_point}/" if mount_point is not None else ""
+        secrets = {}
+
+        with get_tracer().span("hashicorp.prefetch", backend="hashicorp", service=path), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            leaves = []
+            pending = [relative_path + "/" if relative_path else ""]
+            while pending:
+                listings = executor.map(lambda directory: (directory, self._list_kv(mount_point, version, directory)),
+                                        pending)
+                pending = []
+                for directory, keys in listings:
+                    for key in keys:
+                        (pending if key.endswith("/") else leaves).append(directory + key)
+            _logger.info("Prefetching %s secrets under %s", len(leaves), path)
+
+            futures = {executor.submit(self._fetch_secret, prefix + leaf): prefix + leaf for leaf in leaves}
+            for future in concurrent.futures.as_completed(futures):
+                service_name = futures[future]
+                try:
+                    secret = future.result()
+                except (hvac.exceptions.VaultError, requests.exceptions.RequestException) as e:
+                    _logger.error("Error prefetching the secret %s: %s", service_name, e)
+                    continue
+                self.cache.put(service_name, secret, ttl=self._lease_ttl)
+                secrets[service_name] = secret
+        return secrets
+
+    def get_versions(self, services: list) -> dict:
+        """
+        Returns the current version of each secret.
+
+        Only the KV v2 metadata is read, not the secrets. Secrets in KV v1
+        mount points have no versions and are left out.
+
+        Args:
+            services (list): Paths of the secrets
+
+        Returns:
+            dict: Current version of each secret found, by path
+        """
+        versions = {}
+        for service_name in services:
+            mount_point, version, path = self._locate(service_name)
+            if version == 1:
+                continue
+            kwargs = {"mount_point": mount_point} if mount_point is not None else {}
+            try:
+                metadata = self.client.secrets.kv.v2.read_secret_metadata(path=path, **kwargs)
+            except hvac.exceptions.InvalidPath:
+                continue
+            versions[service_name] = metadata["data"]["current_version"]
+        return versions
+
+    def invalidate(self, service_name: str) -> None:
+        """Drops a secret from the cache, so it is retrieved again."""
+        self.cache.invalidate(service_name)
+
+    def warmup(self) -> None:
+        """
+        Opens the connections to Vault and lists its KV mount points.
+
+        Logging in only connects to the first address. The others get a
+        health check, so the TLS handshake isn't paid by the first read
+        hedged to them, and the mount points are listed before the first
+        read instead of during it.
+        """
+        with get_tracer().span("hashicorp.warmup", backend="hashicorp"):
+            for client in self.clients[1:]:
+                check_deadline()
+                client.sys.read_health_status(method="HEAD")
+            check_deadline()
+            with self._mounts_lock:
+                self._load_mounts()
+
+    def close(self) -> None:
+        """Stops renewing the token in the background."""
+        self.auth.stop_renewal()
+
+    def get_secret(self, service_name: str, credential_name: str, deadline=None) -> str:
         """
         Retrieves the value of the service + credential named.
 
         Args:
             service_name (str): The name of the service to retrieve credentials for
             credential_name (str): The name of the credential to retrieve
+            deadline (Deadline or float, optional): Deadline of the lookup, or seconds it may take
 
         Returns:
             str: The value of the credential
 
         Raises:
+            DeadlineExceeded: If the deadline passed before Vault was asked.
             Exception: If couldn't retrieve credentials'
         """
-        try:
-            credentials = self._retrieve_credentials(service_name)
-            # We get the exact credential from the dict returned by the retrieval
-            credential = credentials["data"]["data"][credential_name]
-            return credential
-        except (
-            hvac.exceptions.Forbidden,
-            hvac.exceptions.InternalServerError,
-            hvac.exceptions.InvalidRequest,
-            hvac.exceptions.RateLimitExceeded,
-            hvac.exceptions.Unauthorized,
-            hvac.exceptions.UnsupportedOperation,
-            hvac.exceptions.VaultDown,
-            hvac.exceptions.VaultError,
-        ) as e:
-            _logger.error("There was an error retrieving the secret: %s", e)
-            return ""
-        except KeyError:
-            _logger.error("The credential %s was not found", credential_name)
-            return ""
-        except hvac.exceptions.InvalidPath:
-            _logger.error("The path %s does not exist in the vault", service_name)
-            return ""
+        with get_tracer().span("hashicorp.get_secret", backend="hashicorp", service=service_name) as span, \
+                deadline_scope(deadline):
+            try:
+                credentials = self._retrieve_credentials(service_name)
+                # We get the exact credential from the dict returned by the retrieval
+                credential = credentials["data"]["data"][credential_name]
+                return credential
+            except hvac.exceptions.InvalidPath:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("hashicorp.not_found", logging.ERROR, "The path %s does not exist in the vault",
+                             service_name, backend="hashicorp", service=service_name)
+                return ""
+            except (
+                hvac.exceptions.Forbidden,
+                hvac.exceptions.InternalServerError,
+                hvac.exceptions.InvalidRequest,
+                hvac.exceptions.RateLimitExceeded,
+                hvac.exceptions.Unauthorized,
+                hvac.exceptions.UnsupportedOperation,
+                hvac.exceptions.VaultDown,
+                hvac.exceptions.VaultError,
+            ) as e:
+                span.set_outcome(OUTCOME_ERROR)
+                _events.emit("hashicorp.error", logging.ERROR, "There was an error retrieving the secret %s: %s",
+                             service_name, e, backend="hashicorp", service=service_name)
+                return ""
+            except KeyError:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("hashicorp.not_found", logging.ERROR, "The credential %s:%s was not found",
+                             service_name, credential_name, backend="hashicorp", service=service_name)
+                return ""
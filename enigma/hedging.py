@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from .events import EventLogger
+
+_logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_DELAY = 0.1
+MIN_SAMPLES = 5
+WINDOW = 100
+
+
+class HedgedReader:
+    """
+    Sends reads to several equivalent endpoints, hedging slow requests.
+
+    A read goes first to the endpoint with the lowest observed latency. If it
+    hasn't answered when that endpoint's latency percentile is reached, the
+    same read is sent to the next endpoint, and so on. The first answer wins
+    and the slower requests are left to finish on their own. An endpoint that
+    fails with one of the retried errors is skipped right away.
+    """
+
+    def __init__(
+        self,
+        endpoints: list,
+        names: list = None,
+        percentile: float = DEFAULT_PERCENTILE,
+        default_delay: float = DEFAULT_DELAY,
+        failure_penalty: float = 1.0,
+    ):
+        """
+        Args:
+            endpoints (list): Objects passed to the read function, e.g. clients
+            names (list, optional): Names of the endpoints used in the logs
+            percentile (float): Latency percentile after which a read is hedged
+            default_delay (float): Hedging delay in seconds until enough latencies are observed
+            failure_penalty (float): Latency in seconds recorded for a read failing with a retried error
+        """
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+
+        self.endpoints = list(endpoints)
+        self.names = list(names) if names else [str(i) for i in range(len(self.endpoints))]
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.failure_penalty = failure_penalty
+        self._latencies = [collections.deque(maxlen=WINDOW) for _ in self.endpoints]
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2 * len(self.endpoints), thread_name_prefix="enigma-hedge"
+        )
+
+    def ranked(self) -> list:
+        """
+        Returns the indexes of the endpoints sorted by median observed latency.
+
+        Endpoints without observations keep their configured order after the
+        observed ones.
+        """
+        with self._lock:
+            medians = [sorted(samples)[len(samples) // 2] if samples else None
+                       for samples in self._latencies]
+        return sorted(
+            range(len(self.endpoints)),
+            key=lambda i: (medians[i] is None, medians[i] or 0.0, i),
+        )
+
+    def hedge_delay(self, index: int) -> float:
+        """Returns the seconds to wait for an endpoint before hedging."""
+        with self._lock:
+            samples = sorted(self._latencies[index])
+        if len(samples) < MIN_SAMPLES:
+            return self.default_delay
+        position = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[position]
+
+    def record(self, index: int, latency: float) -> None:
+        """Records the latency of a read sent to an endpoint."""
+        with self._lock:
+            self._latencies[index].append(latency)
+
+    def read(self, function, retry_errors: tuple = (Exception,)):
+        """
+        Runs function against the endpoints, hedging slow reads.
+
+        Args:
+            function (callable): Receives an endpoint and returns the read value
+            retry_errors (tuple): Errors after which the next endpoint is tried.
+                Any other error is raised right away.
+
+        Returns:
+            The value returned by the first endpoint answering
+
+        Raises:
+            Exception: The last error if every endpoint failed
+        """
+        order = self.ranked()
+        pending = {}
+        last_error = None
+
+        def submit(index):
+            start = time.monotonic()
+
+            def timed():
+                try:
+                    result = function(self.endpoints[index])
+                except retry_errors:
+                    self.record(index, self.failure_penalty)
+                    raise
+                except Exception:
+                    # The endpoint answered, e.g. that the secret doesn't exist
+                    self.record(index, time.monotonic() - start)
+                    raise
+                self.record(index, time.monotonic() - start)
+                return result
+
+            pending[self._executor.submit(timed)] = index
+
+        submit(order.pop(0))
+        while pending:
+            if order:
+                timeout = self.hedge_delay(list(pending.values())[-1])
+            else:
+                timeout = None
+            done, _ = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    return future.result()
+                except retry_errors as e:
+                    _events.emit("hedging.endpoint_error", logging.WARNING, "Endpoint %s failed: %s",
+                                 self.names[index], e, endpoint=self.names[index])
+                    last_error = e
+
+            if order and (not done or not pending):
+                index = order.pop(0)
+                if not done:
+                    _logger.debug("Hedging read to endpoint %s", self.names[index])
+                submit(index)
+
+        raise last_error
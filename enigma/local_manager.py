@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import json
+import logging
+import os
+import threading
+import time
+
+from .events import EventLogger
+from .tracing import get_tracer, OUTCOME_NOT_FOUND
+
+_logger = logging.getLogger(__name__)
+_events = EventLogger(__name__)
+
+# Seconds between checks of the files for changes
+DEFAULT_CHECK_INTERVAL = 1.0
+
+# Extensions dropped from file names to get the service name
+SUFFIXES = (".json", ".env")
+
+# Separator of the service and the credential in the keys of an env-file
+ENV_SEPARATOR = "__"
+
+
+def parse_env(text: str) -> dict:
+    """
+    Parses the KEY=value lines of an env-file.
+
+    Blank lines and comments are skipped, an "export" prefix is allowed and
+    values can be enclosed in single or double quotes.
+
+    Args:
+        text (str): Contents of the file
+
+    Returns:
+        dict: Value of each key
+    """
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export "):].lstrip()
+        key, separator, value = line.partition("=")
+        if not separator:
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        values[key.strip()] = value
+    return values
+
+
+def _parse_file(path: str) -> dict:
+    """Reads the credentials of a file holding a JSON object or KEY=value lines."""
+    with open(path) as fd:
+        text = fd.read()
+    if path.endswith(".json") or text.lstrip().startswith("{"):
+        credentials = json.loads(text)
+        if not isinstance(credentials, dict):
+            raise ValueError("Expected a JSON object")
+        return credentials
+    return parse_env(text)
+
+
+def _read_directory(path: str) -> dict:
+    """Reads a directory holding one file per credential, as mounted by Kubernetes."""
+    credentials = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            with open(entry.path) as fd:
+                credentials[entry.name] = fd.read().rstrip("\n")
+    return credentials
+
+
+def _signature(path: str, is_dir: bool):
+    """What changes when the contents of a file, or of the files of a directory, change."""
+    if not is_dir:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    signatures = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.name.startswith(".") and entry.is_file():
+                signatures.append((entry.name,) + _signature(entry.path, False))
+    return tuple(sorted(signatures))
+
+
+def _service_name(file_name: str) -> str:
+    for suffix in SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def _env_name(name: str) -> str:
+    """Name of a service or a credential as written in an env-file key."""
+    return name.upper().replace("-", "_").replace(".", "_")
+
+
+class LocalManager:
+    """
+    Retrieves secrets from local files, such as the ones mounted by an orchestrator.
+
+    The path can be a directory or an env-file. In a directory, every entry
+    is a service:
+
+    - a JSON file (service.json) holding an object with the credentials
+    - a file of KEY=value lines (service.env or any other name)
+    - a directory with one file per credential, as Kubernetes mounts secrets
+
+    In an env-file, every key is SERVICE__CREDENTIAL. Services and credentials
+    are then looked up in upper case, with dashes and dots as underscores.
+
+    The files are read once into memory. They are checked for changes at
+    most every check_interval seconds, and only the files whose size,
+    modification time or inode changed are read again.
+    """
+
+    def __init__(self, path: str, check_interval: float = DEFAULT_CHECK_INTERVAL):
+        """
+        Args:
+            path (str): Directory with a file per service, or env-file
+            check_interval (float): Seconds between checks of the files for changes
+
+        Raises:
+            FileNotFoundError: If the path doesn't exist
+        """
+        if not os.path.exists(path):
+            _logger.error("Secrets path %s not found", path)
+            raise FileNotFoundError(path)
+
+        self.path = path
+        self.check_interval = check_interval
+        self._env_file = not os.path.isdir(path)
+        self._services = {}
+        # Times each service changed since it was first read
+        self._revisions = {}
+        # Service and signature of every entry of the directory read
+        self._entries = {}
+        self._file_signature = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+        with get_tracer().span("local.login", backend="local"):
+            self.refresh()
+
+    def refresh(self) -> list:
+        """
+        Reads again the files changed since the last check.
+
+        Returns:
+            list: Names of the services added, changed or removed
+        """
+        with self._lock:
+            try:
+                if self._env_file:
+                    changed = self._refresh_env_file()
+                else:
+                    changed = self._refresh_directory()
+            except OSError as e:
+                _logger.warning("Could not check %s for changes: %s", self.path, e)
+                changed = []
+            for service in changed:
+                self._revisions[service] = self._revisions.get(service, -1) + 1
+            self._checked = time.monotonic()
+        if changed:
+            _logger.info("Loaded %s changed services from %s", len(changed), self.path)
+        return changed
+
+    def warmup(self) -> None:
+        """Reads the files changed since the manager was created."""
+        self.refresh()
+
+    def _refresh_directory(self) -> list:
+        found = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                    if not is_dir and not entry.is_file():
+                        continue
+                    found[entry.name] = (is_dir, _signature(entry.path, is_dir))
+                except OSError:
+                    # Removed while listing the directory
+                    continue
+
+        # Entries of the same service, such as svc.json and svc.env, are
+        # ambiguous; the first one by name is read, whatever the listing order
+        entries_by_service = {}
+        for name in sorted(found):
+            entries_by_service.setdefault(_service_name(name), []).append(name)
+        for service, names in entries_by_service.items():
+            if len(names) > 1:
+                _events.emit("local.duplicate_service", logging.WARNING,
+                             "Several entries hold the secrets of %s in %s (%s), only %s is read",
+                             service, self.path, ", ".join(names), names[0], backend="local", service=service)
+                for name in names[1:]:
+                    del found[name]
+
+        changed = []
+        for name in set(self._entries) - set(found):
+            service, _ = self._entries.pop(name)
+            self._services.pop(service, None)
+            changed.append(service)
+
+        for name, (is_dir, signature) in found.items():
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] == signature:
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                credentials = _read_directory(path) if is_dir else _parse_file(path)
+            except (OSError, ValueError) as e:
+                # Read again on the next check
+                _logger.warning("Could not read secrets from %s: %s", path, e)
+                continue
+            service = _service_name(name)
+            self._entries[name] = (service, signature)
+            if self._services.get(service) != credentials:
+                self._services[service] = credentials
+                changed.append(service)
+        return changed
+
+    def _refresh_env_file(self) -> list:
+        signature = _signature(self.path, False)
+        if signature == self._file_signature:
+            return []
+
+        try:
+            with open(self.path) as fd:
+                values = parse_env(fd.read())
+        except OSError as e:
+            _logger.warning("Could not read secrets from %s: %s", self.path, e)
+            return []
+
+        services = {}
+        for key, value in values.items():
+            service, separator, credential = key.partition(ENV_SEPARATOR)
+            if separator and service and credential:
+                services.setdefault(_env_name(service), {})[_env_name(credential)] = value
+
+        changed = [
+            service for service in set(services) | set(self._services)
+            if services.get(service) != self._services.get(service)
+        ]
+        self._services = services
+        self._file_signature = signature
+        return changed
+
+    def _check(self) -> None:
+        """Looks for changed files when the last check is older than check_interval."""
+        if self._checked is None or time.monotonic() - self._checked >= self.check_interval:
+            self.refresh()
+
+    def get_versions(self, services: list) -> dict:
+        """
+        Returns how many times each service changed, checking the files first.
+
+        Args:
+            services (list): Names of the services
+
+        Returns:
+            dict: Revision of each service found, by name
+        """
+        self.refresh()
+        versions = {}
+        for service_name in services:
+            key = self._key(service_name)
+            if key in self._services:
+                versions[service_name] = self._revisions.get(key)
+        return versions
+
+    def invalidate(self, service_name: str = None) -> None:
+        """
+        Reads the files of a service again on the next lookup.
+
+        Args:
+            service_name (str, optional): Service to read again. If not given, every file is read again.
+        """
+        with self._lock:
+            self._file_signature = None
+            for name, (service, _) in list(self._entries.items()):
+                if service_name is None or service == service_name:
+                    del self._entries[name]
+            self._checked = None
+
+    def _key(self, name: str) -> str:
+        return _env_name(name) if self._env_file else name
+
+    def get_secret(self, service_name: str, credential_name: str, deadline=None) -> str:
+        """
+        Retrieves a credential of a service from the files.
+
+        Args:
+            service_name (str): The name of the service
+            credential_name (str): The name of the credential
+            deadline (Deadline or float, optional): Accepted like in the other
+                managers; lookups never wait on a backend
+
+        Returns:
+            str: The credential value if found, empty string if not found
+        """
+        with get_tracer().span("local.get_secret", backend="local", service=service_name) as span:
+            self._check()
+            credentials = self._services.get(self._key(service_name))
+            if credentials is None:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("local.not_found", logging.ERROR, "The service %s was not found in %s",
+                             service_name, self.path, backend="local", service=service_name)
+                return ""
+
+            secret = credentials.get(self._key(credential_name))
+            if secret is None:
+                span.set_outcome(OUTCOME_NOT_FOUND)
+                _events.emit("local.not_found", logging.ERROR, "The credential %s:%s was not found.",
+                             service_name, credential_name, backend="local", service=service_name)
+                return ""
+            return secret
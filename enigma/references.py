@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+from .deadline import Deadline
+from .enigma import SUPPORTED_MANAGERS, _get_manager, get_secret
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+
+# enigma://aws/github/api-token; the service can hold slashes, like Vault paths
+URI_PATTERN = re.compile(r"enigma://([a-z]+)/([^\s'\"<>{}\[\],;]+)/([^/\s'\"<>{}\[\],;]+)")
+# ${enigma:hashicorp:gitlab:password}
+PLACEHOLDER_PATTERN = re.compile(r"\$\{enigma:([a-z]+):([^}]+):([^:}]+)\}")
+
+Reference = namedtuple("Reference", ["backend", "service", "credential"])
+
+
+def _matches(text: str):
+    for pattern in (URI_PATTERN, PLACEHOLDER_PATTERN):
+        for match in pattern.finditer(text):
+            yield match, Reference(*match.groups())
+
+
+def _strings(config):
+    """Yields every string of a config, nested in dicts, lists and tuples."""
+    if isinstance(config, str):
+        yield config
+    elif isinstance(config, dict):
+        for value in config.values():
+            yield from _strings(value)
+    elif isinstance(config, (list, tuple)):
+        for value in config:
+            yield from _strings(value)
+
+
+def find_references(config) -> list:
+    """
+    Finds the secret references of a config.
+
+    References are written as enigma://backend/service/credential or as
+    ${enigma:backend:service:credential}.
+
+    Args:
+        config (str, dict or list): Text of a config file or a parsed config
+
+    Returns:
+        list: Distinct references, in the order they first appear
+    """
+    references = {}
+    for text in _strings(config):
+        for _, reference in _matches(text):
+            references.setdefault(reference, None)
+    return list(references)
+
+
+def _resolve_service(backend: str, service: str, credentials: list, deadline: Deadline) -> dict:
+    """Retrieves the credentials of a service, which share a single fetch of its secret."""
+    return {
+        credential: get_secret(backend, service, credential, deadline=deadline)
+        for credential in credentials
+    }
+
+
+def resolve(references, max_workers: int = DEFAULT_MAX_WORKERS, deadline=None) -> dict:
+    """
+    Retrieves the secrets of several references in one batch.
+
+    References are grouped by backend and service, so every secret is
+    fetched once however many of its credentials are referenced, and
+    services are resolved in parallel. AWS secrets are fetched in batches.
+
+    Args:
+        references (iterable): References to retrieve
+        max_workers (int): Services resolved at the same time
+        deadline (float or Deadline, optional): Seconds the whole batch may take
+
+    Returns:
+        dict: Value of each reference. References not found, or whose secrets
+            manager failed, are left out.
+
+    Raises:
+        ValueError: If a reference names an unsupported secrets manager
+    """
+    deadline = Deadline.of(deadline)
+    services = {}
+    for reference in dict.fromkeys(references):
+        if reference.backend not in SUPPORTED_MANAGERS:
+            raise ValueError(f"Unsupported secrets manager: {reference.backend}")
+        services.setdefault((reference.backend, reference.service), []).append(reference.credential)
+
+    aws_services = [service for backend, service in services if backend == "aws"]
+    if len(aws_services) > 1:
+        try:
+            _get_manager("aws").get_secrets(aws_services)
+        except Exception as e:
+            # Every service is still retrieved on its own
+            _logger.warning("Could not retrieve the AWS secrets in a batch: %s", e)
+
+    values = {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="enigma-resolve"
+    ) as executor:
+        futures = {
+            executor.submit(_resolve_service, backend, service, credentials, deadline): (backend, service)
+            for (backend, service), credentials in services.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            backend, service = futures[future]
+            try:
+                credentials = future.result()
+            except Exception as e:
+                _logger.error("Could not resolve the secrets of %s in %s: %s", service, backend, e)
+                continue
+            for credential, value in credentials.items():
+                if value:
+                    values[Reference(backend, service, credential)] = value
+    return values
+
+
+def _substitute(config, values: dict):
+    if isinstance(config, str):
+        matches = list(_matches(config))
+        if len(matches) == 1 and matches[0][0].group(0) == config and matches[0][1] in values:
+            # A value made only of a reference keeps the type of the secret
+            return values[matches[0][1]]
+
+        def replace(match):
+            reference = Reference(*match.groups())
+            return str(values[reference]) if reference in values else match.group(0)
+
+        for pattern in (URI_PATTERN, PLACEHOLDER_PATTERN):
+            config = pattern.sub(replace, config)
+        return config
+    if isinstance(config, dict):
+        return {key: _substitute(value, values) for key, value in config.items()}
+    if isinstance(config, list):
+        return [_substitute(value, values) for value in config]
+    if isinstance(config, tuple):
+        return tuple(_substitute(value, values) for value in config)
+    return config
+
+
+def resolve_config(config, strict: bool = False, max_workers: int = DEFAULT_MAX_WORKERS, deadline=None):
+    """
+    Replaces the secret references of a config by their values.
+
+    Args:
+        config (str, dict or list): Text of a config file or a parsed config
+        strict (bool): Whether to fail when a reference can't be resolved
+        max_workers (int): Services resolved at the same time
+        deadline (float or Deadline, optional): Seconds the whole batch may take
+
+    Returns:
+        A copy of the config with the references replaced. References not
+        found are left as they are.
+
+    Raises:
+        LookupError: If strict and some references were not found
+    """
+    references = find_references(config)
+    if not references:
+        return config
+
+    values = resolve(references, max_workers=max_workers, deadline=deadline)
+    missing = [reference for reference in references if reference not in values]
+    for reference in missing:
+        _logger.warning("Secret reference %s:%s:%s not resolved", *reference)
+    if missing and strict:
+        raise LookupError(f"{len(missing)} secret references could not be resolved")
+    return _substitute(config, values)
+
+
+def resolve_file(path: str, output: str = None, strict: bool = False, deadline=None) -> str:
+    """
+    Replaces the secret references of a config file by their values.
+
+    JSON files are parsed, so values are written with the JSON escaping;
+    any other file is processed as text.
+
+    Args:
+        path (str): Config file
+        output (str, optional): File where the resolved config is written, readable
+            only by its owner. If not given, it is only returned.
+        strict (bool): Whether to fail when a reference can't be resolved
+        deadline (float or Deadline, optional): Seconds the whole batch may take
+
+    Returns:
+        str: The resolved config
+
+    Raises:
+        LookupError: If strict and some references were not found
+    """
+    with open(path) as fd:
+        text = fd.read()
+
+    if path.endswith(".json"):
+        resolved = json.dumps(resolve_config(json.loads(text), strict=strict, deadline=deadline), indent=2)
+    else:
+        resolved = resolve_config(text, strict=strict, deadline=deadline)
+
+    if output is not None:
+        directory = os.path.dirname(os.path.abspath(output))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".enigma-")
+        try:
+            with os.fdopen(fd, "w") as resolved_file:
+                resolved_file.write(resolved)
+            os.replace(temporary, output)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    return resolved
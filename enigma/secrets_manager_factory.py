@@ -18,26 +18,101 @@
 #
 
 import getpass
+import hashlib
 import logging
 import os
+import threading
 
-from .aws_manager import AwsManager
+from .aws_manager import AwsManager, get_shared_session
 from .bw_manager import BitwardenManager
+from .bw_session import FileSessionStore, KeyringSessionStore
+from .hc_auth import VaultAuth, METHOD_APPROLE, METHOD_KUBERNETES, METHOD_TOKEN
 from .hc_manager import HashicorpManager
+from .local_manager import LocalManager, DEFAULT_CHECK_INTERVAL
+from .shared_cache import SharedSecretCache
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 _logger = logging.getLogger(__name__)
 
 
+def _split_list(value: str) -> list:
+    """Splits a comma separated list, returning None if it is empty."""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _cache_for(identity: tuple):
+    """
+    Returns the cache for a new manager.
+
+    When GRIMOIRELAB_ENIGMA_SHARED_CACHE holds a path, the manager gets a
+    cache shared with the other processes of the host through that file.
+    Otherwise None is returned and the manager creates its own cache.
+
+    The namespace of the shared cache is a hash of the identity of the
+    manager, so managers using other credentials never read its secrets,
+    and tokens or keys in the identity are never written to the file.
+
+    Args:
+        identity (tuple): Kind of manager followed by what identifies its credentials
+    """
+    path = os.environ.get("GRIMOIRELAB_ENIGMA_SHARED_CACHE")
+    if not path:
+        return None
+    digest = hashlib.sha256(repr(identity).encode()).hexdigest()
+    return SharedSecretCache(path, namespace=f"{identity[0]}:{digest}")
+
+
+def _aws_access_key() -> str:
+    """Access key of the shared AWS session, None if there are no credentials."""
+    credentials = get_shared_session().get_credentials()
+    return credentials.access_key if credentials is not None else None
+
+
 class SecretsManagerFactory:
+    """
+    Creates the secrets managers.
+
+    Managers are kept for the lifetime of the process, so every lookup made
+    with the same configuration reuses the same manager and its cache.
+    """
+
+    _instances = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_or_create(cls, key: tuple, create):
+        """Returns the manager stored under key, creating it if needed."""
+        with cls._lock:
+            manager = cls._instances.get(key)
+        if manager is None:
+            manager = create()
+            with cls._lock:
+                manager = cls._instances.setdefault(key, manager)
+        return manager
+
+    @classmethod
+    def clear(cls):
+        """Forgets every manager created so far."""
+        with cls._lock:
+            cls._instances.clear()
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """Forgets the managers, whose clients and command queues don't survive a fork."""
+        cls._lock = threading.Lock()
+        cls._instances = {}
 
     @staticmethod
     def get_bitwarden_manager(email=None, password=None):
         """
         Gets or creates a BitwardenManager instance.
 
+        The session key is kept between processes when
+        GRIMOIRELAB_ENIGMA_BW_SESSION_STORE is set to keyring, file or a file path.
+        Items are decrypted in the process from the data file of the CLI when
+        GRIMOIRELAB_ENIGMA_BW_READ_DATA_FILE is true.
+
         Args:
             email (str, optional): Bitwarden email. If not provided,
                                   will try environment variables or prompt.
@@ -48,10 +123,8 @@ class SecretsManagerFactory:
             BitwardenManager: The singleton BitwardenManager instance
 
         Raises:
-            ValueError: If credentials cannot be obtained
+            ValueError: If credentials cannot be obtained or the login failed
         """
-        _logger.debug("Creating new Bitwarden manager")
-
         if email is None:
             email = os.environ.get("GRIMOIRELAB_ENIGMA_BW_EMAIL")
         if password is None:
@@ -64,60 +137,186 @@ class SecretsManagerFactory:
             if not email or not password:
                 raise ValueError("Bitwarden credentials are required")
 
-        return BitwardenManager(email, password)
+        key = ("bitwarden", email)
+
+        def create():
+            _logger.debug("Creating new Bitwarden manager")
+            manager = BitwardenManager(
+                email,
+                password,
+                cache=_cache_for(key),
+                session_store=_bw_session_store_from_environment(),
+                read_data_file=os.environ.get("GRIMOIRELAB_ENIGMA_BW_READ_DATA_FILE", "").lower()
+                in ("1", "true", "yes"),
+            )
+            # A manager that couldn't log in is not kept, so the next call logs in again
+            if not manager.session_key:
+                raise ValueError(f"Could not log in to Bitwarden as {email}")
+            return manager
+
+        return SecretsManagerFactory._get_or_create(key, create)
 
     @staticmethod
-    def get_aws_manager():
+    def get_aws_manager(regions=None):
         """
         Gets or creates an AwsManager instance.
 
+        Args:
+            regions (list, optional): Regions holding replicas of the secrets. If not
+                                      provided, will try the comma separated
+                                      GRIMOIRELAB_ENIGMA_AWS_REGIONS environment variable.
+
         Returns:
             AwsManager: The singleton AwsManager instance
         """
-        _logger.debug("Creating new AWS manager")
+        if regions is None:
+            regions = _split_list(os.environ.get("GRIMOIRELAB_ENIGMA_AWS_REGIONS"))
+
+        key = ("aws", tuple(regions or ()), os.environ.get("AWS_PROFILE"))
 
-        return AwsManager()
+        def create():
+            _logger.debug("Creating new AWS manager")
+            identity = key
+            if os.environ.get("GRIMOIRELAB_ENIGMA_SHARED_CACHE"):
+                # Profiles don't tell apart the credentials of the environment
+                identity += (_aws_access_key(),)
+            return AwsManager(regions=regions, cache=_cache_for(identity))
+
+        return SecretsManagerFactory._get_or_create(key, create)
 
 
     @staticmethod
     def get_hashicorp_manager(
-        vault_addr=None, token=None, certificate=None
+        vault_addr=None, token=None, certificate=None, auth=None
     ):
         """
         Gets or creates a HashicorpManager instance.
 
+        The auth method is read from GRIMOIRELAB_ENIGMA_VAULT_AUTH_METHOD (token,
+        approle or kubernetes). AppRole takes GRIMOIRELAB_ENIGMA_VAULT_ROLE_ID and
+        GRIMOIRELAB_ENIGMA_VAULT_SECRET_ID; Kubernetes takes GRIMOIRELAB_ENIGMA_VAULT_ROLE
+        and, optionally, GRIMOIRELAB_ENIGMA_VAULT_JWT_PATH.
+
         Args:
-            vault_addr (str, optional): Vault address.
+            vault_addr (str or list, optional): Vault address, or a list of addresses
+                                                of the same cluster. The environment
+                                                variable can hold a comma separated list.
 
             token (str, optional): Vault token.
 
             certificate (str, optional): Path to CA certificate.
 
+            auth (VaultAuth, optional): How to authenticate, instead of a token.
+
         Returns:
             HashicorpManager: The singleton HashicorpManager instance
 
         Raises:
             ValueError: If required credentials cannot be obtained
         """
-        _logger.debug("Creating new Hashicorp manager")
-
         if vault_addr is None:
             vault_addr = os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_ADDR")
-        if token is None:
+            if vault_addr and "," in vault_addr:
+                vault_addr = _split_list(vault_addr)
+        if auth is None:
+            auth = _vault_auth_from_environment()
+        if token is None and auth is None:
             token = os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_TOKEN")
         if certificate is None:
             certificate = os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_CACERT")
 
         if not vault_addr:
             vault_addr = input("Please enter vault address: ")
-        if not token:
+        if not token and auth is None:
             token = input("Please enter vault token: ")
         if not certificate:
             certificate = input(
                 "Please enter path to a PEM-encoded CA certificate file: "
             )
 
-        if not all([vault_addr, token, certificate]):
+        if not all([vault_addr, token or auth, certificate]):
             raise ValueError("All Hashicorp Vault credentials are required")
 
-        return HashicorpManager(vault_addr, token, certificate)
+        addresses = vault_addr if isinstance(vault_addr, str) else tuple(vault_addr)
+        identity = auth.identity() if auth is not None else (METHOD_TOKEN, token)
+        key = ("hashicorp", addresses, certificate) + identity
+
+        def create():
+            _logger.debug("Creating new Hashicorp manager")
+            return HashicorpManager(vault_addr, token, certificate, auth=auth, cache=_cache_for(key))
+
+        return SecretsManagerFactory._get_or_create(key, create)
+
+    @staticmethod
+    def get_local_manager(path=None, check_interval=None):
+        """
+        Gets or creates a LocalManager instance.
+
+        Args:
+            path (str, optional): Directory with a file per service, or env-file.
+                                  If not provided, GRIMOIRELAB_ENIGMA_LOCAL_PATH is used.
+            check_interval (float, optional): Seconds between checks of the files for
+                                              changes. If not provided,
+                                              GRIMOIRELAB_ENIGMA_LOCAL_CHECK_INTERVAL or 1.
+
+        Returns:
+            LocalManager: The singleton LocalManager instance for the path
+
+        Raises:
+            ValueError: If no path is configured
+        """
+        if path is None:
+            path = os.environ.get("GRIMOIRELAB_ENIGMA_LOCAL_PATH")
+        if not path:
+            raise ValueError("A path to the local secrets is required")
+        if check_interval is None:
+            check_interval = float(
+                os.environ.get("GRIMOIRELAB_ENIGMA_LOCAL_CHECK_INTERVAL", DEFAULT_CHECK_INTERVAL)
+            )
+
+        def create():
+            _logger.debug("Creating new local manager")
+            return LocalManager(path, check_interval=check_interval)
+
+        return SecretsManagerFactory._get_or_create(("local", os.path.abspath(path)), create)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=SecretsManagerFactory._reset_after_fork)
+
+
+def _vault_auth_from_environment():
+    """Builds the Vault auth configured in the environment, None for tokens."""
+    method = os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_AUTH_METHOD", METHOD_TOKEN)
+
+    if method == METHOD_APPROLE:
+        return VaultAuth(
+            method,
+            role_id=os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_ROLE_ID"),
+            secret_id=os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_SECRET_ID"),
+        )
+    elif method == METHOD_KUBERNETES:
+        kwargs = {}
+        if os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_JWT_PATH"):
+            kwargs["jwt_path"] = os.environ["GRIMOIRELAB_ENIGMA_VAULT_JWT_PATH"]
+        return VaultAuth(method, role=os.environ.get("GRIMOIRELAB_ENIGMA_VAULT_ROLE"), **kwargs)
+    elif method != METHOD_TOKEN:
+        raise ValueError(f"Unsupported Vault auth method: {method}")
+    return None
+
+
+def _bw_session_store_from_environment():
+    """
+    Builds the Bitwarden session store configured in the environment.
+
+    GRIMOIRELAB_ENIGMA_BW_SESSION_STORE can be "keyring", "file" for the
+    default session file, or the path of a session file. None if not set.
+    """
+    store = os.environ.get("GRIMOIRELAB_ENIGMA_BW_SESSION_STORE")
+    if not store:
+        return None
+    if store == "keyring":
+        return KeyringSessionStore()
+    if store == "file":
+        return FileSessionStore()
+    return FileSessionStore(store)
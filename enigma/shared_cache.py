@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from .cache import SecretCache, DEFAULT_TTL, DEFAULT_STALE_TTL, DEFAULT_GRACE_PERIOD, DEFAULT_MAX_BYTES
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_TIMEOUT = 10
+_POLL_INTERVAL = 0.05
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS secrets (namespace TEXT NOT NULL, key TEXT NOT NULL,"
+    " value BLOB NOT NULL, stored REAL NOT NULL, ttl REAL NOT NULL, PRIMARY KEY (namespace, key))",
+    "CREATE TABLE IF NOT EXISTS leases (namespace TEXT NOT NULL, key TEXT NOT NULL,"
+    " expires REAL NOT NULL, owner TEXT NOT NULL DEFAULT '', PRIMARY KEY (namespace, key))",
+)
+
+
+def _load_key(path: str, key: str = None) -> bytes:
+    """
+    Returns the encryption key of the cache file.
+
+    The key is taken from the argument, from GRIMOIRELAB_ENIGMA_CACHE_KEY or
+    from a key file next to the cache, readable only by its owner, which is
+    created the first time.
+    """
+    key = key or os.environ.get("GRIMOIRELAB_ENIGMA_CACHE_KEY")
+    if key:
+        return key.encode() if isinstance(key, str) else key
+
+    from cryptography.fernet import Fernet
+
+    key_path = path + ".key"
+    if os.path.exists(key_path):
+        with open(key_path, "rb") as key_file:
+            return key_file.read().strip()
+
+    # The key is written before the file appears, so other processes
+    # starting at the same time never read an empty key file
+    key = Fernet.generate_key()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(key_path) or ".", prefix=".enigma-key-")
+    try:
+        with os.fdopen(fd, "wb") as key_file:
+            key_file.write(key)
+        os.link(tmp_path, key_path)
+    except FileExistsError:
+        with open(key_path, "rb") as key_file:
+            return key_file.read().strip()
+    finally:
+        os.unlink(tmp_path)
+    return key
+
+
+class SharedSecretCache(SecretCache):
+    """
+    Secret cache shared by the processes of a host.
+
+    Values are also kept in an SQLite file in WAL mode, encrypted with
+    Fernet, so a secret loaded by one process is served to the others until
+    its ttl expires. Readers never wait for writers. When a value is missing,
+    a process takes a lease on it before calling the backend and the other
+    processes wait for the result instead of loading it too.
+
+    In-process behaviour (stale serving, grace period, memory budget) is the
+    one of SecretCache. Requires the cryptography package.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str = "",
+        key: str = None,
+        ttl: float = DEFAULT_TTL,
+        stale_ttl: float = DEFAULT_STALE_TTL,
+        grace_period: float = DEFAULT_GRACE_PERIOD,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+    ):
+        """
+        Args:
+            path (str): Path of the cache file
+            namespace (str): Prefix of the keys of this cache, to tell managers apart
+            key (str, optional): Fernet key. Defaults to GRIMOIRELAB_ENIGMA_CACHE_KEY
+                or to a key file created next to the cache.
+            ttl (float): Seconds a loaded value is considered fresh
+            stale_ttl (float): Seconds after ttl a stale value is served while refreshing
+            grace_period (float): Seconds after ttl the last good value is served on errors
+            max_bytes (int): Memory budget of the values kept in this process, in bytes
+            lease_timeout (float): Seconds to wait for another process loading a value
+
+        Raises:
+            ImportError: If cryptography is not installed
+        """
+        super().__init__(ttl=ttl, stale_ttl=stale_ttl, grace_period=grace_period, max_bytes=max_bytes)
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError as e:
+            _logger.error("cryptography is not installed: %s", e)
+            raise e
+
+        self.path = path
+        self.namespace = namespace
+        self.lease_timeout = lease_timeout
+        self._fernet = Fernet(_load_key(path, key))
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread and process."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        connection = sqlite3.connect(self.path, timeout=self.lease_timeout, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        # Files created before leases had an owner
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(leases)")]
+        if "owner" not in columns:
+            try:
+                connection.execute("ALTER TABLE leases ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+            except sqlite3.OperationalError:
+                # Added meanwhile by another process
+                pass
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _read(self, key: str):
+        """Returns the value of key in the file and its age, or None if missing or expired."""
+        row = self._connect().execute(
+            "SELECT value, stored, ttl FROM secrets WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+
+        token, stored, ttl = row
+        age = time.time() - stored
+        if age >= ttl:
+            return None
+        try:
+            namespace, stored_key, value = json.loads(self._fernet.decrypt(token))
+        except Exception as e:
+            _logger.warning("Could not decrypt shared cache entry for %s: %s", key, e)
+            return None
+        # Rows copied under another key are not taken as its value
+        if (namespace, stored_key) != (self.namespace, key):
+            return None
+        return value, age, ttl
+
+    def _write(self, key: str, value, ttl: float) -> None:
+        try:
+            token = self._fernet.encrypt(json.dumps([self.namespace, key, value]).encode())
+        except TypeError as e:
+            _logger.debug("Not sharing %s: %s", key, e)
+            return
+
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO secrets (namespace, key, value, stored, ttl) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, token, now, ttl),
+            )
+            connection.execute("DELETE FROM secrets WHERE stored + ttl < ?", (now - self.stale_ttl,))
+
+    def _acquire_lease(self, key: str) -> str:
+        """
+        Takes the lease to load key.
+
+        Returns:
+            str: Owner token of the lease, to release it; None if another process holds it
+        """
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "DELETE FROM leases WHERE namespace = ? AND key = ? AND expires < ?", (self.namespace, key, now)
+            )
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO leases (namespace, key, expires, owner) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, now + self.lease_timeout, owner),
+            )
+            return owner if cursor.rowcount == 1 else None
+
+    def _release_lease(self, key: str, owner: str) -> None:
+        """Releases a lease, unless it expired and was taken by someone else."""
+        self._connect().execute(
+            "DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?", (self.namespace, key, owner)
+        )
+
+    def _wait_for(self, key: str) -> tuple:
+        """
+        Waits for another process to load key.
+
+        Returns:
+            tuple: The shared value, or None if it wasn't loaded in time, and the
+                   owner token of the lease if it was released and taken meanwhile
+        """
+        deadline = time.monotonic() + self.lease_timeout
+        while time.monotonic() < deadline:
+            time.sleep(_POLL_INTERVAL)
+            shared = self._read(key)
+            if shared is not None:
+                return shared, None
+            shared, owner = self._take_lease(key)
+            if shared is not None or owner is not None:
+                return shared, owner
+        return None, None
+
+    def _take_lease(self, key: str) -> tuple:
+        """
+        Takes the lease to load key, unless its value is already shared.
+
+        Returns:
+            tuple: The shared value, if it was written right before the lease
+                   was released, and the owner token of the lease if it was taken
+        """
+        owner = self._acquire_lease(key)
+        if owner is None:
+            return None, None
+        shared = self._read(key)
+        if shared is not None:
+            self._release_lease(key, owner)
+            return shared, None
+        return None, owner
+
+    def _load(self, key: str, loader, ttl):
+        owner = None
+        shared = self._read(key)
+        if shared is None:
+            shared, owner = self._take_lease(key)
+            if shared is None and owner is None:
+                shared, owner = self._wait_for(key)
+
+        if shared is not None:
+            value, age, shared_ttl = shared
+            self._store(key, value, shared_ttl, time.monotonic() - age)
+            return value
+
+        try:
+            value = loader()
+            ttl = self._ttl_for(value, ttl)
+            self._store(key, value, ttl, time.monotonic())
+            self._write(key, value, ttl)
+        finally:
+            if owner is not None:
+                self._release_lease(key, owner)
+        return value
+
+    def put(self, key: str, value, ttl: float = None) -> None:
+        """Caches a value in this process and in the cache file."""
+        ttl = self._ttl_for(value, ttl)
+        self._store(key, value, ttl, time.monotonic())
+        self._write(key, value, ttl)
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        Removes an entry from this process and from the cache file.
+
+        Args:
+            key (str, optional): Key to remove. If not given, every entry of the namespace is removed.
+        """
+        super().invalidate(key)
+        connection = self._connect()
+        if key is None:
+            connection.execute("DELETE FROM secrets WHERE namespace = ?", (self.namespace,))
+        else:
+            connection.execute("DELETE FROM secrets WHERE namespace = ? AND key = ?", (self.namespace, key))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+OUTCOME_OK = "ok"
+OUTCOME_NOT_FOUND = "not_found"
+OUTCOME_ERROR = "error"
+
+
+class Span:
+    """
+    A single traced stage of a secret retrieval.
+
+    Spans are used as context managers. When the block exits the outcome
+    is set to "error" if an exception escaped, or to "ok" if nothing else
+    was recorded with set_outcome. Secret values must never be stored as
+    attributes, only the backend, the service and the outcome.
+    """
+
+    def set_attribute(self, key: str, value) -> None:
+        """Records an attribute on the span."""
+
+    def set_outcome(self, outcome: str) -> None:
+        """Records the outcome of the stage (ok, not_found or error)."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = Span()
+
+
+class Tracer:
+    """
+    Interface used by enigma to report the stages of a secret retrieval.
+
+    The default implementation does nothing. Subclasses override span to
+    plug enigma into a tracing system.
+    """
+
+    def span(self, name: str, backend: str = None, service: str = None) -> Span:
+        """
+        Creates a span for a retrieval stage.
+
+        Args:
+            name (str): Name of the stage, e.g. "aws.fetch"
+            backend (str, optional): Secrets manager in use
+            service (str, optional): Service whose credentials are retrieved
+
+        Returns:
+            Span: A context manager wrapping the stage
+        """
+        return _NOOP_SPAN
+
+
+class NoopTracer(Tracer):
+    """Tracer that discards every span. Used by default."""
+
+
+class _OpenTelemetrySpan(Span):
+    """Span forwarding attributes and outcome to an OpenTelemetry span."""
+
+    def __init__(self, tracer, name: str, attributes: dict):
+        self._tracer = tracer
+        self._name = name
+        self._attributes = attributes
+        self._outcome = None
+        self._context = None
+        self._span = None
+
+    def set_attribute(self, key: str, value) -> None:
+        if self._span is not None:
+            self._span.set_attribute(key, value)
+        else:
+            self._attributes[key] = value
+
+    def set_outcome(self, outcome: str) -> None:
+        self._outcome = outcome
+
+    def __enter__(self):
+        self._context = self._tracer.start_as_current_span(
+            self._name, attributes=self._attributes
+        )
+        self._span = self._context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._outcome is None:
+            self._outcome = OUTCOME_ERROR if exc_type else OUTCOME_OK
+        self._span.set_attribute("enigma.outcome", self._outcome)
+        return self._context.__exit__(exc_type, exc_value, traceback)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Tracer that reports every stage as an OpenTelemetry span.
+
+    Requires the opentelemetry-api package. Spans are created with the
+    tracer given or, by default, with the one registered globally under
+    the "enigma" instrumentation name.
+    """
+
+    def __init__(self, tracer=None):
+        """
+        Args:
+            tracer (opentelemetry.trace.Tracer, optional): Tracer to use
+
+        Raises:
+            ImportError: If opentelemetry-api is not installed
+        """
+        if tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError as e:
+                _logger.error("OpenTelemetry is not installed: %s", e)
+                raise e
+            tracer = trace.get_tracer("enigma")
+        self._tracer = tracer
+
+    def span(self, name: str, backend: str = None, service: str = None) -> Span:
+        attributes = {}
+        if backend is not None:
+            attributes["enigma.backend"] = backend
+        if service is not None:
+            attributes["enigma.service"] = service
+        return _OpenTelemetrySpan(self._tracer, name, attributes)
+
+
+_tracer = NoopTracer()
+
+
+def get_tracer() -> Tracer:
+    """Returns the tracer currently in use."""
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> None:
+    """
+    Sets the tracer used by enigma and its managers.
+
+    Args:
+        tracer (Tracer): The tracer to use. None restores the no-op tracer.
+    """
+    global _tracer
+    _tracer = tracer if tracer is not None else NoopTracer()
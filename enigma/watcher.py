@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Author:
+#     Alberto Ferrer Sánchez (alberefe@gmail.com)
+#
+
+
+import logging
+import threading
+
+from .enigma import _get_manager
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60
+
+
+class Watcher:
+    """
+    Polls a secrets manager for rotated credentials.
+
+    Every interval the versions of the watched secrets are asked to the
+    manager (AWS LastChangedDate, Vault KV v2 metadata version, Bitwarden
+    revision date), without reading their values. When a version changes,
+    the secret is dropped from the manager cache and the callback is called
+    with the name of the secret.
+    """
+
+    def __init__(self, manager, services: list, callback, interval: float = DEFAULT_INTERVAL):
+        """
+        Args:
+            manager: Secrets manager holding the secrets
+            services (list): Names of the secrets to watch
+            callback (callable): Function called with the name of each rotated secret
+            interval (float): Seconds between polls
+        """
+        self.manager = manager
+        self.services = list(services)
+        self.callback = callback
+        self.interval = interval
+        self._versions = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self) -> list:
+        """
+        Checks the versions of the secrets once.
+
+        The first poll only records the current versions.
+
+        Returns:
+            list: Names of the secrets rotated since the previous poll
+        """
+        versions = self.manager.get_versions(self.services)
+        previous, self._versions = self._versions, versions
+        if previous is None:
+            return []
+
+        rotated = [
+            service_name for service_name in self.services
+            if versions.get(service_name) != previous.get(service_name)
+        ]
+        for service_name in rotated:
+            _logger.info("Secret %s rotated", service_name)
+            self.manager.invalidate(service_name)
+            try:
+                self.callback(service_name)
+            except Exception as e:
+                _logger.error("Rotation callback failed for %s: %s", service_name, e)
+        return rotated
+
+    def start(self) -> "Watcher":
+        """Starts polling in a background thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._poll_loop, name="enigma-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops polling."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+    def _poll_loop(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                _logger.error("Could not check secret versions: %s", e)
+            if self._stop.wait(self.interval):
+                break
+
+
+def watch(manager, services: list, callback, interval: float = DEFAULT_INTERVAL) -> Watcher:
+    """
+    Calls back when any of the secrets rotates.
+
+    Args:
+        manager: Secrets manager, or its name (bitwarden, hashicorp, aws)
+        services (list): Names of the secrets to watch
+        callback (callable): Function called with the name of each rotated secret
+        interval (float): Seconds between polls
+
+    Returns:
+        Watcher: The running watcher. Call stop() to stop it.
+    """
+    if isinstance(manager, str):
+        manager = _get_manager(manager)
+    return Watcher(manager, services, callback, interval=interval).start()
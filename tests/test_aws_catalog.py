@@ -0,0 +1,136 @@
+import datetime
+import pytest
+from unittest.mock import patch, MagicMock
+
+from enigma.aws_catalog import AwsCatalog
+from enigma.aws_manager import AwsManager
+
+JANUARY = datetime.datetime(2024, 1, 1)
+FEBRUARY = datetime.datetime(2024, 2, 1)
+
+
+def listing(*secrets):
+    return [{"SecretList": list(secrets)}]
+
+
+def secret(name, changed=JANUARY, tags=()):
+    return {
+        "Name": name,
+        "ARN": f"arn:aws:secretsmanager:eu-west-1:123:secret:{name}-abc",
+        "LastChangedDate": changed,
+        "SecretVersionsToStages": {"v1": ["AWSPREVIOUS"], "v2": ["AWSCURRENT"]},
+        "Tags": [{"Key": key, "Value": value} for key, value in tags],
+    }
+
+
+@pytest.fixture
+def client():
+    client = MagicMock()
+    client.get_paginator.return_value.paginate.return_value = listing(
+        secret("grimoirelab/github", tags=[("team", "chaoss")]),
+        secret("grimoirelab/gitlab", tags=[("team", "bitergia")]),
+        secret("other/jira"),
+    )
+    return client
+
+
+def test_entries(client):
+    """Test that entries keep the ARN and the current version"""
+    entry = AwsCatalog(client).get("grimoirelab/github")
+
+    assert entry.arn == "arn:aws:secretsmanager:eu-west-1:123:secret:grimoirelab/github-abc"
+    assert entry.version == "v2"
+    assert entry.tags == {"team": "chaoss"}
+
+
+def test_prefix_query(client):
+    """Test queries by name prefix"""
+    assert AwsCatalog(client).names(prefix="grimoirelab/") == ["grimoirelab/github", "grimoirelab/gitlab"]
+
+
+def test_tag_query(client):
+    """Test queries by tag"""
+    catalog = AwsCatalog(client)
+
+    assert catalog.names(tags={"team": "chaoss"}) == ["grimoirelab/github"]
+    assert catalog.names(prefix="grimoirelab/", tags={"team": None}) == ["grimoirelab/github", "grimoirelab/gitlab"]
+    assert catalog.names(tags={"owner": None}) == []
+
+
+def test_listed_once_while_recent(client):
+    """Test that the secrets are not listed again while the index is recent"""
+    catalog = AwsCatalog(client)
+
+    catalog.names()
+    assert "other/jira" in catalog
+    assert len(catalog) == 3
+    client.get_paginator.return_value.paginate.assert_called_once()
+
+
+def test_incremental_refresh(client):
+    """Test that a refresh reports only added, changed and deleted secrets"""
+    catalog = AwsCatalog(client)
+    assert sorted(catalog.refresh()) == ["grimoirelab/github", "grimoirelab/gitlab", "other/jira"]
+    unchanged = catalog.get("grimoirelab/gitlab")
+
+    client.get_paginator.return_value.paginate.return_value = listing(
+        secret("grimoirelab/github", changed=FEBRUARY),
+        secret("grimoirelab/gitlab", tags=[("team", "bitergia")]),
+        secret("grimoirelab/bugzilla"),
+    )
+
+    assert sorted(catalog.refresh(force=True)) == ["grimoirelab/bugzilla", "grimoirelab/github", "other/jira"]
+    assert catalog.get("grimoirelab/gitlab") is unchanged
+    assert catalog.get("other/jira") is None
+
+
+def test_bulk_fetch():
+    """Test that secrets are fetched in batches and cached"""
+    with patch("enigma.aws_manager.get_shared_client") as get_client:
+        client = get_client.return_value
+        manager = AwsManager()
+    names = [f"grimoirelab/service-{number}" for number in range(25)]
+    client.batch_get_secret_value.side_effect = [
+        {"SecretValues": [{"Name": name, "ARN": name, "SecretString": f'{{"password": "{name}"}}'}
+                          for name in names[:20]]},
+        {"SecretValues": [{"Name": name, "ARN": name, "SecretString": f'{{"password": "{name}"}}'}
+                          for name in names[20:24]],
+         "Errors": [{"SecretId": names[24], "ErrorCode": "ResourceNotFoundException", "Message": "gone"}]},
+    ]
+
+    credentials = manager.get_secrets(names)
+
+    assert len(credentials) == 24
+    assert client.batch_get_secret_value.call_count == 2
+    assert manager.get_secret("grimoirelab/service-3", "password") == "grimoirelab/service-3"
+    client.get_secret_value.assert_not_called()
+
+
+def test_bulk_fetch_pages_and_cache():
+    """Test that cached secrets are skipped and every page is read"""
+    with patch("enigma.aws_manager.get_shared_client") as get_client:
+        client = get_client.return_value
+        manager = AwsManager()
+    manager.cache.put("github", {"password": "cached"})
+    client.batch_get_secret_value.side_effect = [
+        {"SecretValues": [{"Name": "gitlab", "ARN": "gitlab", "SecretString": '{"password": "a"}'}],
+         "NextToken": "next"},
+        {"SecretValues": [{"Name": "jira", "ARN": "jira", "SecretString": '{"password": "b"}'}]},
+    ]
+
+    credentials = manager.get_secrets(["github", "gitlab", "jira"])
+
+    assert credentials == {"github": {"password": "cached"}, "gitlab": {"password": "a"}, "jira": {"password": "b"}}
+    assert client.batch_get_secret_value.call_args_list[0][1] == {"SecretIdList": ["gitlab", "jira"]}
+    assert client.batch_get_secret_value.call_args_list[1][1]["NextToken"] == "next"
+
+
+def test_prefetch(client):
+    """Test that a catalog query feeds the bulk fetch"""
+    with patch("enigma.aws_manager.get_shared_client", return_value=client):
+        manager = AwsManager()
+    client.batch_get_secret_value.return_value = {"SecretValues": []}
+
+    manager.prefetch(prefix="grimoirelab/")
+
+    client.batch_get_secret_value.assert_called_once_with(SecretIdList=["grimoirelab/github", "grimoirelab/gitlab"])
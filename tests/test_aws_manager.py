@@ -1,9 +1,12 @@
+import contextlib
 import pytest
 from unittest.mock import patch, MagicMock
 import json
 from botocore.exceptions import ClientError, EndpointConnectionError, SSLError
 
-from enigma.aws_manager import AwsManager
+from enigma import aws_manager
+from enigma.aws_manager import AwsManager, CLIENT_CONFIG
+from enigma.cache import SecretCache
 
 MOCK_SECRET_RESPONSE = {
     "ARN": "arn:aws:secretsmanager:region:account:secret:test-secret-123456",
@@ -13,24 +16,39 @@ MOCK_SECRET_RESPONSE = {
     "VersionStages": ["AWSCURRENT"]
 }
 
+
+@pytest.fixture(autouse=True)
+def shared_session():
+    """Starts every test without a shared session"""
+    aws_manager.reset_shared_session()
+    yield
+    aws_manager.reset_shared_session()
+
+
+@contextlib.contextmanager
+def patch_client():
+    """Patches the creation of clients from the shared session"""
+    with patch('boto3.Session') as mock_session:
+        yield mock_session.return_value.client
+
 def test_initialization():
     """Test successful initialization"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_boto.return_value = MagicMock()
         manager = AwsManager()
-        mock_boto.assert_called_once_with('secretsmanager')
+        mock_boto.assert_called_once_with('secretsmanager', config=CLIENT_CONFIG)
         assert manager.client is not None
 
 def test_initialization_endpoint_error():
     """Test initialization failure due to endpoint error"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_boto.side_effect = EndpointConnectionError(endpoint_url="http://example.com")
         with pytest.raises(EndpointConnectionError):
             AwsManager()
 
 def test_initialization_ssl_error():
     """Test initialization failure due to SSL error"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_boto.side_effect = SSLError(
             error="SSL Validation failed",
             endpoint_url="http://example.com"
@@ -40,7 +58,7 @@ def test_initialization_ssl_error():
 
 def test_retrieve_and_format_credentials_success():
     """Test successful retrieval and formatting of credentials"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_client = MagicMock()
         mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
         mock_boto.return_value = mock_client
@@ -54,7 +72,7 @@ def test_retrieve_and_format_credentials_success():
 
 def test_retrieve_and_format_credentials_not_found():
     """Test handling of non-existent secrets"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_client = MagicMock()
         error_response = {
             'Error': {
@@ -75,7 +93,7 @@ def test_retrieve_and_format_credentials_not_found():
 
 def test_retrieve_and_format_credentials_invalid_json():
     """Test handling of invalid JSON in secret value"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_client = MagicMock()
         invalid_response = MOCK_SECRET_RESPONSE.copy()
         invalid_response['SecretString'] = 'invalid json'
@@ -89,7 +107,7 @@ def test_retrieve_and_format_credentials_invalid_json():
 
 def test_get_secret_success():
     """Test successful secret retrieval"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_client = MagicMock()
         mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
         mock_boto.return_value = mock_client
@@ -101,7 +119,7 @@ def test_get_secret_success():
 
 def test_get_secret_missing_credential():
     """Test handling of non existant credential"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_client = MagicMock()
         mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
         mock_boto.return_value = mock_client
@@ -113,7 +131,7 @@ def test_get_secret_missing_credential():
 
 def test_get_secret_service_error():
     """Test handling of AWS service errors"""
-    with patch('boto3.client') as mock_boto:
+    with patch_client() as mock_boto:
         mock_client = MagicMock()
         error_response = {
             'Error': {
@@ -129,4 +147,100 @@ def test_get_secret_service_error():
         manager = AwsManager()
 
         with pytest.raises(Exception):
-            manager.get_secret("test-secret", "api_key")
\ No newline at end of file
+            manager.get_secret("test-secret", "api_key")
+
+
+def test_get_secret_cached():
+    """Test that secrets are retrieved once and then served from the cache"""
+    with patch_client() as mock_boto:
+        mock_client = MagicMock()
+        mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
+        mock_boto.return_value = mock_client
+
+        manager = AwsManager()
+
+        assert manager.get_secret("test-secret", "api_key") == "test_key"
+        assert manager.get_secret("test-secret", "username") == "test_user"
+        mock_client.get_secret_value.assert_called_once_with(SecretId="test-secret")
+
+
+def test_get_secret_serves_stale_when_unreachable():
+    """Test that the last known value is served while AWS is unreachable"""
+    with patch_client() as mock_boto:
+        mock_client = MagicMock()
+        mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
+        mock_boto.return_value = mock_client
+
+        manager = AwsManager(cache=SecretCache(ttl=0, stale_ttl=0, grace_period=60))
+        assert manager.get_secret("test-secret", "api_key") == "test_key"
+
+        mock_client.get_secret_value.side_effect = EndpointConnectionError(endpoint_url="http://example.com")
+        assert manager.get_secret("test-secret", "api_key") == "test_key"
+
+
+def test_initialization_several_regions():
+    """Test that a client is created for every region"""
+    with patch_client() as mock_boto:
+        manager = AwsManager(regions=["eu-west-1", "us-east-1"])
+
+        assert len(manager.clients) == 2
+        mock_boto.assert_any_call('secretsmanager', region_name="eu-west-1", config=CLIENT_CONFIG)
+        mock_boto.assert_any_call('secretsmanager', region_name="us-east-1", config=CLIENT_CONFIG)
+
+
+def test_shared_session_reused():
+    """Test that managers share the session and its client"""
+    with patch_client() as mock_boto:
+        first = AwsManager()
+        second = AwsManager()
+
+        mock_boto.assert_called_once_with('secretsmanager', config=CLIENT_CONFIG)
+        assert first.client is second.client
+
+
+def test_shared_session_preloads_service_model():
+    """Test that the shared session is created once with the service model loaded"""
+    with patch('botocore.session.get_session') as mock_get_session, patch('boto3.Session') as mock_session:
+        first = aws_manager.get_shared_session()
+        second = aws_manager.get_shared_session()
+
+        assert first is second
+        mock_get_session.return_value.get_service_model.assert_called_once_with('secretsmanager')
+        mock_session.assert_called_once_with(botocore_session=mock_get_session.return_value)
+
+
+def test_initialization_injected_session():
+    """Test that clients are created with the injected session"""
+    session = MagicMock()
+
+    manager = AwsManager(session=session, region_name="eu-west-1")
+
+    session.client.assert_called_once_with('secretsmanager', region_name="eu-west-1", config=CLIENT_CONFIG)
+    assert manager.client is session.client.return_value
+
+
+def test_initialization_injected_client():
+    """Test that an injected client is used as is"""
+    mock_client = MagicMock()
+    mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
+
+    with patch_client() as mock_boto:
+        manager = AwsManager(client=mock_client)
+        mock_boto.assert_not_called()
+
+    assert manager.get_secret("test-secret", "api_key") == "test_key"
+
+
+def test_warmup_every_region():
+    """Test that warming up makes a request with every client, even if it is denied"""
+    clients = [MagicMock(), MagicMock()]
+    clients[1].list_secrets.side_effect = ClientError(
+        {"Error": {"Code": "AccessDeniedException", "Message": "Denied"}}, "ListSecrets"
+    )
+    with patch.object(AwsManager, "_create_client", side_effect=clients):
+        manager = AwsManager(regions=["eu-west-1", "us-east-1"])
+
+    manager.warmup()
+
+    for client in clients:
+        client.list_secrets.assert_called_once_with(MaxResults=1)
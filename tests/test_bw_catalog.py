@@ -0,0 +1,214 @@
+import io
+import json
+import unittest
+from unittest.mock import MagicMock
+
+from enigma.bw_catalog import BitwardenCatalog, BitwardenItem, iter_json_array
+
+ITEMS = [
+    {"id": "b", "name": "github", "folderId": "f1", "collectionIds": [],
+     "revisionDate": "2024-01-01T00:00:00.000Z"},
+    {"id": "a", "name": "github", "folderId": "f2", "collectionIds": ["c1"],
+     "revisionDate": "2024-01-01T00:00:00.000Z"},
+    {"id": "c", "name": "GitLab", "folderId": None, "collectionIds": [],
+     "revisionDate": "2024-03-01T00:00:00.000Z"},
+    {"id": "d", "name": "gitlab", "folderId": None, "collectionIds": [],
+     "revisionDate": "2024-02-01T00:00:00.000Z"},
+]
+
+FOLDERS = [{"id": "f1", "name": "Work"}, {"id": "f2", "name": "Personal"}, {"id": None, "name": "No Folder"}]
+COLLECTIONS = [{"id": "c1", "name": "Team/Shared"}]
+
+
+class TestBitwardenCatalog(unittest.TestCase):
+    """BitwardenCatalog unit tests"""
+
+    def setUp(self):
+        self.paths_loader = MagicMock(return_value=(FOLDERS, COLLECTIONS))
+        self.catalog = BitwardenCatalog(ITEMS, paths_loader=self.paths_loader)
+
+    def test_resolve_by_id(self):
+        """Test lookups by item id"""
+        self.assertEqual(self.catalog.resolve("d").name, "gitlab")
+
+    def test_resolve_exact_name(self):
+        """Test that an exact name wins over a case insensitive match"""
+        self.assertEqual(self.catalog.resolve("gitlab").id, "d")
+        self.assertEqual(self.catalog.resolve("GitLab").id, "c")
+
+    def test_resolve_ignoring_case(self):
+        """Test lookups differing only in case"""
+        self.assertEqual(self.catalog.resolve("GITLAB").id, "c")
+
+    def test_resolve_ambiguous_name(self):
+        """Test that ambiguous names resolve deterministically"""
+        self.assertEqual(self.catalog.resolve("github").id, "a")
+        reversed_catalog = BitwardenCatalog(list(reversed(ITEMS)))
+        self.assertEqual(reversed_catalog.resolve("github").id, "a")
+
+    def test_resolve_by_path(self):
+        """Test lookups by folder and collection path"""
+        self.assertEqual(self.catalog.resolve("Work/github").id, "b")
+        self.assertEqual(self.catalog.resolve("personal/GITHUB").id, "a")
+        self.assertEqual(self.catalog.resolve("Team/Shared/github").id, "a")
+
+    def test_paths_loaded_lazily(self):
+        """Test that folders and collections are only listed when needed"""
+        self.catalog.resolve("github")
+        self.paths_loader.assert_not_called()
+
+        self.catalog.resolve("Work/github")
+        self.catalog.resolve("Personal/github")
+        self.paths_loader.assert_called_once()
+
+    def test_resolve_missing(self):
+        """Test lookups of items not in the vault"""
+        self.assertIsNone(self.catalog.resolve("bugzilla"))
+        self.assertIsNone(self.catalog.resolve("Work/bugzilla"))
+
+    def test_update_reuses_unchanged_items(self):
+        """Test that an update only rebuilds the changed items"""
+        unchanged = self.catalog.resolve("d")
+        items = [dict(item) for item in ITEMS if item["id"] != "b"]
+        items[0]["revisionDate"] = "2024-04-01T00:00:00.000Z"
+        items.append({"id": "e", "name": "jira", "folderId": None, "collectionIds": [],
+                      "revisionDate": "2024-04-01T00:00:00.000Z"})
+
+        changed = self.catalog.update(items)
+
+        self.assertEqual(sorted(changed), ["a", "b", "e"])
+        self.assertIs(self.catalog.resolve("d"), unchanged)
+        self.assertEqual(self.catalog.resolve("jira").id, "e")
+        self.assertIsNone(self.catalog.resolve("b"))
+        self.assertEqual(len(self.catalog), 4)
+
+    def test_update_keeps_resolution_order(self):
+        """Test that updated indexes resolve like a new catalog"""
+        items = [dict(item) for item in ITEMS]
+        items[3]["revisionDate"] = "2024-05-01T00:00:00.000Z"
+        items[3]["name"] = "GitLab"
+
+        self.catalog.update(items)
+        rebuilt = BitwardenCatalog(items)
+
+        for name in ("github", "GitLab", "gitlab", "GITLAB", "a", "d"):
+            self.assertEqual(self.catalog.resolve(name).id, rebuilt.resolve(name).id)
+
+    def test_update_unchanged(self):
+        """Test that a listing without changes doesn't touch the indexes"""
+        self.assertEqual(self.catalog.update(ITEMS), [])
+
+    def test_update_reindexes_paths(self):
+        """Test that paths are indexed again after an update"""
+        self.catalog.resolve("Work/github")
+        items = [dict(item) for item in ITEMS]
+        items[0]["folderId"] = "f2"
+        items[0]["revisionDate"] = "2024-06-01T00:00:00.000Z"
+
+        self.catalog.update(items)
+
+        self.assertIsNone(self.catalog.resolve("Work/github"))
+        self.assertEqual(self.catalog.resolve("Personal/github").id, "b")
+
+
+def make_item(number):
+    """Item as listed by the CLI, with the metadata enigma doesn't use"""
+    return {
+        "object": "item", "id": f"{number:08d}-0000-0000-0000-000000000000",
+        "organizationId": None, "folderId": "f1", "collectionIds": [], "type": 1,
+        "reprompt": 0, "name": f"service-{number}", "notes": "Some notes " * 20,
+        "favorite": False, "fields": [{"name": "api_key", "value": f"key-{number}", "type": 1}],
+        "login": {"uris": [{"match": None, "uri": "https://example.com"}],
+                  "username": f"user-{number}", "password": f"password-{number}", "totp": None,
+                  "passwordRevisionDate": None},
+        "passwordHistory": [{"lastUsedDate": "2024-01-01T00:00:00.000Z", "password": "old"}],
+        "revisionDate": "2024-01-01T00:00:00.000Z", "creationDate": "2024-01-01T00:00:00.000Z",
+        "deletedDate": None,
+    }
+
+
+class TestBitwardenItem(unittest.TestCase):
+    """BitwardenItem unit tests"""
+
+    def test_keeps_used_fields(self):
+        """Test that records keep what is needed to format credentials"""
+        item = BitwardenItem.from_dict(make_item(1))
+
+        self.assertFalse(hasattr(item, "__dict__"))
+        self.assertEqual(item.to_dict(), {
+            "id": "00000001-0000-0000-0000-000000000000",
+            "name": "service-1",
+            "login": {"username": "user-1", "password": "password-1"},
+            "fields": [{"name": "api_key", "value": "key-1"}],
+        })
+
+    def test_item_without_login(self):
+        """Test records of items that are not logins"""
+        item = BitwardenItem.from_dict({"id": "1", "name": "note", "type": 2})
+
+        self.assertIsNone(item.username)
+        self.assertEqual(item.fields, ())
+
+    def test_iter_json_array(self):
+        """Test that a listing is decoded across chunk boundaries"""
+        items = [make_item(number) for number in range(20)]
+        stream = io.StringIO(json.dumps(items, indent=2))
+
+        self.assertEqual(list(iter_json_array(stream, chunk_size=7)), items)
+        self.assertEqual(list(iter_json_array(io.StringIO(" [ ] "))), [])
+
+    def test_iter_json_array_invalid(self):
+        """Test that other JSON documents are rejected"""
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"id": "1"}')))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"id": "1"}')))
+
+
+class TestCatalogFootprint(unittest.TestCase):
+    """Memory footprint of the catalog"""
+
+    def test_large_vault_footprint(self):
+        """Test that a 10k items vault is indexed within a bounded footprint"""
+        listing = json.dumps([make_item(number) for number in range(10000)])
+
+        catalog = BitwardenCatalog.from_json(listing)
+
+        self.assertTrue(catalog.complete)
+        self.assertEqual(len(catalog), 10000)
+        self.assertEqual(catalog.resolve("SERVICE-9999").password, "password-9999")
+        # Under 1 KiB per item, notes and history included in the listing
+        self.assertLess(catalog.footprint(), 10000 * 1024)
+
+    def test_max_bytes(self):
+        """Test that indexing stops at the memory budget"""
+        items = [make_item(number) for number in range(100)]
+        budget = BitwardenItem.from_dict(items[0]).footprint() * 10
+
+        with self.assertLogs("enigma.bw_catalog", level="WARNING"):
+            catalog = BitwardenCatalog(items, max_bytes=budget)
+
+        self.assertFalse(catalog.complete)
+        self.assertLessEqual(len(catalog), 10)
+        self.assertIsNone(catalog.resolve("service-99"))
+
+    def test_max_bytes_keeps_newest_items(self):
+        """Test that the items kept over the budget don't depend on the listing order"""
+        items = [make_item(number) for number in range(100)]
+        for number, item in enumerate(items):
+            item["revisionDate"] = f"2024-01-01T00:00:{number % 60:02d}.000Z"
+        budget = BitwardenItem.from_dict(items[0]).footprint() * 10
+
+        with self.assertLogs("enigma.bw_catalog", level="WARNING"):
+            catalog = BitwardenCatalog(items, max_bytes=budget)
+            reversed_catalog = BitwardenCatalog(list(reversed(items)), max_bytes=budget)
+
+        kept = [item.id for item in catalog]
+        self.assertEqual([item.id for item in reversed_catalog], kept)
+        self.assertEqual(catalog.resolve(kept[0]).revision_date, "2024-01-01T00:00:59.000Z")
+        self.assertIsNotNone(catalog.resolve("service-59"))
+        self.assertIsNone(catalog.resolve("service-0"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from enigma.bw_data import BitwardenDataFile, decrypt_enc_string, _SymmetricKey
+from enigma.bw_manager import BitwardenManager
+
+USER_ID = "4a5e7bd0-1111-2222-3333-444444444444"
+SESSION_KEY = bytes(range(64))
+USER_KEY = bytes(range(64, 128))
+ITEM_KEY = bytes(range(128, 192))
+
+
+def encrypt(key: bytes, plaintext: bytes) -> tuple:
+    iv = os.urandom(16)
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(plaintext) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key[:32]), modes.CBC(iv)).encryptor()
+    ciphertext = encryptor.update(padded) + encryptor.finalize()
+    mac = hmac.new(key[32:], iv + ciphertext, hashlib.sha256).digest()
+    return iv, ciphertext, mac
+
+
+def enc_string(key: bytes, text) -> str:
+    plaintext = text if isinstance(text, bytes) else text.encode()
+    return "2." + "|".join(base64.b64encode(part).decode() for part in encrypt(key, plaintext))
+
+
+def protected(key: bytes, plaintext: bytes) -> str:
+    iv, ciphertext, mac = encrypt(key, plaintext)
+    return base64.b64encode(bytes([2]) + iv + mac + ciphertext).decode()
+
+
+def make_data_file(path: str) -> None:
+    """Writes a data.json like the one of the CLI, with known keys"""
+    ciphers = {
+        "1": {
+            "id": "1", "organizationId": None, "folderId": None, "collectionIds": [],
+            "revisionDate": "2024-01-01T00:00:00.000Z", "type": 1,
+            "name": enc_string(USER_KEY, "GitHub"),
+            "notes": enc_string(USER_KEY, "not needed"),
+            "login": {"username": enc_string(USER_KEY, "octocat"), "password": enc_string(USER_KEY, "hunter2")},
+            "fields": [{"name": enc_string(USER_KEY, "api_key"), "value": enc_string(USER_KEY, "xyz"), "type": 1}],
+        },
+        "2": {
+            "id": "2", "organizationId": None, "folderId": "f1", "collectionIds": [],
+            "revisionDate": "2024-02-01T00:00:00.000Z", "type": 1,
+            "key": enc_string(USER_KEY, ITEM_KEY),
+            "name": enc_string(ITEM_KEY, "GitLab"),
+            "login": {"username": enc_string(ITEM_KEY, "tanuki"), "password": None},
+        },
+        "3": {
+            "id": "3", "organizationId": "org", "revisionDate": "2024-01-01T00:00:00.000Z",
+            "name": "2.b3JnYW5pemF0aW9u|a2V5|bWFj",
+        },
+        "4": {
+            "id": "4", "organizationId": None, "deletedDate": "2024-03-01T00:00:00.000Z",
+            "revisionDate": "2024-03-01T00:00:00.000Z", "name": enc_string(USER_KEY, "Trashed"),
+        },
+    }
+    data = {
+        "global_account_activeAccountId": USER_ID,
+        f"__PROTECTED__{USER_ID}_user_auto": protected(
+            SESSION_KEY, json.dumps(base64.b64encode(USER_KEY).decode()).encode()
+        ),
+        f"user_{USER_ID}_ciphers_ciphers": ciphers,
+    }
+    with open(path, "w") as fd:
+        json.dump(data, fd)
+
+
+class TestBitwardenDataFile(unittest.TestCase):
+    """BitwardenDataFile unit tests"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, "data.json")
+        make_data_file(self.path)
+
+    def test_items(self):
+        """Test that personal items are decrypted in the format of the CLI"""
+        data_file = BitwardenDataFile(self.path, base64.b64encode(SESSION_KEY).decode())
+
+        items = {item["id"]: item for item in data_file.items()}
+
+        self.assertEqual(items["1"]["name"], "GitHub")
+        self.assertEqual(items["1"]["login"], {"username": "octocat", "password": "hunter2"})
+        self.assertEqual(items["1"]["fields"], [{"name": "api_key", "value": "xyz"}])
+        self.assertEqual(items["2"]["name"], "GitLab")
+        self.assertEqual(items["2"]["login"], {"username": "tanuki", "password": None})
+        self.assertNotIn("4", items)
+        self.assertEqual(data_file.skipped, 1)
+
+    def test_wrong_session_key(self):
+        """Test that a session key that doesn't protect the user key is rejected"""
+        data_file = BitwardenDataFile(self.path, base64.b64encode(bytes(64)).decode())
+
+        with self.assertRaises(ValueError):
+            list(data_file.items())
+
+    def test_tampered_value(self):
+        """Test that values whose MAC doesn't match are not decrypted"""
+        iv, ciphertext, mac = enc_string(USER_KEY, "GitHub")[2:].split("|")
+        tampered = "2." + "|".join((iv, ciphertext, base64.b64encode(bytes(32)).decode()))
+
+        with self.assertRaises(ValueError):
+            decrypt_enc_string(tampered, _SymmetricKey(USER_KEY))
+
+    def test_manager_reads_data_file(self):
+        """Test that the manager resolves items without listing them with the CLI"""
+        with patch("subprocess.run") as mock_run:
+            manager = BitwardenManager("test@example.com", "password", read_data_file=True)
+            manager.session_key = base64.b64encode(SESSION_KEY).decode()
+            manager.last_sync_time = datetime.datetime.now()
+            mock_run.reset_mock()
+
+            with patch.dict(os.environ, {"BITWARDENCLI_APPDATA_DIR": self.directory}):
+                self.assertEqual(manager.get_secret("github", "password"), "hunter2")
+                self.assertEqual(manager.get_secret("GitLab", "username"), "tanuki")
+
+            mock_run.assert_not_called()
+            self.assertFalse(manager.catalog.complete)
+
+    def test_manager_falls_back_to_cli(self):
+        """Test that the CLI lists the items when the data file can't be read"""
+        with patch("subprocess.run") as mock_run:
+            manager = BitwardenManager("test@example.com", "password", read_data_file=True)
+            manager.session_key = base64.b64encode(bytes(64)).decode()
+            manager.last_sync_time = datetime.datetime.now()
+            mock_run.return_value = MagicMock(
+                returncode=0, stdout='[{"id": "1", "name": "GitHub", "login": {"password": "cli"}}]'
+            )
+
+            with patch.dict(os.environ, {"BITWARDENCLI_APPDATA_DIR": self.directory}), \
+                    self.assertLogs("enigma.bw_manager", level="WARNING"):
+                self.assertEqual(manager.get_secret("github", "password"), "cli")
+
+
+if __name__ == "__main__":
+    unittest.main()
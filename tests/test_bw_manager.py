@@ -1,9 +1,14 @@
+import json
+import os
+import tempfile
 import unittest
 import subprocess
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from unittest.mock import patch, MagicMock
 
+from enigma.bw_catalog import BitwardenCatalog
 from enigma.bw_manager import BitwardenManager
 
 
@@ -25,7 +30,6 @@ class TestBitwardenManager(unittest.TestCase):
         self.assertEqual(self.manager.session_key, None)
         self.assertEqual(self.manager.last_sync_time, None)
         self.assertEqual(self.manager.sync_interval, timedelta(minutes=3))
-        self.assertEqual(self.manager.formatted_credentials, {})
 
     @patch("subprocess.run")
     def test_login_success(self, mock_run):
@@ -155,7 +159,7 @@ class TestBitwardenManager(unittest.TestCase):
 
         mock_run.return_value = MagicMock(
             returncode=0,
-            stdout='{"name": "test_service", "login": {"username": "user", "password": "pass"}}',
+            stdout='[{"id": "1", "name": "test_service", "login": {"username": "user", "password": "pass"}}]',
         )
 
         result1 = self.manager._retrieve_credentials("test_service")
@@ -164,6 +168,179 @@ class TestBitwardenManager(unittest.TestCase):
         self.assertEqual(result1, result2)
         mock_run.assert_called_once()
 
+    @patch("subprocess.run")
+    def test_get_secret_case_insensitive(self, mock_run):
+        """Test lookups differing in case resolve without calling the CLI again"""
+
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout='[{"id": "1", "name": "GitHub", "login": {"username": "user", "password": "pass"}}]',
+        )
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        self.assertEqual(self.manager.get_secret("GitHub", "username"), "user")
+        self.assertEqual(self.manager.get_secret("github", "password"), "pass")
+        mock_run.assert_called_once()
+
+    @patch("subprocess.run")
+    def test_get_secret_names_differing_in_case(self, mock_run):
+        """Test that items whose names differ only in case are not mixed up"""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout='[{"id": "1", "name": "GitHub", "login": {"username": "user", "password": "upper"}},'
+                   ' {"id": "2", "name": "github", "login": {"username": "user", "password": "lower"}}]',
+        )
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        self.assertEqual(self.manager.get_secret("GitHub", "password"), "upper")
+        self.assertEqual(self.manager.get_secret("github", "password"), "lower")
+        self.assertEqual(self.manager.get_secret("GitHub", "password"), "upper")
+
+    @patch("subprocess.run")
+    def test_get_secret_not_found(self, mock_run):
+        """Test secret retrieval of an item missing from the vault"""
+
+        mock_run.return_value = MagicMock(returncode=0, stdout="[]")
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        self.assertEqual(self.manager.get_secret("missing", "password"), "")
+
+    @patch("subprocess.run")
+    def test_get_secret_beyond_catalog_budget(self, mock_run):
+        """Test that items left out of a full catalog are searched with the CLI and resolved"""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout='[{"id": "3", "name": "gitlab", "login": {"username": "user", "password": "lower"}},'
+                   ' {"id": "2", "name": "GitLab", "login": {"username": "user", "password": "pass"}}]',
+        )
+        self.manager.last_sync_time = datetime.datetime.now()
+        self.manager._catalog_time = self.manager.last_sync_time
+        self.manager.catalog = BitwardenCatalog([{"id": "1", "name": "GitHub"}])
+        self.manager.catalog.complete = False
+
+        self.assertEqual(self.manager.get_secret("GitLab", "password"), "pass")
+        self.assertEqual(mock_run.call_args[0][0][1:5], ["list", "items", "--search", "GitLab"])
+        mock_run.assert_called_once()
+
+    @staticmethod
+    def write_data_file(path, last_sync, revisions):
+        """Writes a data file of the CLI with items of the given revision dates"""
+        ciphers = {item_id: {"id": item_id, "revisionDate": revision} for item_id, revision in revisions.items()}
+        with open(path, "w") as fd:
+            json.dump({"global_account_activeAccountId": "u1", "user_u1_vaultTimeout_lastSync": last_sync,
+                       "user_u1_ciphers_ciphers": ciphers}, fd)
+
+    @patch("subprocess.run")
+    def test_catalog_updated_only_when_data_changed(self, mock_run):
+        """Test that the vault is listed again after a sync only if its items changed"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        data_file = os.path.join(directory.name, "data.json")
+        self.write_data_file(data_file, "2024-01-01T00:00:00Z", {"1": "2024-01-01"})
+        listing = '[{"id": "1", "name": "GitHub", "revisionDate": "2024-01-01"}]'
+        mock_run.return_value = MagicMock(returncode=0, stdout=listing)
+
+        with patch.dict(os.environ, {"BITWARDENCLI_APPDATA_DIR": directory.name}):
+            self.manager.last_sync_time = datetime.datetime.now()
+            catalog = self.manager._get_catalog()
+
+            # Synced without changes
+            self.manager.last_sync_time = datetime.datetime.now() + timedelta(seconds=1)
+            self.assertIs(self.manager._get_catalog(), catalog)
+            self.assertEqual(mock_run.call_count, 1)
+
+            # Synced with changes
+            self.write_data_file(data_file, "2024-01-01T00:03:00Z", {"1": "2024-02-01"})
+            mock_run.return_value = MagicMock(
+                returncode=0, stdout='[{"id": "1", "name": "GitLab", "revisionDate": "2024-02-01"}]'
+            )
+            self.manager.last_sync_time = datetime.datetime.now() + timedelta(seconds=2)
+            self.assertIs(self.manager._get_catalog(), catalog)
+            self.assertEqual(mock_run.call_count, 2)
+            self.assertEqual(catalog.resolve("gitlab").id, "1")
+
+    @patch("subprocess.run")
+    def test_catalog_kept_when_sync_rewrites_data_file(self, mock_run):
+        """Test that a sync rewriting the data file without changing any item doesn't list the vault"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        data_file = os.path.join(directory.name, "data.json")
+        self.write_data_file(data_file, "2024-01-01T00:00:00Z", {"1": "2024-01-01", "2": "2024-01-02"})
+        mock_run.return_value = MagicMock(
+            returncode=0, stdout='[{"id": "1", "name": "GitHub", "revisionDate": "2024-01-01"}]'
+        )
+
+        with patch.dict(os.environ, {"BITWARDENCLI_APPDATA_DIR": directory.name}):
+            self.manager.last_sync_time = datetime.datetime.now()
+            self.manager._get_catalog()
+
+            self.write_data_file(data_file, "2024-01-01T00:03:00.123Z", {"2": "2024-01-02", "1": "2024-01-01"})
+            self.manager.last_sync_time = datetime.datetime.now() + timedelta(seconds=1)
+            self.manager._get_catalog()
+
+        self.assertEqual(mock_run.call_count, 1)
+
+    @patch("subprocess.run")
+    def test_get_secret_concurrent(self, mock_run):
+        """Test that threads sharing a manager get the secrets of their services"""
+        listing = json.dumps([
+            {"id": str(number), "name": f"service-{number}",
+             "login": {"username": "user", "password": f"pass-{number}"}}
+            for number in range(8)
+        ])
+        mock_run.return_value = MagicMock(returncode=0, stdout=listing)
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        def get(number):
+            return self.manager.get_secret(f"service-{number}", "password")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(get, list(range(8)) * 25))
+
+        self.assertEqual(results, [f"pass-{number}" for number in range(8)] * 25)
+        self.assertEqual(mock_run.call_count, 1)
+
+    @patch("subprocess.run")
+    def test_commands_bounded_by_deadline(self, mock_run):
+        """Test that CLI commands get the time left of the deadline as timeout"""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout='[{"id": "1", "name": "GitHub", "login": {"username": "user", "password": "pass"}}]',
+        )
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        self.assertEqual(self.manager.get_secret("GitHub", "password", deadline=5), "pass")
+        self.assertLessEqual(mock_run.call_args.kwargs["timeout"], 5)
+
+        self.manager.invalidate("GitHub")
+        self.manager.catalog = None
+        self.manager.get_secret("GitHub", "password")
+        self.assertGreater(mock_run.call_args.kwargs["timeout"], 5)
+
+    @patch("subprocess.run")
+    def test_command_timeout(self, mock_run):
+        """Test that a hung CLI fails the lookup instead of blocking it"""
+        mock_run.side_effect = subprocess.TimeoutExpired(["bw", "list"], 5)
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.manager.get_secret("GitHub", "password", deadline=5)
+
+    @patch("subprocess.run")
+    def test_warmup_indexes_vault(self, mock_run):
+        """Test that after a warmup the first lookup doesn't run the CLI"""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout='[{"id": "1", "name": "GitHub", "login": {"username": "user", "password": "pass"}}]',
+        )
+        self.manager.last_sync_time = datetime.datetime.now()
+
+        self.manager.warmup()
+        self.assertEqual(mock_run.call_count, 1)
+
+        self.assertEqual(self.manager.get_secret("GitHub", "password"), "pass")
+        self.assertEqual(mock_run.call_count, 1)
+
     def test_format_credentials_complete(self):
         """Test formatting credentials"""
         raw_creds = {
@@ -181,17 +358,17 @@ class TestBitwardenManager(unittest.TestCase):
 
     def test_get_secret_success(self):
         """Test successful secret retrieval"""
-        self.manager.formatted_credentials = {
-            "service_name": "test_service",
-            "test_credential": "test_value",
-        }
+        self.manager.cache.put("test_service", {
+            "name": "test_service",
+            "fields": [{"name": "test_credential", "value": "test_value"}],
+        })
 
         result = self.manager.get_secret("test_service", "test_credential")
         self.assertEqual(result, "test_value")
 
     def test_get_secret_missing(self):
         """Test secret retrieval with non existant credential"""
-        self.manager.formatted_credentials = {"service_name": "test_service"}
+        self.manager.cache.put("test_service", {"name": "test_service"})
 
         result = self.manager.get_secret("test_service", "missing_credential")
         self.assertEqual(result, "")
@@ -0,0 +1,126 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from enigma.bw_manager import BitwardenManager
+from enigma.bw_session import FileSessionStore, KeyringSessionStore
+from enigma.secrets_manager_factory import _bw_session_store_from_environment
+
+
+class TestFileSessionStore(unittest.TestCase):
+    """FileSessionStore unit tests"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "sessions", "bw.json")
+        self.store = FileSessionStore(self.path)
+
+    def test_save_and_load(self):
+        """Test that a stored key is returned to another store"""
+        self.store.save("test@example.com", "session-key")
+
+        self.assertEqual(FileSessionStore(self.path).load("test@example.com"), "session-key")
+        self.assertIsNone(self.store.load("other@example.com"))
+
+    def test_file_private(self):
+        """Test that the file can only be read by its owner"""
+        self.store.save("test@example.com", "session-key")
+
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_readable_file_ignored(self):
+        """Test that keys in a file other users can read are not used"""
+        self.store.save("test@example.com", "session-key")
+        os.chmod(self.path, 0o644)
+
+        with self.assertLogs("enigma.bw_session", level="WARNING"):
+            self.assertIsNone(self.store.load("test@example.com"))
+
+    def test_expired_key(self):
+        """Test that expired keys are not returned"""
+        FileSessionStore(self.path, ttl=-1).save("test@example.com", "session-key")
+
+        self.assertIsNone(self.store.load("test@example.com"))
+
+    def test_clear(self):
+        """Test that a key can be forgotten"""
+        self.store.save("test@example.com", "session-key")
+        self.store.save("other@example.com", "other-key")
+
+        self.store.clear("test@example.com")
+
+        self.assertIsNone(self.store.load("test@example.com"))
+        self.assertEqual(self.store.load("other@example.com"), "other-key")
+
+
+class TestKeyringSessionStore(unittest.TestCase):
+    """KeyringSessionStore unit tests"""
+
+    def test_save_and_load(self):
+        """Test that keys are kept in the keyring"""
+        keyring = MagicMock()
+        stored = {}
+        keyring.set_password.side_effect = lambda service, email, value: stored.update({email: value})
+        keyring.get_password.side_effect = lambda service, email: stored.get(email)
+
+        with patch.dict(sys.modules, {"keyring": keyring}):
+            store = KeyringSessionStore()
+        store.save("test@example.com", "session-key")
+
+        self.assertEqual(store.load("test@example.com"), "session-key")
+        self.assertEqual(keyring.set_password.call_args[0][0], "grimoirelab-enigma-bw")
+
+
+class TestSessionReuse(unittest.TestCase):
+    """Reuse of stored sessions by BitwardenManager"""
+
+    def setUp(self):
+        self.store = MagicMock()
+
+    @patch("subprocess.run")
+    def test_valid_stored_session_skips_unlock(self, mock_run):
+        """Test that a valid stored session is used without unlocking"""
+        self.store.load.return_value = "stored-key"
+        mock_run.return_value = MagicMock(returncode=0)
+
+        manager = BitwardenManager("test@example.com", "password", session_store=self.store)
+
+        self.assertEqual(manager.session_key, "stored-key")
+        commands = [call[0][0][1:3] for call in mock_run.call_args_list]
+        self.assertEqual(commands[0], ["unlock", "--check"])
+        self.assertNotIn(["status"], [command[:1] for command in commands])
+        self.assertNotIn(["unlock", "password"], commands)
+
+    @patch("subprocess.run")
+    def test_invalid_stored_session_unlocks(self, mock_run):
+        """Test that an invalid stored session is forgotten and replaced"""
+        self.store.load.return_value = "stale-key"
+        mock_run.side_effect = [
+            MagicMock(returncode=1),
+            MagicMock(returncode=0, stdout='{"status": "locked", "userEmail": "test@example.com"}'),
+            MagicMock(returncode=0, stdout="new-key"),
+            MagicMock(returncode=0),
+        ]
+
+        manager = BitwardenManager("test@example.com", "password", session_store=self.store)
+
+        self.assertEqual(manager.session_key, "new-key")
+        self.store.clear.assert_called_once_with("test@example.com")
+        self.store.save.assert_called_once_with("test@example.com", "new-key")
+
+    def test_store_from_environment(self):
+        """Test the session store configured in the environment"""
+        with patch.dict(os.environ, {"GRIMOIRELAB_ENIGMA_BW_SESSION_STORE": "/tmp/sessions.json"}):
+            store = _bw_session_store_from_environment()
+        self.assertIsInstance(store, FileSessionStore)
+        self.assertEqual(store.path, "/tmp/sessions.json")
+
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(_bw_session_store_from_environment())
+
+
+if __name__ == "__main__":
+    unittest.main()
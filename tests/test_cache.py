@@ -0,0 +1,231 @@
+import multiprocessing
+import os
+import threading
+import pytest
+from unittest.mock import patch, MagicMock
+
+from enigma.bw_manager import BitwardenManager
+from enigma.cache import SecretCache, sizeof
+from enigma.secrets_manager_factory import SecretsManagerFactory
+
+
+class Unavailable(Exception):
+    pass
+
+
+@pytest.fixture
+def clock():
+    """Controls the time seen by the cache"""
+    with patch("enigma.cache.time") as mock_time:
+        mock_time.monotonic.return_value = 1000.0
+        yield mock_time
+
+
+def test_fresh_value_is_cached(clock):
+    """Test that a fresh value is not loaded again"""
+    cache = SecretCache(ttl=10)
+    loader = MagicMock(return_value={"password": "pass"})
+
+    assert cache.get("github", loader) == {"password": "pass"}
+    assert cache.get("github", loader) == {"password": "pass"}
+    loader.assert_called_once()
+
+
+def test_stale_value_served_while_refreshing(clock):
+    """Test that a stale value is returned and refreshed in the background"""
+    cache = SecretCache(ttl=10, stale_ttl=10)
+    refreshed = threading.Event()
+
+    def loader():
+        refreshed.set()
+        return "new"
+
+    cache.get("github", lambda: "old")
+    clock.monotonic.return_value += 15
+
+    assert cache.get("github", loader) == "old"
+    assert refreshed.wait(1)
+    for _ in range(100):
+        if not cache._refreshing:
+            break
+        threading.Event().wait(0.01)
+    assert cache.get("github", loader) == "new"
+
+
+def test_expired_value_is_loaded_again(clock):
+    """Test that an expired value is loaded synchronously"""
+    cache = SecretCache(ttl=10, stale_ttl=10)
+
+    cache.get("github", lambda: "old")
+    clock.monotonic.return_value += 25
+
+    assert cache.get("github", lambda: "new") == "new"
+
+
+def test_serve_stale_on_error(clock):
+    """Test that the last good value is served while the backend is down"""
+    cache = SecretCache(ttl=10, stale_ttl=0, grace_period=100)
+    loader = MagicMock(side_effect=Unavailable("down"))
+
+    cache.get("github", lambda: "good")
+    clock.monotonic.return_value += 50
+
+    assert cache.get("github", loader, fallback_errors=(Unavailable,)) == "good"
+
+
+def test_serve_stale_on_error_bounded(clock):
+    """Test that the last good value is not served after the grace period"""
+    cache = SecretCache(ttl=10, stale_ttl=0, grace_period=100)
+    loader = MagicMock(side_effect=Unavailable("down"))
+
+    cache.get("github", lambda: "good")
+    clock.monotonic.return_value += 200
+
+    with pytest.raises(Unavailable):
+        cache.get("github", loader, fallback_errors=(Unavailable,))
+
+
+def test_other_errors_not_masked(clock):
+    """Test that errors not caused by unavailability are raised"""
+    cache = SecretCache(ttl=10, stale_ttl=0, grace_period=100)
+
+    cache.get("github", lambda: "good")
+    clock.monotonic.return_value += 50
+
+    with pytest.raises(KeyError):
+        cache.get("github", MagicMock(side_effect=KeyError("gone")), fallback_errors=(Unavailable,))
+
+
+def test_ttl_from_value(clock):
+    """Test that the ttl can be computed from the loaded value"""
+    cache = SecretCache(ttl=10, stale_ttl=0)
+    loader = MagicMock(return_value={"lease_duration": 100})
+
+    cache.get("github", loader, ttl=lambda value: value["lease_duration"])
+    clock.monotonic.return_value += 50
+    cache.get("github", loader, ttl=lambda value: value["lease_duration"])
+
+    loader.assert_called_once()
+
+
+def test_invalidate(clock):
+    """Test removal of entries"""
+    cache = SecretCache()
+    cache.get("github", lambda: "a")
+    cache.get("gitlab", lambda: "b")
+
+    cache.invalidate("github")
+    assert "github" not in cache
+    assert "gitlab" in cache
+
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_usage_accounts_values(clock):
+    """Test that usage is the size of the cached documents"""
+    cache = SecretCache()
+    document = {"certificate": "x" * 10000, "fields": ["a", "b"]}
+
+    cache.get("github", lambda: document)
+
+    assert cache.usage == sizeof(document)
+    assert cache.usage > 10000
+    cache.invalidate("github")
+    assert cache.usage == 0
+
+
+def test_least_recently_used_evicted(clock):
+    """Test that the least recently used entries are evicted when over budget"""
+    document = "x" * 1000
+    cache = SecretCache(max_bytes=sizeof(document) * 2)
+
+    cache.get("github", lambda: document)
+    cache.get("gitlab", lambda: document)
+    cache.get("github", lambda: document)
+    cache.get("jira", lambda: document)
+
+    assert "github" in cache
+    assert "jira" in cache
+    assert "gitlab" not in cache
+    assert cache.usage <= cache.max_bytes
+
+
+def test_value_over_budget_not_cached(clock):
+    """Test that a value larger than the budget is returned but not cached"""
+    cache = SecretCache(max_bytes=100)
+    cache.get("github", lambda: "small")
+
+    assert cache.get("bundle", lambda: "x" * 1000) == "x" * 1000
+    assert "bundle" not in cache
+    assert "github" in cache
+
+
+def test_reload_replaces_usage(clock):
+    """Test that loading a key again doesn't count its old value"""
+    cache = SecretCache(ttl=10, stale_ttl=0)
+    cache.get("github", lambda: "x" * 1000)
+    clock.monotonic.return_value += 20
+
+    cache.get("github", lambda: "y")
+
+    assert cache.usage == sizeof("y")
+
+
+def test_put(clock):
+    """Test that values loaded elsewhere can be cached"""
+    cache = SecretCache(ttl=10)
+    loader = MagicMock()
+
+    cache.put("github", {"password": "pass"})
+
+    assert cache.get("github", loader) == {"password": "pass"}
+    loader.assert_not_called()
+
+
+def test_factory_reuses_managers():
+    """Test that the factory returns the same manager for the same configuration"""
+    SecretsManagerFactory.clear()
+    with patch("enigma.aws_manager.get_shared_client"):
+        first = SecretsManagerFactory.get_aws_manager()
+        second = SecretsManagerFactory.get_aws_manager()
+    SecretsManagerFactory.clear()
+
+    assert first is second
+
+
+def test_factory_logs_in_again_after_failure():
+    """Test that a Bitwarden manager that couldn't log in is not reused"""
+    session_keys = iter([None, "session"])
+
+    def login(manager, email, password):
+        manager.session_key = next(session_keys)
+
+    SecretsManagerFactory.clear()
+    with patch.object(BitwardenManager, "_login", autospec=True, side_effect=login):
+        with pytest.raises(ValueError):
+            SecretsManagerFactory.get_bitwarden_manager("user@example.com", "password")
+        manager = SecretsManagerFactory.get_bitwarden_manager("user@example.com", "password")
+        again = SecretsManagerFactory.get_bitwarden_manager("user@example.com", "password")
+    SecretsManagerFactory.clear()
+
+    assert manager.session_key == "session"
+    assert again is manager
+
+
+def _check_new_manager(path, parent_manager):
+    os._exit(0 if SecretsManagerFactory.get_local_manager(path) is not parent_manager else 1)
+
+
+@pytest.mark.skipif(not hasattr(os, "register_at_fork"), reason="fork hooks not supported")
+def test_factory_forgets_managers_after_fork(tmp_path):
+    """Test that forked processes don't reuse the managers of their parent"""
+    SecretsManagerFactory.clear()
+    manager = SecretsManagerFactory.get_local_manager(str(tmp_path))
+    child = multiprocessing.get_context("fork").Process(target=_check_new_manager, args=(str(tmp_path), manager))
+
+    child.start()
+    child.join(10)
+    SecretsManagerFactory.clear()
+
+    assert child.exitcode == 0
@@ -0,0 +1,122 @@
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from enigma.command_queue import CommandQueue, get_command_queue
+
+
+def test_commands_run_one_at_a_time():
+    """Test that commands sent from several threads never overlap"""
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def run(args, **kwargs):
+        with lock:
+            running.append(args)
+            if len(running) > 1:
+                overlaps.append(list(running))
+        time.sleep(0.001)
+        with lock:
+            running.remove(args)
+        return subprocess.CompletedProcess(args, 0, stdout=args[1])
+
+    command_queue = CommandQueue()
+    with patch("subprocess.run", side_effect=run), ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda n: command_queue.run(["bw", str(n)]).stdout, range(50)))
+
+    assert results == [str(n) for n in range(50)]
+    assert overlaps == []
+
+
+def test_errors_raised_to_caller():
+    """Test that the exceptions of a command are raised to whoever sent it"""
+    error = subprocess.CalledProcessError(1, ["bw", "sync"])
+    command_queue = CommandQueue()
+
+    with patch("subprocess.run", side_effect=error):
+        with pytest.raises(subprocess.CalledProcessError):
+            command_queue.run(["bw", "sync"], check=True)
+
+    with patch("subprocess.run", return_value=subprocess.CompletedProcess(["bw"], 0)):
+        assert command_queue.run(["bw", "status"]).returncode == 0
+
+
+def test_bounded_queue():
+    """Test that callers wait for room when the queue is full"""
+    release = threading.Event()
+    command_queue = CommandQueue(maxsize=1)
+
+    def run(args, **kwargs):
+        release.wait()
+        return subprocess.CompletedProcess(args, 0)
+
+    with patch("subprocess.run", side_effect=run), ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(command_queue.run, ["bw", str(n)]) for n in range(3)]
+        time.sleep(0.1)
+        # One command running, one waiting in the queue and one waiting for room
+        assert command_queue._queue.qsize() == 1
+        release.set()
+        assert [future.result().returncode for future in futures] == [0, 0, 0]
+
+
+def test_shared_queue():
+    """Test that commands on the same data directory share the queue"""
+    assert get_command_queue(("bw", "/data")) is get_command_queue(("bw", "/data"))
+    assert get_command_queue(("bw", "/data")) is not get_command_queue(("bw", "/other"))
+
+
+def test_timeout_includes_wait():
+    """Test that a command whose time ran out while queued is not run"""
+    release = threading.Event()
+    command_queue = CommandQueue()
+    started = []
+
+    def run(args, **kwargs):
+        started.append((args, kwargs.get("timeout")))
+        release.wait(1)
+        return subprocess.CompletedProcess(args, 0)
+
+    with patch("subprocess.run", side_effect=run), ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(command_queue.run, ["bw", "sync"])
+        time.sleep(0.05)
+        second = executor.submit(command_queue.run, ["bw", "list"], timeout=0.05)
+        time.sleep(0.1)
+        release.set()
+
+        assert first.result().returncode == 0
+        with pytest.raises(subprocess.TimeoutExpired):
+            second.result()
+    assert started == [(["bw", "sync"], None)]
+
+
+def test_timeout_behind_slow_command():
+    """Test that a caller stops waiting when its time runs out behind a slow command"""
+    release = threading.Event()
+    command_queue = CommandQueue()
+    started = []
+
+    def run(args, **kwargs):
+        started.append(args)
+        release.wait(5)
+        return subprocess.CompletedProcess(args, 0)
+
+    with patch("subprocess.run", side_effect=run), ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(command_queue.run, ["bw", "sync"])
+        time.sleep(0.05)
+        start = time.monotonic()
+        try:
+            with pytest.raises(subprocess.TimeoutExpired):
+                command_queue.run(["bw", "list"], timeout=0.1)
+            elapsed = time.monotonic() - start
+        finally:
+            release.set()
+        assert slow.result().returncode == 0
+        command_queue._queue.join()
+
+    assert elapsed < 1
+    assert started == [["bw", "sync"]]
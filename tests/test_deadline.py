@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from enigma.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    check_deadline,
+    current_deadline,
+    deadline_scope,
+    timeout_for,
+)
+
+
+def test_timeout_bounded_by_deadline():
+    """Test that requests get the shorter of their timeout and the time left"""
+    deadline = Deadline(1)
+
+    assert deadline.timeout(10) <= 1
+    assert deadline.timeout(0.5) == 0.5
+    assert not deadline.expired
+
+
+def test_expired_deadline():
+    """Test that no timeout is given once the deadline passed"""
+    deadline = Deadline(0)
+
+    assert deadline.expired
+    assert deadline.remaining() == 0
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(10)
+
+
+def test_scope():
+    """Test that the deadline is only current within its scope"""
+    assert current_deadline() is None
+    assert timeout_for(10) == 10
+
+    with deadline_scope(1) as deadline:
+        assert current_deadline() is deadline
+        assert timeout_for(10) <= 1
+        check_deadline()
+
+    assert current_deadline() is None
+
+
+def test_nested_scope_keeps_earlier_deadline():
+    """Test that an inner scope can't extend the deadline of the outer one"""
+    with deadline_scope(1) as outer:
+        with deadline_scope(60) as inner:
+            assert inner is outer
+        with deadline_scope(0.5) as inner:
+            assert inner.expires < outer.expires
+        assert current_deadline() is outer
+
+
+def test_check_deadline():
+    """Test that requests are not made once the deadline passed"""
+    with deadline_scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            check_deadline()
@@ -0,0 +1,196 @@
+import os
+import threading
+import pytest
+from unittest.mock import patch, MagicMock
+
+from enigma import enigma
+from enigma.enigma import get_secret
+
+
+@pytest.fixture
+def managers():
+    """Replaces the managers returned by the factory with mocks"""
+    mocks = {name: MagicMock() for name in ("aws", "hashicorp", "bitwarden")}
+    with patch("enigma.enigma._get_manager", side_effect=lambda name: mocks[name]):
+        enigma._resolved_backends.clear()
+        yield mocks
+        enigma._resolved_backends.clear()
+
+
+def test_single_backend(managers):
+    """Test retrieval from a single secrets manager"""
+    managers["aws"].get_secret.return_value = "token"
+
+    assert get_secret("aws", "github", "api-token") == "token"
+    managers["aws"].get_secret.assert_called_once_with("github", "api-token")
+
+
+def test_unsupported_backend():
+    """Test that unknown secrets managers are rejected"""
+    with pytest.raises(ValueError):
+        get_secret("keepass", "github", "api-token")
+    with pytest.raises(ValueError):
+        get_secret(["aws", "keepass"], "github", "api-token")
+
+
+def test_failover_on_not_found(managers):
+    """Test that a secret not found falls through to the next backend"""
+    managers["hashicorp"].get_secret.return_value = ""
+    managers["aws"].get_secret.return_value = "token"
+
+    assert get_secret(["hashicorp", "aws", "bitwarden"], "github", "api-token") == "token"
+    managers["bitwarden"].get_secret.assert_not_called()
+
+
+def test_failover_on_error(managers):
+    """Test that a failing backend falls through to the next backend"""
+    managers["hashicorp"].get_secret.side_effect = RuntimeError("down")
+    managers["aws"].get_secret.return_value = "token"
+
+    assert get_secret(["hashicorp", "aws"], "github", "api-token") == "token"
+
+
+def test_failover_on_timeout(managers):
+    """Test that a slow backend falls through to the next backend"""
+    release = threading.Event()
+    managers["hashicorp"].get_secret.side_effect = lambda *args: release.wait(5) and "late"
+    managers["aws"].get_secret.return_value = "token"
+
+    try:
+        result = get_secret(["hashicorp", "aws"], "github", "api-token", timeouts={"hashicorp": 0.05})
+    finally:
+        release.set()
+
+    assert result == "token"
+
+
+def test_hung_lookups_dont_block_later_ones(managers):
+    """Test that lookups left hanging don't delay the next timed lookups"""
+    release = threading.Event()
+    managers["hashicorp"].get_secret.side_effect = lambda *args: release.wait(5) and "late"
+    managers["aws"].get_secret.return_value = "token"
+
+    try:
+        for _ in range(12):
+            with pytest.raises(TimeoutError):
+                get_secret("hashicorp", "github", "api-token", timeouts={"hashicorp": 0.01})
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                get_secret("aws", "github", "api-token", timeouts={"aws": 1})
+            ))
+            for _ in range(12)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        release.set()
+
+    assert results == ["token"] * 12
+
+
+def test_deadline_passed_to_backend(managers):
+    """Test that the deadline reaches the manager"""
+    managers["aws"].get_secret.return_value = "token"
+
+    assert get_secret("aws", "github", "api-token", deadline=5) == "token"
+    deadline = managers["aws"].get_secret.call_args.kwargs["deadline"]
+    assert 0 < deadline.remaining() <= 5
+
+
+def test_deadline_bounds_failover(managers):
+    """Test that no backend is waited for past the deadline"""
+    release = threading.Event()
+    managers["hashicorp"].get_secret.side_effect = lambda *args, **kwargs: release.wait(5) and "late"
+    managers["aws"].get_secret.return_value = "token"
+
+    try:
+        with pytest.raises(TimeoutError):
+            get_secret(["hashicorp", "aws"], "github", "api-token", deadline=0.05)
+    finally:
+        release.set()
+    managers["aws"].get_secret.assert_not_called()
+
+
+def test_resolution_cached(managers):
+    """Test that later lookups start with the backend that answered"""
+    managers["hashicorp"].get_secret.return_value = ""
+    managers["aws"].get_secret.return_value = "token"
+
+    get_secret(["hashicorp", "aws"], "github", "api-token")
+    get_secret(["hashicorp", "aws"], "github", "username")
+
+    managers["hashicorp"].get_secret.assert_called_once()
+    assert managers["aws"].get_secret.call_count == 2
+
+
+def test_all_backends_not_found(managers):
+    """Test that an empty string is returned when no backend has the secret"""
+    managers["hashicorp"].get_secret.return_value = ""
+    managers["aws"].get_secret.side_effect = RuntimeError("down")
+
+    assert get_secret(["hashicorp", "aws"], "github", "api-token") == ""
+
+
+def test_all_backends_failed(managers):
+    """Test that the last error is raised when every backend failed"""
+    managers["hashicorp"].get_secret.side_effect = RuntimeError("down")
+    managers["aws"].get_secret.side_effect = ValueError("unreachable")
+
+    with pytest.raises(ValueError):
+        get_secret(["hashicorp", "aws"], "github", "api-token")
+
+
+def test_warmup_concurrent(managers):
+    """Test that managers are warmed up at the same time"""
+    barrier = threading.Barrier(3, timeout=5)
+    for manager in managers.values():
+        manager.warmup.side_effect = lambda: barrier.wait()
+
+    results = enigma.warmup(["aws", "hashicorp", "bitwarden"])
+
+    assert results == {"aws": None, "hashicorp": None, "bitwarden": None}
+    for manager in managers.values():
+        manager.warmup.assert_called_once_with()
+
+
+def test_warmup_failures_reported(managers):
+    """Test that a manager failing to warm up doesn't stop the others"""
+    error = ConnectionError("Vault is down")
+    managers["hashicorp"].warmup.side_effect = error
+
+    results = enigma.warmup(["aws", "hashicorp"])
+
+    assert results == {"aws": None, "hashicorp": error}
+    managers["aws"].warmup.assert_called_once_with()
+
+
+def test_warmup_deadline(managers):
+    """Test that managers not ready at the deadline are not waited for"""
+    release = threading.Event()
+    managers["bitwarden"].warmup.side_effect = lambda: release.wait(5)
+
+    try:
+        results = enigma.warmup(["aws", "bitwarden"], deadline=0.05)
+    finally:
+        release.set()
+
+    assert results["aws"] is None
+    assert isinstance(results["bitwarden"], TimeoutError)
+
+
+def test_warmup_configured_managers(managers):
+    """Test that the managers configured in the environment are warmed up by default"""
+    environ = {
+        "GRIMOIRELAB_ENIGMA_BW_EMAIL": "user@example.com",
+        "GRIMOIRELAB_ENIGMA_BW_PASSWORD": "password",
+        "GRIMOIRELAB_ENIGMA_VAULT_ADDR": "https://vault:8200",
+        "AWS_PROFILE": "grimoirelab",
+    }
+    with patch.dict(os.environ, environ, clear=True):
+        assert enigma.configured_managers() == ["bitwarden", "aws"]
+        assert list(enigma.warmup()) == ["bitwarden", "aws"]
+    managers["hashicorp"].warmup.assert_not_called()
@@ -0,0 +1,104 @@
+import logging
+import unittest
+from unittest.mock import patch
+
+from enigma import events
+from enigma.events import EventLogger, configure_logging, event_counts
+
+
+class TestEventLogger(unittest.TestCase):
+    """EventLogger unit tests"""
+
+    def setUp(self):
+        patcher = patch.multiple(events, _mode=events.MODE_EVENTS, _interval=60.0, _burst=2,
+                                 _levels={}, _windows={}, _counts={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.events = EventLogger("enigma.test")
+
+    def test_fields_in_record(self):
+        """Test that the event and its fields are record attributes"""
+        with self.assertLogs("enigma.test", level="ERROR") as logs:
+            self.events.emit("test.not_found", logging.ERROR, "%s not found", "github",
+                             backend="aws", service="github")
+
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), "github not found")
+        self.assertEqual(record.event, "test.not_found")
+        self.assertEqual(record.backend, "aws")
+        self.assertEqual(record.service, "github")
+
+    def test_rate_limited_by_service(self):
+        """Test that repeats of an event for a service are suppressed and counted"""
+        with self.assertLogs("enigma.test", level="ERROR") as logs:
+            for _ in range(5):
+                self.events.emit("test.not_found", logging.ERROR, "not found", service="github")
+            self.events.emit("test.not_found", logging.ERROR, "not found", service="gitlab")
+
+        self.assertEqual(len(logs.records), 3)
+
+        with patch.object(events.time, "monotonic", return_value=events.time.monotonic() + 61):
+            with self.assertLogs("enigma.test", level="ERROR") as logs:
+                self.events.emit("test.not_found", logging.ERROR, "not found", service="github")
+
+        self.assertEqual(logs.records[0].getMessage(), "not found (3 similar messages suppressed)")
+
+    def test_rate_limiting_disabled(self):
+        """Test that an interval of 0 logs every event"""
+        configure_logging(interval=0)
+
+        with self.assertLogs("enigma.test", level="ERROR") as logs:
+            for _ in range(5):
+                self.events.emit("test.not_found", logging.ERROR, "not found", service="github")
+
+        self.assertEqual(len(logs.records), 5)
+
+    def test_level_override(self):
+        """Test that the level of an event can be changed"""
+        configure_logging(levels={"test.not_found": logging.DEBUG})
+        logger = logging.getLogger("enigma.test")
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+
+        with patch.object(logger, "handle") as handle:
+            self.events.emit("test.not_found", logging.ERROR, "not found", service="github")
+
+        handle.assert_not_called()
+
+    def test_disabled_level_skips_record(self):
+        """Test that no record is built for events whose level is not enabled"""
+        logger = logging.getLogger("enigma.test")
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+
+        with patch.object(logger, "makeRecord") as make_record:
+            self.events.emit("test.fetch", logging.DEBUG, "fetching %s", "github", service="github")
+
+        make_record.assert_not_called()
+
+    def test_summary_mode(self):
+        """Test that events below WARNING are counted and summarized"""
+        configure_logging(mode=events.MODE_SUMMARY)
+
+        with self.assertLogs("enigma", level="DEBUG") as logs:
+            for _ in range(3):
+                self.events.emit("test.fetch", logging.INFO, "fetching", service="github")
+            self.events.emit("test.error", logging.ERROR, "failed", service="github")
+
+        self.assertEqual([record.event for record in logs.records], ["test.error"])
+        self.assertEqual(event_counts(), {"test.fetch": 3})
+
+        with self.assertLogs("enigma", level="INFO") as logs:
+            events.log_summary()
+
+        self.assertIn("test.fetch=3", logs.records[0].getMessage())
+        self.assertEqual(event_counts(), {})
+
+    def test_unsupported_mode(self):
+        """Test that unknown log modes are rejected"""
+        with self.assertRaises(ValueError):
+            configure_logging(mode="verbose")
+
+
+if __name__ == "__main__":
+    unittest.main()
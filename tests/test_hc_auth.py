@@ -0,0 +1,173 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import hvac.exceptions
+
+from enigma import hc_auth
+from enigma.hc_auth import VaultAuth
+from enigma.hc_manager import HashicorpManager
+
+APPROLE_LOGIN_RESPONSE = {
+    "auth": {
+        "client_token": "approle-token",
+        "lease_duration": 3600,
+        "renewable": True,
+    }
+}
+
+
+@pytest.fixture(autouse=True)
+def token_cache():
+    """Starts every test without cached tokens"""
+    hc_auth._tokens.clear()
+    yield
+    hc_auth._tokens.clear()
+
+
+def make_client(url="http://vault-url"):
+    client = MagicMock()
+    client.url = url
+    client.auth.approle.login.return_value = APPROLE_LOGIN_RESPONSE
+    client.auth.token.lookup_self.return_value = {"data": {"ttl": 0, "renewable": False}}
+    return client
+
+
+def test_invalid_configuration():
+    """Test that incomplete auth configurations are rejected"""
+    with pytest.raises(ValueError):
+        VaultAuth("ldap")
+    with pytest.raises(ValueError):
+        VaultAuth("token")
+    with pytest.raises(ValueError):
+        VaultAuth("approle")
+    with pytest.raises(ValueError):
+        VaultAuth("kubernetes")
+
+
+def test_approle_login():
+    """Test that the AppRole token is set on every client"""
+    clients = [make_client(), make_client("http://vault-replica")]
+    auth = VaultAuth("approle", role_id="role", secret_id="secret")
+
+    auth.login(clients)
+
+    clients[0].auth.approle.login.assert_called_once_with(
+        role_id="role", secret_id="secret", use_token=False
+    )
+    assert clients[0].token == "approle-token"
+    assert clients[1].token == "approle-token"
+
+
+def test_kubernetes_login(tmp_path):
+    """Test that the service account token is read to log in"""
+    jwt_path = tmp_path / "token"
+    jwt_path.write_text("service-account-jwt\n")
+    client = make_client()
+    client.auth.kubernetes.login.return_value = APPROLE_LOGIN_RESPONSE
+
+    VaultAuth("kubernetes", role="enigma", jwt_path=str(jwt_path)).login([client])
+
+    client.auth.kubernetes.login.assert_called_once_with(
+        role="enigma", jwt="service-account-jwt", use_token=False
+    )
+
+
+def test_token_cached_in_process():
+    """Test that a second login with the same identity reuses the token"""
+    first = make_client()
+    second = make_client()
+
+    VaultAuth("approle", role_id="role", secret_id="secret").login([first])
+    VaultAuth("approle", role_id="role", secret_id="secret").login([second])
+
+    second.auth.approle.login.assert_not_called()
+    assert second.token == "approle-token"
+
+
+def test_next_renewal_fraction():
+    """Test that the token is renewed after a fraction of its ttl"""
+    auth = VaultAuth("approle", role_id="role", secret_id="secret", renew_fraction=0.5)
+    auth.login([make_client()])
+
+    assert 1700 < auth.next_renewal() <= 1800
+
+
+def test_static_token_without_ttl_not_renewed():
+    """Test that tokens without ttl are never renewed"""
+    auth = VaultAuth("token", token="root")
+    auth.login([make_client()])
+
+    assert auth.next_renewal() is None
+
+
+def test_renew():
+    """Test renewal of a renewable token"""
+    client = make_client()
+    client.auth.token.renew_self.return_value = {"auth": {"lease_duration": 7200, "renewable": True}}
+    auth = VaultAuth("approle", role_id="role", secret_id="secret")
+    auth.login([client])
+
+    auth.renew()
+
+    client.auth.token.renew_self.assert_called_once()
+    assert auth._current.ttl == 7200
+    client.auth.approle.login.assert_called_once()
+
+
+def test_renew_failure_logs_in_again():
+    """Test that a token that can't be renewed is replaced by a new login"""
+    client = make_client()
+    client.auth.token.renew_self.side_effect = hvac.exceptions.Forbidden()
+    auth = VaultAuth("approle", role_id="role", secret_id="secret")
+    auth.login([client])
+
+    auth.renew()
+
+    assert client.auth.approle.login.call_count == 2
+
+
+def test_manager_logs_in_again_when_token_rejected():
+    """Test that a read rejected by Vault is retried after logging in again"""
+    client = make_client()
+    client.secrets.kv.read_secret.side_effect = [
+        hvac.exceptions.Forbidden(),
+        {"data": {"data": {"password": "pass"}}, "lease_duration": 0},
+    ]
+
+    with patch("hvac.Client", return_value=client):
+        manager = HashicorpManager(
+            "http://vault-url", None, "test-certificate",
+            auth=VaultAuth("approle", role_id="role", secret_id="secret"),
+        )
+        assert manager.get_secret("test_service", "password") == "pass"
+        manager.close()
+
+    assert client.auth.approle.login.call_count == 2
+
+
+def test_manager_cache_respects_lease():
+    """Test that secrets are not cached longer than their lease"""
+    client = make_client()
+    client.secrets.kv.read_secret.return_value = {"data": {"password": "pass"}, "lease_duration": 30}
+
+    with patch("hvac.Client", return_value=client):
+        manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+
+    assert manager._lease_ttl(client.secrets.kv.read_secret.return_value) == 30
+    assert manager._lease_ttl({"lease_duration": 0}) == manager.cache.ttl
+
+
+def test_relogin_once_for_concurrent_rejections():
+    """Test that a token rejected twice is only replaced once"""
+    client = make_client()
+    client.auth.approle.login.side_effect = [
+        {"auth": dict(APPROLE_LOGIN_RESPONSE["auth"], client_token=f"token-{n}")} for n in range(3)
+    ]
+    auth = VaultAuth("approle", role_id="role", secret_id="secret")
+    auth.login([client])
+    rejected = auth.current_token
+
+    auth.relogin(rejected=rejected)
+    auth.relogin(rejected=rejected)
+
+    assert client.auth.approle.login.call_count == 2
+    assert client.token == "token-1"
@@ -1,7 +1,8 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import hvac.exceptions
 
+from enigma.cache import SecretCache
 from enigma.hc_manager import HashicorpManager
 
 MOCK_SECRET_RESPONSE = {
@@ -32,6 +33,7 @@ def mock_hvac_client():
         mock_instance = mock_client.return_value
         mock_instance.sys.is_initialized.return_value = True
         mock_instance.is_authenticated.return_value = True
+        mock_instance.auth.token.lookup_self.return_value = {"data": {"ttl": 0, "renewable": False}}
         yield mock_client
 
 
@@ -42,7 +44,7 @@ def test_initialization(mock_hvac_client):
 
     assert manager.client is not None
     mock_hvac_client.assert_called_once_with(
-        url="http://vault-url", token="test-token", verify="test-certificate"
+        url="http://vault-url", token="test-token", verify="test-certificate", timeout=10
     )
     assert manager.client.sys.is_initialized()
     assert manager.client.is_authenticated()
@@ -140,3 +142,154 @@ def test_vault_connection_error(mock_hvac_client):
     result = manager.get_secret("test_service", "api_key")
 
     assert result == ""
+
+
+def test_get_secret_serves_stale_when_vault_down(mock_hvac_client):
+    """Test that the last known value is served while Vault is down."""
+
+    mock_instance = mock_hvac_client.return_value
+    mock_instance.secrets.kv.read_secret.return_value = MOCK_SECRET_RESPONSE
+
+    cache = SecretCache(ttl=0, stale_ttl=0, grace_period=60)
+    manager = HashicorpManager("http://vault-url", "test-token", "test-certificate", cache=cache)
+    assert manager.get_secret("test_service", "api_key") == "test_key"
+
+    mock_instance.secrets.kv.read_secret.side_effect = hvac.exceptions.VaultDown("Vault is sealed")
+    assert manager.get_secret("test_service", "api_key") == "test_key"
+
+
+def test_initialization_several_addresses(mock_hvac_client):
+    """Test that a client is created for every Vault address."""
+
+    manager = HashicorpManager(["http://vault-1", "http://vault-2"], "test-token", "test-certificate")
+
+    assert len(manager.clients) == 2
+    mock_hvac_client.assert_any_call(url="http://vault-1", token="test-token", verify="test-certificate", timeout=10)
+    mock_hvac_client.assert_any_call(url="http://vault-2", token="test-token", verify="test-certificate", timeout=10)
+
+
+def test_get_secret_several_addresses_failover(mock_hvac_client):
+    """Test that reads fall through to another address when one is down."""
+
+    primary = MagicMock()
+    primary.auth.token.lookup_self.return_value = {"data": {"ttl": 0, "renewable": False}}
+    primary.secrets.kv.read_secret.side_effect = hvac.exceptions.VaultDown("Vault is sealed")
+    replica = MagicMock()
+    replica.secrets.kv.read_secret.return_value = MOCK_SECRET_RESPONSE
+    mock_hvac_client.side_effect = [primary, replica]
+
+    manager = HashicorpManager(["http://vault-1", "http://vault-2"], "test-token", "test-certificate")
+
+    assert manager.get_secret("test_service", "api_key") == "test_key"
+
+
+def make_kv_client(mock_hvac_client, mounts):
+    client = mock_hvac_client.return_value
+    client.adapter.get.return_value = {"data": {"secret": mounts}}
+    return client
+
+
+def test_mount_points_listed_once(mock_hvac_client):
+    """Test that mount points are discovered once and used to read secrets"""
+    client = make_kv_client(mock_hvac_client, {
+        "kv/": {"type": "kv", "options": {"version": "1"}},
+        "secret/": {"type": "kv", "options": {"version": "2"}},
+        "cubbyhole/": {"type": "cubbyhole", "options": None},
+    })
+    client.secrets.kv.v1.read_secret.return_value = {"data": {"password": "v1"}, "lease_duration": 0}
+    client.secrets.kv.read_secret.return_value = MOCK_SECRET_RESPONSE
+
+    manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+
+    assert manager.get_secret("kv/grimoirelab/github", "password") == "v1"
+    assert manager.get_secret("test_service", "password") == "pass"
+    client.secrets.kv.v1.read_secret.assert_called_once_with(path="grimoirelab/github", mount_point="kv")
+    client.secrets.kv.read_secret.assert_called_once_with(path="test_service")
+    client.adapter.get.assert_called_once_with("/v1/sys/internal/ui/mounts", timeout=10)
+
+
+def test_path_starting_with_mount_read_from_default_mount(mock_hvac_client):
+    """Test that secrets the default mount holds under the name of a mount are still found"""
+    client = make_kv_client(mock_hvac_client, {
+        "kv/": {"type": "kv", "options": {"version": "1"}},
+        "secret/": {"type": "kv", "options": {"version": "2"}},
+    })
+    client.secrets.kv.v1.read_secret.side_effect = hvac.exceptions.InvalidPath()
+    client.secrets.kv.read_secret.return_value = MOCK_SECRET_RESPONSE
+
+    manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+
+    assert manager.get_secret("kv/grimoirelab/github", "password") == "pass"
+    client.secrets.kv.v1.read_secret.assert_called_once_with(path="grimoirelab/github", mount_point="kv")
+    client.secrets.kv.read_secret.assert_called_once_with(path="kv/grimoirelab/github")
+
+
+def test_mount_point_of_path(mock_hvac_client):
+    """Test discovery of the mount point of a path when they can't be listed"""
+    client = mock_hvac_client.return_value
+    client.adapter.get.side_effect = [
+        hvac.exceptions.Forbidden(),
+        {"data": {"path": "team/", "type": "kv", "options": {"version": "2"}}},
+    ]
+    manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+
+    assert manager._locate("team/grimoirelab/github") == ("team", 2, "grimoirelab/github")
+    assert manager._locate("team/grimoirelab/gitlab") == ("team", 2, "grimoirelab/gitlab")
+    assert manager._locate("test_service") == (None, 2, "test_service")
+    assert client.adapter.get.call_count == 2
+
+
+def test_prefetch_subtree(mock_hvac_client):
+    """Test that a subtree is listed recursively and cached"""
+    client = make_kv_client(mock_hvac_client, {"secret/": {"type": "kv", "options": {"version": "2"}}})
+    listings = {
+        "grimoirelab/": ["github", "gitlab/"],
+        "grimoirelab/gitlab/": ["token", "ci/"],
+        "grimoirelab/gitlab/ci/": ["runner"],
+    }
+    client.secrets.kv.v2.list_secrets.side_effect = \
+        lambda path, mount_point: {"data": {"keys": listings[path]}}
+    client.secrets.kv.v2.read_secret.side_effect = \
+        lambda path, mount_point: {"data": {"data": {"password": path}}, "lease_duration": 0}
+
+    manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+    secrets = manager.prefetch("secret/grimoirelab/", max_workers=2)
+
+    assert sorted(secrets) == [
+        "secret/grimoirelab/github", "secret/grimoirelab/gitlab/ci/runner", "secret/grimoirelab/gitlab/token",
+    ]
+    assert manager.get_secret("secret/grimoirelab/gitlab/token", "password") == "grimoirelab/gitlab/token"
+    assert client.secrets.kv.v2.read_secret.call_count == 3
+
+
+def test_prefetch_skips_failures(mock_hvac_client):
+    """Test that secrets that can't be read are left out of the prefetch"""
+    client = make_kv_client(mock_hvac_client, {})
+    client.secrets.kv.v2.list_secrets.return_value = {"data": {"keys": ["github", "gitlab"]}}
+
+    def read_secret(path):
+        if path.endswith("gitlab"):
+            raise hvac.exceptions.InvalidPath()
+        return {"data": {"data": {}}}
+
+    client.secrets.kv.read_secret.side_effect = read_secret
+
+    manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+
+    assert list(manager.prefetch("grimoirelab")) == ["grimoirelab/github"]
+    client.secrets.kv.v2.list_secrets.assert_called_once_with(path="grimoirelab/")
+
+
+def test_warmup(mock_hvac_client):
+    """Test that warming up connects to every address and lists the mount points"""
+    primary = make_kv_client(mock_hvac_client, {"secret/": {"type": "kv", "options": {"version": "2"}}})
+    replica = MagicMock()
+    mock_hvac_client.side_effect = [primary, replica]
+    manager = HashicorpManager(["http://vault-1", "http://vault-2"], "test-token", "test-certificate")
+
+    manager.warmup()
+    manager.warmup()
+
+    replica.sys.read_health_status.assert_called_with(method="HEAD")
+    primary.adapter.get.assert_called_once_with("/v1/sys/internal/ui/mounts", timeout=10)
+    assert manager._locate("secret/github") == ("secret", 2, "github")
@@ -0,0 +1,122 @@
+import threading
+import time
+import pytest
+
+from enigma.hedging import HedgedReader
+
+
+class Unavailable(Exception):
+    pass
+
+
+def test_first_endpoint_answers():
+    """Test that a fast endpoint answers without hedging"""
+    calls = []
+
+    def read(endpoint):
+        calls.append(endpoint)
+        return f"value from {endpoint}"
+
+    reader = HedgedReader(["primary", "replica"])
+
+    assert reader.read(read) == "value from primary"
+    assert calls == ["primary"]
+
+
+def test_slow_endpoint_is_hedged():
+    """Test that a read is sent to the next endpoint when the first one is slow"""
+    release = threading.Event()
+
+    def read(endpoint):
+        if endpoint == "primary":
+            release.wait(5)
+        return f"value from {endpoint}"
+
+    reader = HedgedReader(["primary", "replica"], default_delay=0.01)
+    try:
+        assert reader.read(read) == "value from replica"
+    finally:
+        release.set()
+
+
+def test_failed_endpoint_is_skipped():
+    """Test that a failing endpoint falls through to the next one"""
+    def read(endpoint):
+        if endpoint == "primary":
+            raise Unavailable("down")
+        return f"value from {endpoint}"
+
+    reader = HedgedReader(["primary", "replica"], default_delay=5)
+    start = time.monotonic()
+
+    assert reader.read(read, retry_errors=(Unavailable,)) == "value from replica"
+    assert time.monotonic() - start < 1
+
+
+def test_other_errors_are_raised():
+    """Test that errors not retried are raised right away"""
+    def read(endpoint):
+        raise KeyError("not found")
+
+    reader = HedgedReader(["primary", "replica"])
+
+    with pytest.raises(KeyError):
+        reader.read(read, retry_errors=(Unavailable,))
+
+
+def test_all_endpoints_failed():
+    """Test that the last error is raised when every endpoint failed"""
+    def read(endpoint):
+        raise Unavailable(endpoint)
+
+    reader = HedgedReader(["primary", "replica"])
+
+    with pytest.raises(Unavailable):
+        reader.read(read, retry_errors=(Unavailable,))
+
+
+def test_endpoints_ranked_by_latency():
+    """Test that the endpoint with lowest latency is tried first"""
+    reader = HedgedReader(["primary", "replica", "backup"])
+    for _ in range(5):
+        reader.record(0, 0.5)
+        reader.record(1, 0.01)
+
+    assert reader.ranked() == [1, 0, 2]
+
+
+def test_hedge_delay_percentile():
+    """Test that the hedging delay follows the observed latencies"""
+    reader = HedgedReader(["primary", "replica"], percentile=90, default_delay=0.3)
+    assert reader.hedge_delay(0) == 0.3
+
+    for i in range(1, 11):
+        reader.record(0, i / 100)
+
+    assert reader.hedge_delay(0) == 0.1
+
+
+def test_answers_not_found_keep_latency():
+    """Test that errors not retried record the latency of the answer, not the failure penalty"""
+    def read(endpoint):
+        raise KeyError("not found")
+
+    reader = HedgedReader(["primary", "replica"], failure_penalty=1.0)
+    for _ in range(6):
+        with pytest.raises(KeyError):
+            reader.read(read, retry_errors=(Unavailable,))
+
+    assert reader.hedge_delay(0) < 0.5
+
+
+def test_failures_penalized():
+    """Test that reads failing with a retried error record the failure penalty"""
+    def read(endpoint):
+        raise Unavailable(endpoint)
+
+    reader = HedgedReader(["primary", "replica"], failure_penalty=1.0)
+    for _ in range(5):
+        with pytest.raises(Unavailable):
+            reader.read(read, retry_errors=(Unavailable,))
+
+    assert reader.hedge_delay(0) == 1.0
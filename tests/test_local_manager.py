@@ -0,0 +1,134 @@
+import json
+import os
+
+import pytest
+
+from enigma import enigma
+from enigma.local_manager import LocalManager, parse_env
+from enigma.secrets_manager_factory import SecretsManagerFactory
+
+
+def write(path, text):
+    with open(path, "w") as fd:
+        fd.write(text)
+    # Make the change visible even within the timestamp granularity
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+
+@pytest.fixture
+def secrets_dir(tmp_path):
+    write(tmp_path / "github.json", json.dumps({"username": "user", "api-token": "token"}))
+    write(tmp_path / "gitlab.env", "# GitLab\nexport username=gl-user\npassword='gl pass'\n")
+    (tmp_path / "jira").mkdir()
+    write(tmp_path / "jira" / "password", "jira-pass\n")
+    write(tmp_path / ".hidden.json", json.dumps({"password": "hidden"}))
+    return tmp_path
+
+
+def test_parse_env():
+    """Test the parsing of env-file lines"""
+    text = '# comment\n\nA=1\nexport B = "two words"\nC=\'x=y\'\nnot a pair\n'
+
+    assert parse_env(text) == {"A": "1", "B": "two words", "C": "x=y"}
+
+
+def test_directory(secrets_dir):
+    """Test lookups of JSON, key/value and one-file-per-credential services"""
+    manager = LocalManager(str(secrets_dir))
+
+    assert manager.get_secret("github", "api-token") == "token"
+    assert manager.get_secret("gitlab", "password") == "gl pass"
+    assert manager.get_secret("jira", "password") == "jira-pass"
+    assert manager.get_secret("github", "password") == ""
+    assert manager.get_secret(".hidden", "password") == ""
+    assert manager.get_secret("bugzilla", "password") == ""
+
+
+def test_duplicate_service(secrets_dir, caplog):
+    """Test that a service held by several files is read from the same one, with a warning"""
+    write(secrets_dir / "github.env", "api-token=from-env\n")
+
+    manager = LocalManager(str(secrets_dir))
+
+    assert manager.get_secret("github", "api-token") == "from-env"
+    assert "Several entries hold the secrets of github" in caplog.text
+
+    os.remove(secrets_dir / "github.env")
+    manager.refresh()
+    assert manager.get_secret("github", "api-token") == "token"
+
+
+def test_env_file(tmp_path):
+    """Test lookups in an env-file with SERVICE__CREDENTIAL keys"""
+    path = tmp_path / "secrets.env"
+    write(path, "GITHUB__API_TOKEN=token\nGITHUB__USERNAME=user\nIGNORED=1\n")
+    manager = LocalManager(str(path))
+
+    assert manager.get_secret("github", "api-token") == "token"
+    assert manager.get_secret("GitHub", "username") == "user"
+    assert manager.get_secret("ignored", "password") == ""
+
+
+def test_missing_path(tmp_path):
+    """Test that a path that doesn't exist is rejected"""
+    with pytest.raises(FileNotFoundError):
+        LocalManager(str(tmp_path / "missing"))
+
+
+def test_reload_changed_files(secrets_dir):
+    """Test that only the changed files are read again"""
+    manager = LocalManager(str(secrets_dir), check_interval=0)
+
+    write(secrets_dir / "github.json", json.dumps({"username": "new-user"}))
+    write(secrets_dir / "bugzilla.json", json.dumps({"password": "bz"}))
+    os.remove(secrets_dir / "gitlab.env")
+
+    assert sorted(manager.refresh()) == ["bugzilla", "github", "gitlab"]
+    assert manager.get_secret("github", "username") == "new-user"
+    assert manager.get_secret("bugzilla", "password") == "bz"
+    assert manager.get_secret("gitlab", "password") == ""
+    assert manager.refresh() == []
+
+
+def test_check_interval(secrets_dir):
+    """Test that files are not checked again until the interval passed"""
+    manager = LocalManager(str(secrets_dir), check_interval=3600)
+    write(secrets_dir / "github.json", json.dumps({"username": "new-user"}))
+
+    assert manager.get_secret("github", "username") == "user"
+    manager.invalidate("github")
+    assert manager.get_secret("github", "username") == "new-user"
+
+
+def test_invalid_file_keeps_last_value(secrets_dir):
+    """Test that a file being rewritten doesn't drop the service"""
+    manager = LocalManager(str(secrets_dir), check_interval=0)
+    write(secrets_dir / "github.json", '{"username": ')
+
+    assert manager.get_secret("github", "username") == "user"
+    write(secrets_dir / "github.json", json.dumps({"username": "new-user"}))
+    assert manager.get_secret("github", "username") == "new-user"
+
+
+def test_versions(secrets_dir):
+    """Test that versions only change when the credentials do"""
+    manager = LocalManager(str(secrets_dir), check_interval=0)
+    versions = manager.get_versions(["github", "jira", "bugzilla"])
+    assert set(versions) == {"github", "jira"}
+
+    manager.invalidate("github")
+    assert manager.get_versions(["github"]) == {"github": versions["github"]}
+
+    write(secrets_dir / "jira" / "password", "rotated")
+    assert manager.get_versions(["jira"])["jira"] != versions["jira"]
+
+
+def test_get_secret_from_enigma(secrets_dir, monkeypatch):
+    """Test the local backend through get_secret"""
+    monkeypatch.setenv("GRIMOIRELAB_ENIGMA_LOCAL_PATH", str(secrets_dir))
+    SecretsManagerFactory.clear()
+
+    assert enigma.get_secret("local", "github", "api-token") == "token"
+    assert SecretsManagerFactory.get_local_manager() is SecretsManagerFactory.get_local_manager()
+    SecretsManagerFactory.clear()
@@ -0,0 +1,213 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock
+
+from enigma.shared_cache import SharedSecretCache, _load_key
+from enigma.secrets_manager_factory import _cache_for
+
+KEY = "mHjbXhJ0QvBHsmFAGrUqNflKZ0aX7L8W6Yr9B2nKx5g="
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "enigma-cache.db")
+
+
+def test_value_shared_between_caches(path):
+    """Test that a value loaded by one cache is served by another one"""
+    first = SharedSecretCache(path, namespace="aws", key=KEY)
+    second = SharedSecretCache(path, namespace="aws", key=KEY)
+    loader = MagicMock(return_value={"password": "pass"})
+
+    assert first.get("github", lambda: {"password": "pass"}) == {"password": "pass"}
+    assert second.get("github", loader) == {"password": "pass"}
+    loader.assert_not_called()
+
+
+def test_namespaces_isolated(path):
+    """Test that caches of different managers don't see each other's values"""
+    SharedSecretCache(path, namespace="aws", key=KEY).get("github", lambda: "aws")
+
+    assert SharedSecretCache(path, namespace="hashicorp", key=KEY).get("github", lambda: "vault") == "vault"
+
+
+def test_values_encrypted(path):
+    """Test that secrets are not stored in clear in the file"""
+    SharedSecretCache(path, key=KEY).get("github", lambda: {"password": "very-secret"})
+
+    with open(path, "rb") as db:
+        assert b"very-secret" not in db.read()
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_key_file_created(path):
+    """Test that a private key file is created when no key is given"""
+    SharedSecretCache(path).get("github", lambda: "pass")
+
+    assert os.stat(path + ".key").st_mode & 0o777 == 0o600
+    assert SharedSecretCache(path).get("github", MagicMock()) == "pass"
+
+
+def _key_worker(path, barrier, keys):
+    barrier.wait()
+    keys.put(_load_key(path))
+
+
+def test_key_file_created_concurrently(path, monkeypatch):
+    """Test that processes starting at once all read the key that was created"""
+    from cryptography.fernet import Fernet
+    generate_key = Fernet.generate_key
+
+    def slow_generate_key():
+        time.sleep(0.2)
+        return generate_key()
+
+    monkeypatch.delenv("GRIMOIRELAB_ENIGMA_CACHE_KEY", raising=False)
+    monkeypatch.setattr(Fernet, "generate_key", staticmethod(slow_generate_key))
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(8)
+    keys = context.Queue()
+    workers = [context.Process(target=_key_worker, args=(path, barrier, keys)) for _ in range(8)]
+
+    for worker in workers:
+        worker.start()
+    results = [keys.get(timeout=10) for _ in workers]
+    for worker in workers:
+        worker.join(10)
+
+    assert len(set(results)) == 1
+    assert results[0]
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path) + ".key"]
+
+
+def test_wrong_key_not_served(path):
+    """Test that entries encrypted with another key are loaded again"""
+    SharedSecretCache(path, key=KEY).get("github", lambda: "old")
+
+    other_key = "Hx9Mc0bD2lq3O1rfSIYp3eH0wpl6Cf9n5V6TgaJ8m3Q="
+    assert SharedSecretCache(path, key=other_key).get("github", lambda: "new") == "new"
+
+
+def test_expired_value_loaded_again(path):
+    """Test that shared values are not served past their ttl"""
+    SharedSecretCache(path, key=KEY, ttl=0.01).get("github", lambda: "old")
+    time.sleep(0.02)
+
+    assert SharedSecretCache(path, key=KEY).get("github", lambda: "new") == "new"
+
+
+def test_invalidate_removes_shared_value(path):
+    """Test that invalidation reaches the other processes"""
+    first = SharedSecretCache(path, namespace="aws", key=KEY)
+    first.get("github", lambda: "old")
+
+    first.invalidate()
+
+    assert SharedSecretCache(path, namespace="aws", key=KEY).get("github", lambda: "new") == "new"
+
+
+def test_lease_released_on_error(path):
+    """Test that a failed load lets the next process load the value"""
+    cache = SharedSecretCache(path, key=KEY, lease_timeout=5)
+
+    with pytest.raises(RuntimeError):
+        cache.get("github", MagicMock(side_effect=RuntimeError("down")))
+
+    assert cache._acquire_lease("github")
+
+
+def _lease_owners(path):
+    with sqlite3.connect(path) as connection:
+        return [row[0] for row in connection.execute("SELECT owner FROM leases")]
+
+
+def test_lease_kept_after_waiting(path):
+    """Test that a lease taken while waiting for another process is held during the load"""
+    holder = SharedSecretCache(path, key=KEY)
+    owner = holder._acquire_lease("github")
+    cache = SharedSecretCache(path, key=KEY, lease_timeout=5)
+    owners = []
+
+    def loader():
+        owners.extend(_lease_owners(path))
+        return "new"
+
+    threading.Timer(0.1, holder._release_lease, ("github", owner)).start()
+    assert cache.get("github", loader) == "new"
+
+    assert len(owners) == 1 and owners[0] != owner
+    assert owners[0].startswith(f"{os.getpid()}:")
+    assert _lease_owners(path) == []
+
+
+def test_lease_of_others_not_released(path):
+    """Test that a process never releases a lease it doesn't hold"""
+    holder = SharedSecretCache(path, key=KEY, lease_timeout=30)
+    owner = holder._acquire_lease("github")
+    cache = SharedSecretCache(path, key=KEY, lease_timeout=0.1)
+
+    assert cache.get("github", lambda: "new") == "new"
+
+    assert _lease_owners(path) == [owner]
+    assert cache._acquire_lease("github") is None
+
+
+def _worker(path, calls_path, barrier):
+    def loader():
+        with open(calls_path, "a") as calls:
+            calls.write("x")
+        time.sleep(0.2)
+        return {"password": "pass"}
+
+    barrier.wait()
+    assert SharedSecretCache(path, key=KEY).get("github", loader) == {"password": "pass"}
+
+
+def test_one_fetch_per_host(path, tmp_path):
+    """Test that concurrent processes fetch a secret from the backend only once"""
+    calls_path = str(tmp_path / "calls")
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(8)
+    workers = [context.Process(target=_worker, args=(path, calls_path, barrier)) for _ in range(8)]
+    SharedSecretCache(path, key=KEY)
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    with open(calls_path) as calls:
+        assert calls.read() == "x"
+
+
+def test_factory_uses_shared_cache(path, monkeypatch):
+    """Test that the factory shares caches when a path is configured"""
+    monkeypatch.setenv("GRIMOIRELAB_ENIGMA_SHARED_CACHE", path)
+    monkeypatch.setenv("GRIMOIRELAB_ENIGMA_CACHE_KEY", KEY)
+
+    cache = _cache_for(("aws", (), None))
+
+    assert isinstance(cache, SharedSecretCache)
+    assert cache.namespace.startswith("aws:")
+    monkeypatch.delenv("GRIMOIRELAB_ENIGMA_SHARED_CACHE")
+    assert _cache_for(("aws", (), None)) is None
+
+
+def test_factory_namespace_by_identity(path, monkeypatch):
+    """Test that managers with other credentials don't share a namespace"""
+    monkeypatch.setenv("GRIMOIRELAB_ENIGMA_SHARED_CACHE", path)
+    monkeypatch.setenv("GRIMOIRELAB_ENIGMA_CACHE_KEY", KEY)
+
+    first = _cache_for(("hashicorp", "https://vault:8200", "ca.pem", "token", "s.first-token"))
+    second = _cache_for(("hashicorp", "https://vault:8200", "ca.pem", "token", "s.second-token"))
+    again = _cache_for(("hashicorp", "https://vault:8200", "ca.pem", "token", "s.first-token"))
+
+    assert first.namespace != second.namespace
+    assert first.namespace == again.namespace
+    assert "s.first-token" not in first.namespace
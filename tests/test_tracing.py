@@ -0,0 +1,136 @@
+import pytest
+from unittest.mock import patch, MagicMock
+
+from enigma import tracing
+from enigma.aws_manager import AwsManager
+from enigma.tracing import NoopTracer, OpenTelemetryTracer, Span, Tracer
+
+MOCK_SECRET_RESPONSE = {
+    "Name": "test-secret",
+    "SecretString": '{"username": "test_user", "api_key": "test_key"}',
+}
+
+
+class RecordingSpan(Span):
+
+    def __init__(self, records, name, attributes):
+        self.record = {"name": name, "outcome": None}
+        self.record.update(attributes)
+        records.append(self.record)
+
+    def set_attribute(self, key, value):
+        self.record[key] = value
+
+    def set_outcome(self, outcome):
+        self.record["outcome"] = outcome
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.record["outcome"] is None:
+            self.record["outcome"] = tracing.OUTCOME_ERROR if exc_type else tracing.OUTCOME_OK
+        return False
+
+
+class RecordingTracer(Tracer):
+
+    def __init__(self):
+        self.records = []
+
+    def span(self, name, backend=None, service=None):
+        return RecordingSpan(self.records, name, {"backend": backend, "service": service})
+
+
+@pytest.fixture
+def recording_tracer():
+    tracer = RecordingTracer()
+    tracing.set_tracer(tracer)
+    yield tracer
+    tracing.set_tracer(None)
+
+
+def test_default_tracer_is_noop():
+    """Test that spans are discarded by default"""
+    assert isinstance(tracing.get_tracer(), NoopTracer)
+
+    with tracing.get_tracer().span("stage", backend="aws", service="github") as span:
+        span.set_outcome(tracing.OUTCOME_NOT_FOUND)
+
+
+def test_set_tracer_none_restores_noop(recording_tracer):
+    """Test that removing the tracer restores the no-op one"""
+    tracing.set_tracer(None)
+    assert isinstance(tracing.get_tracer(), NoopTracer)
+
+
+def test_aws_stages_traced(recording_tracer):
+    """Test that every AWS stage is reported without the secret value"""
+    with patch('enigma.aws_manager.get_shared_client') as mock_get_client:
+        mock_client = MagicMock()
+        mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
+        mock_get_client.return_value = mock_client
+
+        manager = AwsManager()
+        assert manager.get_secret("test-secret", "api_key") == "test_key"
+
+    names = [record["name"] for record in recording_tracer.records]
+    assert names == ["aws.login", "aws.get_secret", "aws.fetch", "aws.parse"]
+    for record in recording_tracer.records:
+        assert record["backend"] == "aws"
+        assert record["outcome"] == tracing.OUTCOME_OK
+        assert "test_key" not in record.values()
+
+
+def test_aws_not_found_outcome(recording_tracer):
+    """Test that a missing credential is reported as not found"""
+    with patch('enigma.aws_manager.get_shared_client') as mock_get_client:
+        mock_client = MagicMock()
+        mock_client.get_secret_value.return_value = MOCK_SECRET_RESPONSE
+        mock_get_client.return_value = mock_client
+
+        manager = AwsManager()
+        assert manager.get_secret("test-secret", "missing") == ""
+
+    record = recording_tracer.records[1]
+    assert record["name"] == "aws.get_secret"
+    assert record["service"] == "test-secret"
+    assert record["outcome"] == tracing.OUTCOME_NOT_FOUND
+
+
+def test_aws_error_outcome(recording_tracer):
+    """Test that a failing stage is reported as an error"""
+    with patch('enigma.aws_manager.get_shared_client') as mock_get_client:
+        mock_client = MagicMock()
+        mock_client.get_secret_value.side_effect = RuntimeError("boom")
+        mock_get_client.return_value = mock_client
+
+        manager = AwsManager()
+        with pytest.raises(RuntimeError):
+            manager.get_secret("test-secret", "api_key")
+
+    outcomes = {record["name"]: record["outcome"] for record in recording_tracer.records}
+    assert outcomes["aws.fetch"] == tracing.OUTCOME_ERROR
+    assert outcomes["aws.get_secret"] == tracing.OUTCOME_ERROR
+
+
+def test_opentelemetry_tracer():
+    """Test that spans are exported through OpenTelemetry"""
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    export = pytest.importorskip("opentelemetry.sdk.trace.export")
+    in_memory = pytest.importorskip("opentelemetry.sdk.trace.export.in_memory_span_exporter")
+
+    exporter = in_memory.InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(export.SimpleSpanProcessor(exporter))
+    tracer = OpenTelemetryTracer(provider.get_tracer("enigma"))
+
+    with tracer.span("aws.fetch", backend="aws", service="github"):
+        pass
+    with pytest.raises(ValueError):
+        with tracer.span("aws.parse", backend="aws", service="github"):
+            raise ValueError("invalid json")
+
+    fetch, parse = exporter.get_finished_spans()
+    assert fetch.name == "aws.fetch"
+    assert fetch.attributes["enigma.backend"] == "aws"
+    assert fetch.attributes["enigma.service"] == "github"
+    assert fetch.attributes["enigma.outcome"] == tracing.OUTCOME_OK
+    assert parse.attributes["enigma.outcome"] == tracing.OUTCOME_ERROR
@@ -0,0 +1,114 @@
+import datetime
+import threading
+from unittest.mock import patch, MagicMock
+import hvac.exceptions
+
+import enigma
+from enigma.aws_manager import AwsManager
+from enigma.bw_catalog import BitwardenCatalog
+from enigma.bw_manager import BitwardenManager
+from enigma.cache import SecretCache
+from enigma.hc_manager import HashicorpManager
+from enigma.watcher import Watcher
+
+
+def make_manager(*versions):
+    manager = MagicMock()
+    manager.get_versions.side_effect = list(versions)
+    return manager
+
+
+def test_first_poll_records_versions():
+    """Test that nothing is reported before versions are known"""
+    manager = make_manager({"github": 1})
+    callback = MagicMock()
+
+    assert Watcher(manager, ["github"], callback).poll() == []
+    callback.assert_not_called()
+
+
+def test_rotation_invalidates_and_notifies():
+    """Test that rotated secrets are invalidated and reported"""
+    manager = make_manager({"github": 1, "gitlab": 1}, {"github": 2, "gitlab": 1}, {"gitlab": 1})
+    callback = MagicMock()
+    watcher = Watcher(manager, ["github", "gitlab"], callback)
+
+    watcher.poll()
+    assert watcher.poll() == ["github"]
+    manager.invalidate.assert_called_once_with("github")
+    callback.assert_called_once_with("github")
+
+    # Deleted secrets are reported too
+    assert watcher.poll() == ["github"]
+
+
+def test_callback_errors_contained():
+    """Test that a failing callback doesn't stop the other notifications"""
+    manager = make_manager({"github": 1, "gitlab": 1}, {"github": 2, "gitlab": 2})
+    callback = MagicMock(side_effect=[RuntimeError("boom"), None])
+    watcher = Watcher(manager, ["github", "gitlab"], callback)
+
+    watcher.poll()
+    assert watcher.poll() == ["github", "gitlab"]
+    assert callback.call_count == 2
+
+
+def test_watch_runs_in_background():
+    """Test that watch polls until stopped"""
+    rotated = threading.Event()
+    manager = MagicMock()
+    manager.get_versions.side_effect = lambda services: {"github": manager.get_versions.call_count}
+
+    watcher = enigma.watch(manager, ["github"], lambda service: rotated.set(), interval=0.01)
+    try:
+        assert rotated.wait(1)
+    finally:
+        watcher.stop()
+
+
+def test_aws_versions():
+    """Test that AWS versions come from batched list_secrets calls"""
+    with patch("enigma.aws_manager.get_shared_client") as get_client:
+        client = get_client.return_value
+        manager = AwsManager()
+    changed = datetime.datetime(2024, 1, 1)
+    client.get_paginator.return_value.paginate.return_value = [
+        {"SecretList": [{"Name": "github", "LastChangedDate": changed},
+                        {"Name": "github-old", "LastChangedDate": changed}]},
+    ]
+    services = [f"service-{number}" for number in range(11)] + ["github"]
+
+    versions = manager.get_versions(services)
+
+    assert versions == {"github": changed}
+    paginate = client.get_paginator.return_value.paginate
+    assert paginate.call_count == 2
+    assert paginate.call_args[1]["Filters"] == [{"Key": "name", "Values": ["service-10", "github"]}]
+
+
+def test_hashicorp_versions():
+    """Test that Vault versions come from the KV v2 metadata"""
+    client = MagicMock()
+    client.auth.token.lookup_self.return_value = {"data": {"ttl": 0, "renewable": False}}
+    client.secrets.kv.v2.read_secret_metadata.side_effect = [
+        {"data": {"current_version": 3}},
+        hvac.exceptions.InvalidPath(),
+    ]
+    with patch("hvac.Client", return_value=client):
+        manager = HashicorpManager("http://vault-url", "test-token", "test-certificate")
+
+    assert manager.get_versions(["github", "missing"]) == {"github": 3}
+
+
+def test_bitwarden_invalidate():
+    """Test that invalidating a Bitwarden item drops it from the cache"""
+    with patch("subprocess.run"):
+        manager = BitwardenManager("test@example.com", "password", cache=SecretCache())
+    manager.last_sync_time = datetime.datetime.now()
+    manager._catalog_time = manager.last_sync_time
+    manager.catalog = BitwardenCatalog([{"id": "1", "name": "GitHub", "revisionDate": "2024-01-01"}])
+    manager.cache.put("GitHub", {"name": "GitHub", "login": {"password": "old"}})
+
+    assert manager.get_versions(["GitHub", "missing"]) == {"GitHub": "2024-01-01"}
+    manager.invalidate("GitHub")
+    assert "GitHub" not in manager.cache